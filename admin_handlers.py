@@ -1,21 +1,25 @@
 # admin_handlers.py - обработчики для админ-панели
+import functools
 import logging
-import os
 import pyotp
-import shutil
 from pathlib import Path
 from datetime import datetime, timedelta
+from io import BytesIO
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext, ConversationHandler
 from config import Config
+import aiofs
 import database
+import order_session
+import profiler
 import utils
 from keyboards import (
     get_admin_main_keyboard,
     get_admin_order_actions_keyboard,
     get_admin_orders_navigation_keyboard,
     get_admin_all_orders_keyboard,
-    get_student_confirmation_keyboard
+    get_student_confirmation_keyboard,
+    get_history_keyboard
 )
 
 logger = logging.getLogger(__name__)
@@ -161,7 +165,7 @@ async def admin_view_all_orders(update: Update, context: CallbackContext):
     database.log_admin_action(update.effective_user.id, "view_all_orders")
 
     # Получаем все заказы
-    orders = database.get_all_orders()
+    orders = await database.read(database.get_all_orders)
 
     if not orders:
         await query.edit_message_text(
@@ -244,7 +248,7 @@ async def admin_orders_by_status(update: Update, context: CallbackContext):
     context.user_data['orders_page'] = 0
 
     # Получаем заказы по статусу
-    orders = get_orders_by_status(status)
+    orders = await database.read(get_orders_by_status, status)
 
     if not orders:
         await query.edit_message_text(
@@ -307,7 +311,7 @@ async def admin_handle_orders_navigation(update: Update, context: CallbackContex
     context.user_data['orders_page'] = page
 
     # Получаем заказы по статусу
-    orders = get_orders_by_status(status)
+    orders = await database.read(get_orders_by_status, status)
 
     if not orders:
         await query.edit_message_text(
@@ -410,11 +414,10 @@ async def admin_order_details(update: Update, context: CallbackContext):
     if order.get('files'):
         try:
             user_id = order.get('user_id')
-            order_folder = utils.create_order_folder(order_id, user_id)
-
-            if order_folder and order_folder.exists():
-                files = list(order_folder.glob('*'))
+            order_folder = utils.get_order_folder(order_id, user_id)
+            files = await aiofs.list_files(order_folder)
 
+            if files:
                 # Если файлов больше одного, отправляем архив
                 if len(files) > 1:
                     from utils import send_files_as_archive
@@ -425,15 +428,14 @@ async def admin_order_details(update: Update, context: CallbackContext):
                 else:
                     # Отправляем файлы по одному
                     for file in files:
-                        if file.is_file():
-                            try:
-                                await context.bot.send_document(
-                                    chat_id=query.message.chat_id,
-                                    document=open(file, 'rb'),
-                                    caption=f"Файл из заказа #{order_id}: {file.name}"
-                                )
-                            except Exception as e:
-                                logger.error(f"Ошибка отправки файла {file.name}: {e}")
+                        try:
+                            await context.bot.send_document(
+                                chat_id=query.message.chat_id,
+                                document=await utils.upload_source(file),
+                                caption=f"Файл из заказа #{order_id}: {file.name}"
+                            )
+                        except Exception as e:
+                            logger.error(f"Ошибка отправки файла {file.name}: {e}")
         except Exception as e:
             logger.error(f"Ошибка получения файлов заказа: {e}")
             await query.message.reply_text("❌ Ошибка при получении файлов заказа.")
@@ -441,14 +443,61 @@ async def admin_order_details(update: Update, context: CallbackContext):
     return ADMIN_ORDER_DETAILS
 
 
+async def admin_start_message(update: Update, context: CallbackContext):
+    """Запрос сообщения для студента"""
+    query = update.callback_query
+    await query.answer()
+
+    order_id = query.data.replace('admin_send_msg_', '')
+    context.user_data['current_order_id'] = order_id
+
+    await query.edit_message_text(
+        f"💬 Сообщение студенту по заказу #{order_id}\n\n"
+        "Отправьте текст, голосовое, фото, видео или документ:",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔙 Назад", callback_data=f"admin_order_{order_id}")]
+        ])
+    )
+
+    return ADMIN_SEND_MESSAGE
+
+
+async def _relay_to_student(update: Update, context: CallbackContext, order):
+    """Пересылка сообщения администратора студенту с записью в историю"""
+    order_id = order['order_id']
+    try:
+        message_type, file_id, history_text, sent_id = await utils.relay_message(
+            context.bot, update.message, order.get('user_id'),
+            f"📩 Сообщение от эксперта по заказу #{order_id}"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка отправки сообщения студенту: {e}")
+        await update.message.reply_text(
+            "❌ Не удалось отправить сообщение студенту. Возможно, он заблокировал бота.",
+            reply_markup=get_admin_order_actions_keyboard(order_id)
+        )
+        return False
+
+    # Ответ студента на это сообщение попадет к администратору
+    utils.remember_relay(context, order.get('user_id'), sent_id, order_id)
+    database.queue_message_to_history(order_id, "admin", history_text, message_type, file_id)
+    database.log_admin_action(update.effective_user.id, f"send_message_{order_id}", order_id)
+    return True
+
+
 async def admin_handle_message(update: Update, context: CallbackContext):
-    """Обработка ввода сообщения для студента"""
+    """Обработка ввода сообщения для студента
+
+    Текст отправляется с заголовком, голосовые, фото, видео и документы
+    пересылаются через copy_message без загрузки на диск.
+    """
     # Проверяем, есть ли сообщение в update
     if not update.message:
         await update.callback_query.answer("Ошибка: сообщение не найдено.")
         return ADMIN_ORDER_DETAILS
 
-    order_id = context.user_data.get('current_order_id')
+    # Ответ на пересланное сообщение студента относится к его заказу
+    order_id = utils.get_relayed_order(context, update.message) or context.user_data.get('current_order_id')
 
     if not order_id:
         await update.message.reply_text("Ошибка: не выбран заказ.")
@@ -461,58 +510,48 @@ async def admin_handle_message(update: Update, context: CallbackContext):
         await update.message.reply_text("Заказ не найден.")
         return ADMIN_VIEW_ORDERS
 
-    message_text = ""
-
-    # Обрабатываем текстовые сообщения
-    if update.message.text:
-        message_text = update.message.text
-    # Обрабатываем голосовые сообщения
-    elif update.message.voice:
-        voice = update.message.voice
-        voice_file = await voice.get_file()
-        # Сохраняем голосовое сообщение
-        voice_path = f"voices/{order_id}_{voice.file_id}.ogg"
-        os.makedirs(os.path.dirname(voice_path), exist_ok=True)
-        await voice_file.download_to_drive(voice_path)
-        message_text = "🎤 Голосовое сообщение"
-
-        # Отправляем голосовое сообщение студенту
-        try:
-            await context.bot.send_voice(
-                chat_id=order.get('user_id'),
-                voice=open(voice_path, 'rb'),
-                caption=f"Голосовое сообщение по заказу #{order_id}"
-            )
-        except Exception as e:
-            logger.error(f"Ошибка отправки голосового сообщения: {e}")
-            await update.message.reply_text("❌ Не удалось отправить голосовое сообщение.")
-            return ADMIN_ORDER_DETAILS
+    if await _relay_to_student(update, context, order):
+        await update.message.reply_text(
+            f"✅ Сообщение отправлено студенту @{order.get('username', 'Не указано')}.",
+            reply_markup=get_admin_order_actions_keyboard(order_id)
+        )
 
-    if message_text:
-        # Отправляем текстовое сообщение студенту
-        try:
-            await context.bot.send_message(
-                chat_id=order.get('user_id'),
-                text=f"📩 Сообщение от эксперта по заказу #{order_id}:\n\n{message_text}"
-            )
+    return ADMIN_ORDER_DETAILS
 
-            # Сохраняем сообщение в историю
-            database.save_message_to_history(order_id, "admin", message_text)
 
-            # Логируем действие
-            database.log_admin_action(update.effective_user.id, f"send_message_{order_id}", order_id)
+async def admin_reply_relay(update: Update, context: CallbackContext):
+    """Ответ администратора на пересланное сообщение студента вне диалога"""
+    order_id = utils.get_relayed_order(context, update.message)
+    if not order_id:
+        return
 
-            await update.message.reply_text(
-                f"✅ Сообщение отправлено студенту @{order.get('username', 'Не указано')}.",
-                reply_markup=get_admin_order_actions_keyboard(order_id)
-            )
+    order = database.get_order_details(order_id)
+    if not order:
+        await update.message.reply_text("Заказ не найден.")
+        return
 
-        except Exception as e:
-            logger.error(f"Ошибка отправки сообщения студенту: {e}")
-            await update.message.reply_text(
-                "❌ Не удалось отправить сообщение студенту. Возможно, он заблокировал бота.",
-                reply_markup=get_admin_order_actions_keyboard(order_id)
-            )
+    if await _relay_to_student(update, context, order):
+        await update.message.reply_text(f"✅ Ответ по заказу #{order_id} отправлен студенту.")
+
+
+async def admin_view_history(update: Update, context: CallbackContext):
+    """Постраничный просмотр истории переписки по заказу"""
+    query = update.callback_query
+    await query.answer()
+
+    # Формат: admin_history_<order_id>[_<id самого старого показанного сообщения>]
+    order_id, _, before_id = query.data.replace('admin_history_', '').partition('_')
+    before_id = int(before_id) if before_id.isdigit() else None
+    context.user_data['current_order_id'] = order_id
+
+    # Не через database.read: страница сначала дописывает очередь истории, а она меняется только в цикле событий
+    messages, has_older = database.get_message_history_page(order_id, before_id, Config.HISTORY_PAGE_SIZE)
+    oldest_id = messages[-1]['id'] if messages else None
+
+    await query.edit_message_text(
+        utils.format_history_page(order_id, messages, has_older),
+        reply_markup=get_history_keyboard(order_id, oldest_id, has_older, is_first_page=before_id is None)
+    )
 
     return ADMIN_ORDER_DETAILS
 
@@ -784,6 +823,7 @@ async def admin_force_set_price(update: Update, context: CallbackContext):
     return ADMIN_SET_PRICE
 
 
+@order_session.unit_of_work
 async def admin_handle_force_price(update: Update, context: CallbackContext):
     """Обработка принудительной установки цены"""
     try:
@@ -805,11 +845,14 @@ async def admin_handle_force_price(update: Update, context: CallbackContext):
             await update.message.reply_text("Неверный формат цены. Введите число:")
             return ADMIN_SET_PRICE
 
-        # Обновляем цену в базе данных
-        database.update_order_price(order_id, price)
+        # Обновляем цену заказа
+        order_session.update_order(order_id, final_amount=price)
 
         # Получаем информацию о заказе
-        order = database.get_order_details(order_id)
+        order = await order_session.get_order(order_id)
+
+        # Студент может нажать кнопку сразу: цена должна быть уже записана
+        order_session.flush()
 
         # Отправляем сообщение студенту
         student_message = (
@@ -860,6 +903,9 @@ async def admin_upload_work(update: Update, context: CallbackContext):
         await query.edit_message_text("Заказ не найден.")
         return ADMIN_VIEW_ORDERS
 
+    # Каждый файл приходит отдельным обновлением: владелец заказа запоминается один раз
+    context.user_data['current_order_user_id'] = order.get('user_id')
+
     await query.edit_message_text(
         f"📤 Загрузите файлы выполненной работы для заказа #{order_id}.\n\n"
         f"После загрузки всех файлов отправьте команду /done."
@@ -876,49 +922,63 @@ async def admin_handle_completed_file(update: Update, context: CallbackContext):
         await update.message.reply_text("Ошибка: не выбран заказ.")
         return ADMIN_MAIN
 
-    # Получаем информацию о заказе
-    order = database.get_order_details(order_id)
+    # Владелец заказа (запомнен в начале загрузки)
+    user_id = context.user_data.get('current_order_user_id')
+    if user_id is None:
+        order = await order_session.get_order(order_id)
 
-    if not order:
-        await update.message.reply_text("Заказ не найден.")
-        return ADMIN_VIEW_ORDERS
+        if not order:
+            await update.message.reply_text("Заказ не найден.")
+            return ADMIN_VIEW_ORDERS
+
+        user_id = context.user_data['current_order_user_id'] = order.get('user_id')
 
     # Создаем папку для выполненной работы
-    completed_folder = utils.create_order_folder(order_id, order.get('user_id'), "completed")
+    completed_folder = utils.create_order_folder(order_id, user_id, "completed")
 
     if not completed_folder:
         await update.message.reply_text("Ошибка создания папки для файлов.")
         return ADMIN_UPLOAD_WORK
 
-    # Сохраняем файл
-    file = None
-    file_path = None
+    file = utils.get_message_file(update.message)
 
-    if update.message.document:
-        file = update.message.document
-    elif update.message.photo:
-        file = update.message.photo[-1]  # Берем самое большое фото
-
-    if file:
-        file_path = await utils.save_file(file, completed_folder)
-
-    if file_path:
-        # Добавляем файл в список
-        if 'completed_files' not in context.user_data:
-            context.user_data['completed_files'] = []
+    if not file:
+        await update.message.reply_text("❌ Не удалось сохранить файл. Попробуйте еще раз.")
+        return ADMIN_UPLOAD_WORK
 
-        context.user_data['completed_files'].append(file_path)
+    completed_files = context.user_data.setdefault('completed_files', [])
 
-        await update.message.reply_text(
-            f"✅ Файл сохранен. Загружено файлов: {len(context.user_data['completed_files'])}\n\n"
-            f"Продолжайте загрузку или отправьте /done для завершения."
+    if update.message.media_group_id:
+        # Файлы альбома сохраняются одной пачкой после окончания сбора
+        utils.collect_media_group(
+            update.message, context, file,
+            functools.partial(_store_completed_files, completed_folder=completed_folder,
+                              completed_files=completed_files)
         )
     else:
-        await update.message.reply_text("❌ Не удалось сохранить файл. Попробуйте еще раз.")
+        await _store_completed_files(update.message, [file], completed_folder, completed_files)
 
     return ADMIN_UPLOAD_WORK
 
 
+async def _store_completed_files(message, files, completed_folder, completed_files):
+    """Сохранение пачки файлов выполненной работы с одним итоговым ответом"""
+    # Для готовых работ проверяется только размер: эксперт может загружать любые форматы
+    saved, rejected, status_message = await utils.save_files_batch(
+        message, files, completed_folder, check_type=False
+    )
+
+    # Добавляем файлы в список
+    completed_files.extend(saved)
+
+    text = utils.format_upload_result(
+        len(saved), len(files), rejected, len(completed_files),
+        "Продолжайте загрузку или отправьте /done для завершения."
+    )
+    await utils.send_upload_summary(message, status_message, text)
+
+
+@order_session.unit_of_work
 async def admin_finish_upload_work(update: Update, context: CallbackContext):
     """Завершение загрузки выполненных работ"""
     order_id = context.user_data.get('current_order_id')
@@ -927,6 +987,9 @@ async def admin_finish_upload_work(update: Update, context: CallbackContext):
         await update.message.reply_text("Ошибка: не выбран заказ.")
         return ADMIN_MAIN
 
+    # Дожидаемся сохранения альбомов, отправленных перед /done
+    await utils.wait_media_groups(update.effective_chat.id)
+
     # Получаем список загруженных файлов
     completed_files = context.user_data.get('completed_files', [])
 
@@ -934,14 +997,15 @@ async def admin_finish_upload_work(update: Update, context: CallbackContext):
         await update.message.reply_text("Не загружено ни одного файла.")
         return ADMIN_UPLOAD_WORK
 
-    # Сохраняем информацию о файлах в базе
-    database.update_order_completed_files(order_id, completed_files)
-
-    # Обновляем статус заказа
-    database.update_order_status(order_id, 'work_uploaded')
+    # Сохраняем информацию о файлах и статус заказа
+    order_session.set_completed_files(order_id, completed_files)
+    order_session.set_status(order_id, 'work_uploaded')
 
     # Получаем информацию о заказе
-    order = database.get_order_details(order_id)
+    order = await order_session.get_order(order_id)
+
+    # Студент может ответить сразу после уведомления
+    order_session.flush()
 
     # Отправляем уведомление студенту
     student_message = (
@@ -980,12 +1044,13 @@ async def admin_finish_upload_work(update: Update, context: CallbackContext):
     )
 
     # Очищаем временные данные
-    if 'completed_files' in context.user_data:
-        del context.user_data['completed_files']
+    context.user_data.pop('completed_files', None)
+    context.user_data.pop('current_order_user_id', None)
 
     return ADMIN_ORDER_DETAILS
 
 
+@order_session.unit_of_work
 async def admin_complete_order(update: Update, context: CallbackContext):
     """Завершение заказа администратором"""
     query = update.callback_query
@@ -994,10 +1059,11 @@ async def admin_complete_order(update: Update, context: CallbackContext):
     order_id = query.data.replace('admin_complete_', '')
 
     # Обновляем статус заказа (теперь с записью времени завершения)
-    database.update_order_status(order_id, 'completed')
+    order_session.set_status(order_id, 'completed')
 
     # Получаем информацию о заказе
-    order = database.get_order_details(order_id)
+    order = await order_session.get_order(order_id)
+    order_session.flush()
 
     if order:
         # Отправляем уведомление студенту
@@ -1034,15 +1100,7 @@ async def admin_delete_order_completely(update: Update, context: CallbackContext
     # Удаляем файлы заказа
     user_id = order.get('user_id')
 
-    # Удаляем папку с загруженными файлами
-    upload_folder = utils.create_order_folder(order_id, user_id, "uploads")
-    if upload_folder and upload_folder.exists():
-        shutil.rmtree(upload_folder)
-
-    # Удаляем папку с выполненной работой
-    completed_folder = utils.create_order_folder(order_id, user_id, "completed")
-    if completed_folder and completed_folder.exists():
-        shutil.rmtree(completed_folder)
+    await utils.delete_order_files(order_id, user_id)
 
     # Удаляем запись из базы данных
     database.delete_order(order_id)
@@ -1101,4 +1159,69 @@ def get_orders_by_status(status):
         logger.error(f"Ошибка получения заказов по статусу: {e}")
         return []
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+
+async def admin_profile(update: Update, context: CallbackContext):
+    """Выгрузка результатов профилирования: /profile или /profile reset"""
+    if update.effective_user.id != Config.ADMIN_ID:
+        return
+
+    if not profiler.is_enabled():
+        await update.message.reply_text("Профилирование выключено (PROFILE_SAMPLE_RATE=0).")
+        return
+
+    if context.args and context.args[0] == 'reset':
+        profiler.reset()
+        await update.message.reply_text("🧹 Результаты профилирования сброшены.")
+        return
+
+    stacks = profiler.collapsed_stacks()
+    if not stacks:
+        await update.message.reply_text("Пока нет данных профилирования.")
+        return
+
+    lines = ["🔥 Обработчики по времени в цикле событий (снимки / профилированные вызовы):\n"]
+    for name, samples, calls in profiler.summary():
+        lines.append(f"{name}: {samples} / {calls}")
+
+    await update.message.reply_document(
+        document=BytesIO(stacks.encode('utf-8')),
+        filename=f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.folded",
+        caption="\n".join(lines)[:1024]
+    )
+
+
+async def admin_slow_queries(update: Update, context: CallbackContext):
+    """Самые затратные запросы к БД: /slowqueries или /slowqueries reset"""
+    if update.effective_user.id != Config.ADMIN_ID:
+        return
+
+    if not Config.SLOW_QUERY_MS:
+        await update.message.reply_text("Журнал медленных запросов выключен (SLOW_QUERY_MS=0).")
+        return
+
+    if context.args and context.args[0] == 'reset':
+        database.clear_slow_queries()
+        await update.message.reply_text("🧹 Журнал медленных запросов очищен.")
+        return
+
+    queries = database.get_slow_query_summary()
+    if not queries:
+        await update.message.reply_text(f"Запросов дольше {Config.SLOW_QUERY_MS:g} мс не было.")
+        return
+
+    report = [f"🐢 Медленные запросы (порог {Config.SLOW_QUERY_MS:g} мс), по суммарному времени:\n"]
+    for query in queries:
+        # SCAN в плане - полный просмотр таблицы без подходящего индекса
+        scan = " ⚠️ SCAN" if "SCAN" in (query['plan'] or "") else ""
+        report.append(
+            f"{query['function']}: {query['count']} раз, среднее {query['avg_ms']:.0f} мс, "
+            f"максимум {query['max_ms']:.0f} мс, строк до {query['max_rows']}{scan}\n"
+            f"{query['sql'][:300]}\n"
+            f"План: {(query['plan'] or '-').replace(chr(10), '; ')}\n"
+        )
+
+    text = "\n".join(report)
+    for start in range(0, len(text), Config.MAX_MESSAGE_LENGTH):
+        await update.message.reply_text(text[start:start + Config.MAX_MESSAGE_LENGTH])
@@ -0,0 +1,76 @@
+# aiofs.py - файловые операции вне цикла событий
+import asyncio
+import functools
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from config import Config
+
+# Отдельный ограниченный пул, чтобы работа с диском не занимала общий пул asyncio
+_executor = ThreadPoolExecutor(max_workers=Config.FS_WORKERS, thread_name_prefix="aiofs")
+
+
+async def run(func, *args, **kwargs):
+    """Выполнение блокирующей функции в пуле файловых операций"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+async def exists(path):
+    """Проверка существования пути"""
+    return await run(os.path.exists, path)
+
+
+async def is_dir(path):
+    """Проверка, что путь - существующая папка"""
+    return await run(os.path.isdir, path)
+
+
+def _list_files(folder, pattern):
+    folder = Path(folder)
+    if not folder.is_dir():
+        return []
+    return sorted(path for path in folder.glob(pattern) if path.is_file())
+
+
+async def list_files(folder, pattern='*'):
+    """Список файлов в папке (пустой, если папки нет)"""
+    return await run(_list_files, folder, pattern)
+
+
+def _rmtree(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+        return True
+    return False
+
+
+async def rmtree(path):
+    """Рекурсивное удаление папки, если она существует"""
+    return await run(_rmtree, path)
+
+
+async def unlink(path):
+    """Удаление файла, если он существует"""
+    return await run(Path(path).unlink, missing_ok=True)
+
+
+async def read_bytes(path):
+    """Содержимое файла"""
+    return await run(Path(path).read_bytes)
+
+
+async def sorted_by_mtime(paths):
+    """Пути, отсортированные по времени изменения (от старых к новым)"""
+    return await run(sorted, paths, key=os.path.getmtime)
+
+
+async def copy2(source, destination):
+    """Копирование файла с метаданными"""
+    return await run(shutil.copy2, source, destination)
+
+
+async def mkdir(path):
+    """Создание папки вместе с родительскими"""
+    return await run(Path(path).mkdir, exist_ok=True, parents=True)
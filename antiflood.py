@@ -0,0 +1,143 @@
+# antiflood.py - ограничение частоты запросов пользователя до обработчиков
+#
+# У каждого пользователя корзина на FLOOD_BURST запросов, которая пополняется
+# со скоростью FLOOD_RATE в секунду. Запрос без свободного места отбрасывается
+# до обработчиков и БД; о превышении пользователь узнает один раз. Кто продолжает
+# слать запросы, блокируется на FLOOD_BAN_SECONDS. Администратор не ограничивается.
+# Обновления, накопившиеся за простой, не ограничиваются: их частоту задает
+# скорость догрузки (catchup), а не пользователь.
+import logging
+import time
+from collections import deque
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import Application, ApplicationHandlerStop, CallbackContext, TypeHandler
+from config import Config
+import catchup
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FLOOD_DROPPED = metrics.Counter("bot_antiflood_dropped_total", "Обновления, отброшенные ограничением частоты",
+                                labels=("reason",))
+FLOOD_BANS = metrics.Counter("bot_antiflood_bans_total", "Временные блокировки пользователей за флуд")
+
+NOTICE_TEXT = "⏳ Слишком много запросов. Подождите немного и попробуйте снова."
+
+# Окно (в секундах), в котором считаются отброшенные запросы для блокировки
+BAN_WINDOW = 60
+# Корзины без запросов дольше этого времени (в секундах) удаляются
+IDLE_TTL = 600
+
+
+class TokenBucket:
+    """Корзина токенов: burst запросов сразу, дальше rate запросов в секунду"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated", "notified", "drops")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+        self.notified = False
+        self.drops = deque()
+
+    def take(self, now):
+        """Списание токена; False, если корзина пуста"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+_buckets = {}
+# user_id -> время окончания блокировки (time.monotonic)
+_banned = {}
+_last_prune = 0.0
+
+metrics.gauge("bot_antiflood_banned_users", "Пользователи, временно заблокированные за флуд",
+              lambda: sum(1 for until in list(_banned.values()) if until > time.monotonic()))
+
+
+def _prune(now):
+    """Удаление давно неактивных корзин и истекших блокировок"""
+    global _last_prune
+    if now - _last_prune < IDLE_TTL:
+        return
+    _last_prune = now
+    for user_id in [user_id for user_id, bucket in _buckets.items() if now - bucket.updated > IDLE_TTL]:
+        del _buckets[user_id]
+    for user_id in [user_id for user_id, until in _banned.items() if until <= now]:
+        del _banned[user_id]
+
+
+def is_banned(user_id, now=None):
+    now = now or time.monotonic()
+    return _banned.get(user_id, 0) > now
+
+
+def allow(user_id, now=None):
+    """Решение по запросу пользователя: (пропустить, причина отказа, уведомить)"""
+    now = now or time.monotonic()
+    _prune(now)
+    if is_banned(user_id, now):
+        return False, "banned", False
+
+    bucket = _buckets.get(user_id)
+    if bucket is None:
+        bucket = _buckets[user_id] = TokenBucket(Config.FLOOD_RATE, Config.FLOOD_BURST, now)
+    if bucket.take(now):
+        bucket.notified = False
+        return True, None, False
+
+    bucket.drops.append(now)
+    while bucket.drops and now - bucket.drops[0] > BAN_WINDOW:
+        bucket.drops.popleft()
+    if Config.FLOOD_BAN_THRESHOLD and len(bucket.drops) >= Config.FLOOD_BAN_THRESHOLD:
+        _banned[user_id] = now + Config.FLOOD_BAN_SECONDS
+        bucket.drops.clear()
+        FLOOD_BANS.inc()
+        logger.warning(f"Пользователь {user_id} заблокирован за флуд на {Config.FLOOD_BAN_SECONDS} с")
+        return False, "banned", False
+
+    notify = not bucket.notified
+    bucket.notified = True
+    return False, "rate", notify
+
+
+async def check_flood(update: Update, context: CallbackContext):
+    """Отбрасывание лишних обновлений до остальных обработчиков"""
+    user = update.effective_user
+    if user is None or user.id == Config.ADMIN_ID:
+        return
+    # Догрузка разбирает за секунды запросы, сделанные за весь простой
+    if catchup.is_running():
+        return
+    # Альбом приходит пачкой до 10 обновлений сразу; его размер ограничивает сам Telegram
+    if update.effective_message and update.effective_message.media_group_id:
+        return
+
+    allowed, reason, notify = allow(user.id)
+    if allowed:
+        return
+
+    FLOOD_DROPPED.inc(reason)
+    if notify:
+        try:
+            if update.callback_query:
+                await update.callback_query.answer(NOTICE_TEXT)
+            elif update.effective_message:
+                await update.effective_message.reply_text(NOTICE_TEXT)
+        except TelegramError as e:
+            logger.debug(f"Не удалось предупредить пользователя {user.id} о флуде: {e}")
+    raise ApplicationHandlerStop
+
+
+def attach(application: Application):
+    """Ограничение частоты перед всеми обработчиками (FLOOD_RATE=0 отключает его)"""
+    if Config.FLOOD_RATE <= 0:
+        return
+    application.add_handler(TypeHandler(Update, check_flood), group=-1)
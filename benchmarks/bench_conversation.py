@@ -0,0 +1,224 @@
+# bench_conversation.py - сквозной бенчмарк диалога создания и выполнения заказа
+#
+# Настоящие диалоги из main.py прогоняются синтетическими обновлениями
+# через имитацию Bot API (без сети). N студентов одновременно создают заказы,
+# администратор по очереди назначает цену, загружает работу и завершает заказ.
+#
+#   python benchmarks/bench_conversation.py --students 50 --output conversation.json
+import argparse
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from datetime import datetime, timedelta
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+from fake_telegram import FakeTelegram, FakeBotRequest, UpdateFactory  # noqa: E402
+
+
+def percentile(values, percent):
+    """Перцентиль по отсортированному списку (ближайший ранг)"""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, round(percent / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def latency_summary(samples):
+    values = sorted(samples)
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+        "mean_ms": round(statistics.fmean(values) * 1000, 3) if values else 0.0,
+    }
+
+
+class DatabaseTimer:
+    """Время в функциях database.py; вложенные вызовы не учитываются повторно"""
+
+    def __init__(self, module):
+        self.total = 0.0
+        self.calls = 0
+        self._depth = threading.local()
+        for name, func in list(vars(module).items()):
+            # database.read только передает вызовы в пул потоков: время считается в самих функциях
+            if inspect.iscoroutinefunction(func):
+                continue
+            if not name.startswith('_') and inspect.isfunction(func) and func.__module__ == module.__name__:
+                setattr(module, name, self._wrap(func))
+
+    def _wrap(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            depth = getattr(self._depth, 'value', 0)
+            self._depth.value = depth + 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._depth.value = depth
+                if depth == 0:
+                    self.total += time.perf_counter() - start
+                    self.calls += 1
+        return wrapper
+
+
+class Benchmark:
+    def __init__(self, application, factory, admin_id):
+        self.application = application
+        self.factory = factory
+        self.admin_id = admin_id
+        self.latencies = []
+        self.latencies_by_step = {}
+        self.errors = 0
+        self.orders = asyncio.Queue()
+
+    async def send(self, step, update):
+        start = time.perf_counter()
+        await self.application.process_update(update)
+        elapsed = time.perf_counter() - start
+        self.latencies.append(elapsed)
+        self.latencies_by_step.setdefault(step, []).append(elapsed)
+
+    async def student(self, user_id, budget):
+        f = self.factory
+        deadline = (datetime.now() + timedelta(days=10)).strftime("%d.%m.%Y")
+        await self.send("start", f.command(user_id, "start"))
+        await self.send("create_order", f.callback(user_id, "user_create_order"))
+        await self.send("discipline", f.callback(user_id, "user_disc_math"))
+        await self.send("work_type", f.callback(user_id, "user_work_course"))
+        await self.send("deadline", f.text(user_id, deadline))
+        await self.send("budget_type", f.callback(user_id, "user_set_budget"))
+        await self.send("budget", f.text(user_id, str(budget)))
+        await self.send("plagiarism", f.callback(user_id, "user_plagiarism_no"))
+        await self.send("upload_file", f.document(user_id, content=f"task of {user_id}".encode() * 512))
+        await self.send("upload_done", f.callback(user_id, "user_upload_done"))
+
+        order_id = self.application.user_data[user_id].get('order_data', {}).get('order_id')
+        await self.send("finish_order", f.callback(user_id, "user_skip_description"))
+        await self.orders.put(order_id)
+
+    async def admin(self, total_orders):
+        f = self.factory
+        admin_id = self.admin_id
+        for _ in range(total_orders):
+            order_id = await self.orders.get()
+            if not order_id:
+                continue
+            await self.send("admin_start", f.command(admin_id, "admin"))
+            await self.send("admin_orders", f.callback(admin_id, "admin_view_all_orders"))
+            await self.send("admin_order", f.callback(admin_id, f"admin_order_{order_id}"))
+            await self.send("admin_price", f.callback(admin_id, f"admin_force_set_price_{order_id}"))
+            await self.send("admin_price_value", f.text(admin_id, "1500"))
+            await self.send("admin_upload", f.callback(admin_id, f"admin_upload_work_{order_id}"))
+            await self.send("admin_upload_file", f.document(admin_id, "work.docx", content=order_id.encode() * 1024))
+            await self.send("admin_done", f.command(admin_id, "done"))
+            await self.send("admin_complete", f.callback(admin_id, f"admin_complete_{order_id}"))
+
+    async def count_error(self, update, context):
+        self.errors += 1
+
+
+async def run(args):
+    from config import Config
+    import database
+    import main
+
+    Config.ENABLE_2FA = False
+    Config.METRICS_PORT = 0
+    budget = max(Config.MIN_BUDGET, 1) + 500
+
+    database.init_db()
+    for folder in (Config.BASE_UPLOAD_FOLDER, Config.COMPLETED_FOLDER, Config.BLOB_FOLDER):
+        Path(folder).mkdir(exist_ok=True, parents=True)
+
+    telegram = FakeTelegram(latency=args.latency / 1000)
+    request = FakeBotRequest(telegram)
+    application = (
+        main.Application.builder()
+        .token("123456:BENCHMARK")
+        .request(request)
+        .get_updates_request(FakeBotRequest(telegram))
+        .build()
+    )
+    main.register_handlers(application)
+    db_timer = DatabaseTimer(database)
+
+    bench = Benchmark(application, UpdateFactory(application.bot, telegram), Config.ADMIN_ID)
+    application.add_error_handler(bench.count_error)
+
+    async with application:
+        start = time.perf_counter()
+        students = [bench.student(10_000 + i, budget) for i in range(args.students)]
+        await asyncio.gather(bench.admin(args.students), *students)
+        duration = time.perf_counter() - start
+
+    handler_time = sum(bench.latencies)
+    return {
+        "benchmark": "conversation",
+        "timestamp": datetime.now().isoformat(),
+        "students": args.students,
+        "simulated_api_latency_ms": args.latency,
+        "updates": len(bench.latencies),
+        "errors": bench.errors,
+        "duration_s": round(duration, 4),
+        "updates_per_s": round(len(bench.latencies) / duration, 2) if duration else 0.0,
+        "latency": latency_summary(bench.latencies),
+        "latency_by_step": {step: latency_summary(samples) for step, samples in bench.latencies_by_step.items()},
+        "db_calls": db_timer.calls,
+        "db_time_s": round(db_timer.total, 4),
+        "db_time_share": round(db_timer.total / handler_time, 4) if handler_time else 0.0,
+        "db_reads": dict(database.read_stats),
+        "api_calls": dict(telegram.calls),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк диалога создания заказа")
+    parser.add_argument("--students", type=int, default=50, help="число одновременных студентов")
+    parser.add_argument("--latency", type=float, default=0.0, help="имитация задержки Bot API, мс")
+    parser.add_argument("--output", default="conversation_benchmark.json", help="файл результатов JSON")
+    parser.add_argument("--verbose", action="store_true", help="не отключать журнал бота уровня INFO")
+    parser.add_argument("--workdir", help="рабочая папка для БД и файлов (по умолчанию временная)")
+    args = parser.parse_args()
+
+    output = Path(args.output).resolve()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_conversation_")
+    Path(workdir).mkdir(parents=True, exist_ok=True)
+    # База и папки заказов создаются относительно рабочей папки
+    os.chdir(workdir)
+    os.environ['DB_NAME'] = str(Path(workdir) / "bench.db")
+
+    warnings.filterwarnings("ignore")
+    if not args.verbose:
+        # Журнал бота на каждый шаг диалога заглушает вывод бенчмарка
+        logging.disable(logging.INFO)
+    result = asyncio.run(run(args))
+
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    latency = result["latency"]
+    print(f"Обновлений: {result['updates']} за {result['duration_s']} с "
+          f"({result['updates_per_s']} обн/с), ошибок: {result['errors']}")
+    print(f"Задержка: p50 {latency['p50_ms']} мс, p95 {latency['p95_ms']} мс, p99 {latency['p99_ms']} мс")
+    print(f"Доля времени в БД: {result['db_time_share'] * 100:.1f}%")
+    print(f"Чтения через database.read: выполнено {result['db_reads']['executed']}, "
+          f"объединено с одновременными {result['db_reads']['shared']}")
+    print(f"Результаты сохранены в {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+# bench_database.py - микробенчмарк функций database.py на наборах 10k/100k/1M заказов
+#
+# Для каждого масштаба один раз генерируется детерминированный набор данных
+# (orders, message_history, admin_logs), затем каждая публичная функция
+# database.py, а также admin_handlers.get_orders_by_status, utils.check_deadlines
+# и utils.cleanup_old_files замеряются на копии этой базы.
+#
+#   python benchmarks/bench_database.py --scales 10000,100000,1000000
+#   python benchmarks/bench_database.py --save-baseline         # записать эталон
+#   python benchmarks/bench_database.py --threshold 0.25        # сравнить с эталоном
+#
+# Код возврата 1, если функция стала медленнее эталона больше чем на threshold.
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime, timedelta
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "db_baseline.json"
+# Изменение набора данных делает старые эталоны несопоставимыми
+DATASET_VERSION = 2
+
+STATUSES = ['new', 'in_progress', 'completed', 'cancelled', 'waiting_payment', 'paid', 'work_uploaded',
+            'revision_requested']
+STATUS_WEIGHTS = [10, 15, 45, 10, 5, 5, 5, 5]
+TAGS = ['срочно', 'vip', 'повтор', 'сложный', 'скидка', '']
+
+
+def generate_dataset(path, scale, seed):
+    """Набор данных: scale заказов, по 3 сообщения и 2 записи журнала на заказ"""
+    import database
+    from config import Config
+
+    Config.DB_NAME = str(path)
+    database.init_db()
+
+    rng = random.Random(seed)
+    now = datetime.now()
+    users = max(1, scale // 5)
+    conn = sqlite3.connect(path)
+    try:
+        orders = []
+        messages = []
+        logs = []
+        for i in range(scale):
+            user_id = 1_000_000 + rng.randrange(users)
+            order_id = f"{user_id}-{i:07d}"
+            created = now - timedelta(days=rng.random() * 365)
+            status = rng.choices(STATUSES, STATUS_WEIGHTS)[0]
+            finished = created + timedelta(days=rng.random() * 14)
+            completed_at = finished.isoformat() if status == 'completed' else None
+            cancelled_at = finished.isoformat() if status == 'cancelled' else None
+            # Файлы давно завершенных и отмененных заказов уже удалены очисткой
+            reaped = status in ('completed', 'cancelled') and finished + timedelta(days=31) < now
+            files_reaped_at = (finished + timedelta(days=31)).isoformat() if reaped else None
+            deadline = (created + timedelta(days=rng.randint(1, 30))).strftime("%d.%m.%Y")
+            tags = ",".join(t for t in rng.sample(TAGS, 2) if t)
+            orders.append((
+                order_id, user_id, f"user{user_id}", "🧮 Математические дисциплины", "Не указано",
+                "📚 Курсовая работа", "Описание заказа " * rng.randint(1, 8), deadline, rng.randint(500, 20000),
+                rng.randint(0, 20000), '', rng.randint(0, 1), '', rng.randint(0, 90), "task.pdf,notes.docx",
+                status, 'paid' if status == 'completed' else 'unpaid', created.isoformat(), 0, '',
+                "work.docx" if completed_at else '', completed_at, tags, cancelled_at,
+                files_reaped_at
+            ))
+            for j in range(3):
+                messages.append((order_id, 'admin' if j % 2 else 'student', f"Сообщение {j} по заказу {order_id}",
+                                 (created + timedelta(hours=j)).isoformat(), 'text', ''))
+            for action in ("admin_login", f"force_set_price_{rng.randint(500, 20000)}"):
+                logs.append((Config.ADMIN_ID, action, order_id, created.isoformat()))
+
+            if len(orders) >= 50_000 or i == scale - 1:
+                conn.executemany(
+                    "INSERT INTO orders (order_id, user_id, username, discipline, subject, work_type, description, "
+                    "deadline, budget, final_amount, payment_url, plagiarism_required, plagiarism_system, "
+                    "plagiarism_percent, files, status, payment_status, created_at, expert_id, expert_name, "
+                    "completed_files, completed_at, tags, cancelled_at, files_reaped_at) VALUES (?, ?, ?, ?, ?, ?, ?, "
+                    "?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", orders)
+                conn.executemany("INSERT INTO message_history (order_id, sender_type, message_text, timestamp, "
+                                 "message_type, file_id) VALUES (?, ?, ?, ?, ?, ?)", messages)
+                conn.executemany("INSERT INTO admin_logs (admin_id, action, order_id, timestamp) VALUES (?, ?, ?, ?)",
+                                 logs)
+                conn.commit()
+                orders, messages, logs = [], [], []
+        conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class Sample:
+    """Случайные существующие заказы и пользователи для аргументов функций"""
+
+    def __init__(self, path, seed):
+        conn = sqlite3.connect(path)
+        rows = conn.execute("SELECT order_id, user_id FROM orders ORDER BY rowid").fetchall()
+        conn.close()
+        self.rng = random.Random(seed + 1)
+        self.rows = rows
+
+    def order_id(self):
+        return self.rng.choice(self.rows)[0]
+
+    def user_id(self):
+        return self.rng.choice(self.rows)[1]
+
+    def pop_order_id(self):
+        return self.rows.pop(self.rng.randrange(len(self.rows)))[0]
+
+
+class FakeBot:
+    async def send_message(self, *args, **kwargs):
+        return None
+
+
+class FakeContext:
+    bot = FakeBot()
+    bot_data = {}
+
+
+def build_cases(sample):
+    """Функция -> вызов с реалистичными аргументами"""
+    import admin_handlers
+    import database
+    import utils
+    from config import Config
+
+    counter = iter(range(10 ** 9))
+    context = FakeContext()
+    now = datetime.now()
+
+    def new_order():
+        user_id = sample.user_id()
+        return {'order_id': f"bench-{next(counter)}", 'user_id': user_id, 'username': f"user{user_id}",
+                'deadline': "01.01.2030", 'budget': 1000, 'files': ["uploads/x/task.pdf"]}
+
+    def flush_batch():
+        # Очередь заполняется заранее: замеряется запись пакета, а не пустой вызов
+        for _ in range(Config.HISTORY_BATCH_SIZE - 1):
+            database.queue_message_to_history(sample.order_id(), "student", "Сообщение")
+        database.flush_message_history()
+
+    async def coalesced_reads():
+        # Восемь одинаковых одновременных выборок списка заказов (повторные нажатия администратора),
+        # которые database.read объединяет в один запрос; сравнивать с "8 x database.get_all_orders"
+        await asyncio.gather(*(database.read(database.get_all_orders) for _ in range(8)))
+
+    def sequential_reads():
+        for _ in range(8):
+            database.get_all_orders()
+
+    return {
+        "database.init_db": lambda: database.init_db(),
+        "database.get_connection": lambda: database.get_connection().close(),
+        "database.log_admin_action": lambda: database.log_admin_action(1, "bench", sample.order_id()),
+        "database.generate_order_id": lambda: database.generate_order_id(sample.user_id()),
+        "database.save_order_to_db": lambda: database.save_order_to_db(new_order()),
+        "database.get_all_orders": lambda: database.get_all_orders(),
+        "8 x database.get_all_orders": sequential_reads,
+        "database.get_order_details": lambda: database.get_order_details(sample.order_id()),
+        "database.update_order_price": lambda: database.update_order_price(sample.order_id(), 1500),
+        "database.update_order_status": lambda: database.update_order_status(sample.order_id(), 'in_progress'),
+        "database.update_order_completed_files": lambda: database.update_order_completed_files(
+            sample.order_id(), ["completed/work.docx"]),
+        "database.update_payment_status": lambda: database.update_payment_status(sample.order_id(), 'paid'),
+        "database.update_payment_url": lambda: database.update_payment_url(sample.order_id(), "https://pay/x"),
+        "database.update_order_tags": lambda: database.update_order_tags(sample.order_id(), "vip,срочно"),
+        "database.completed_files_value": lambda: database.completed_files_value(["completed/work.docx"] * 3),
+        "database.update_order_fields": lambda: database.update_order_fields(
+            sample.order_id(), {'status': 'work_uploaded', 'completed_files': "work.docx"}),
+        "database.get_user_active_orders_count": lambda: database.get_user_active_orders_count(sample.user_id()),
+        "database.get_user_orders": lambda: database.get_user_orders(sample.user_id()),
+        "database.delete_order": lambda: database.delete_order(sample.pop_order_id()),
+        "database.save_message_to_history": lambda: database.save_message_to_history(
+            sample.order_id(), "admin", "Сообщение"),
+        "database.get_message_history": lambda: database.get_message_history(sample.order_id()),
+        "database.queue_message_to_history": lambda: database.queue_message_to_history(
+            sample.order_id(), "student", "Сообщение"),
+        "database.flush_message_history": lambda: flush_batch(),
+        "database.get_message_history_page": lambda: database.get_message_history_page(sample.order_id()),
+        "database.get_response_templates": lambda: database.get_response_templates(),
+        "database.save_response_template": lambda: database.save_response_template("bench", "text"),
+        "database.get_orders_by_tags": lambda: database.get_orders_by_tags("vip"),
+        "database.get_blob_by_unique_id": lambda: database.get_blob_by_unique_id(f"u{next(counter)}"),
+        "database.add_file_reference": lambda: database.add_file_reference(
+            f"uploads/bench/{next(counter)}", "0" * 64, 1024),
+        "database.release_file_references": lambda: database.release_file_references(
+            f"uploads/{sample.user_id()}/{sample.order_id()}"),
+        "database.get_expired_completed_orders": lambda: database.get_expired_completed_orders(
+            now - timedelta(days=30)),
+        "database.get_stale_cancelled_orders": lambda: database.get_stale_cancelled_orders(now - timedelta(days=7)),
+        "database.mark_orders_reaped": lambda: database.mark_orders_reaped([sample.order_id() for _ in range(100)]),
+        "database.get_existing_order_ids": lambda: database.get_existing_order_ids(
+            [sample.order_id() for _ in range(100)]),
+        "database.get_slow_query_summary": lambda: database.get_slow_query_summary(),
+        "database.clear_slow_queries": lambda: database.clear_slow_queries(),
+        "database.read": lambda: asyncio.run(coalesced_reads()),
+        "admin_handlers.get_orders_by_status": lambda: admin_handlers.get_orders_by_status('new'),
+        "admin_handlers.get_orders_by_status(all)": lambda: admin_handlers.get_orders_by_status('all'),
+        "utils.check_deadlines": lambda: asyncio.run(utils.check_deadlines(context)),
+        "utils.cleanup_old_files": lambda: asyncio.run(utils.cleanup_old_files(context)),
+    }
+
+
+def time_case(func, repeat, max_time):
+    """Медиана времени вызова: не меньше 3 и не больше repeat замеров, не дольше max_time"""
+    func()  # прогрев
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < repeat and (len(timings) < 3 or time.perf_counter() - started < max_time):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def run_scale(scale, args, workdir):
+    import database
+    from config import Config
+
+    base = workdir / f"dataset_v{DATASET_VERSION}_{scale}_{args.seed}.db"
+    if not base.exists():
+        print(f"Генерация набора данных: {scale} заказов...", flush=True)
+        started = time.perf_counter()
+        generate_dataset(base, scale, args.seed)
+        print(f"  готово за {time.perf_counter() - started:.1f} с", flush=True)
+
+    # Замеры идут на копии, чтобы изменения не накапливались между запусками
+    work = workdir / f"work_{scale}.db"
+    shutil.copyfile(base, work)
+    Config.DB_NAME = str(work)
+
+    sample = Sample(work, args.seed)
+    cases = build_cases(sample)
+    public = {f"database.{name}" for name, func in vars(database).items()
+              if not name.startswith('_') and inspect.isfunction(func) and func.__module__ == 'database'}
+    for name in sorted(public - cases.keys()):
+        print(f"  ⚠️ {name}: нет сценария замера, функция пропущена")
+
+    results = {}
+    for name, func in cases.items():
+        if args.only and not any(part in name for part in args.only.split(',')):
+            continue
+        results[name] = time_case(func, args.repeat, args.max_time)
+    return results
+
+
+def compare(results, baseline, threshold, min_delta):
+    """Сравнение с эталоном: список регрессий (масштаб, функция, эталон, текущее)"""
+    regressions = []
+    for scale, functions in results.items():
+        for name, current in functions.items():
+            reference = baseline.get(scale, {}).get(name)
+            if reference is None:
+                continue
+            if current > reference * (1 + threshold) and current - reference > min_delta:
+                regressions.append((scale, name, reference, current))
+    return regressions
+
+
+def print_table(results, baseline):
+    scales = list(results)
+    names = sorted({name for functions in results.values() for name in functions})
+    width = max(len(name) for name in names) + 2
+    header = "Функция".ljust(width) + "".join(f"{scale + ' заказов':>26}" for scale in scales)
+    print(header)
+    print("-" * len(header))
+    for name in names:
+        row = name.ljust(width)
+        for scale in scales:
+            current = results[scale].get(name)
+            if current is None:
+                row += f"{'-':>26}"
+                continue
+            reference = baseline.get(scale, {}).get(name)
+            cell = f"{current * 1000:.3f} мс"
+            if reference:
+                cell += f" ({(current / reference - 1) * 100:+.0f}%)"
+            row += f"{cell:>26}"
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарк функций базы данных")
+    parser.add_argument("--scales", default="10000,100000,1000000", help="размеры наборов через запятую")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=20, help="максимум замеров на функцию")
+    parser.add_argument("--max-time", type=float, default=2.0, help="лимит времени замеров функции, с")
+    parser.add_argument("--only", help="замерять только функции, содержащие эти подстроки (через запятую)")
+    parser.add_argument("--workdir", default=str(Path(tempfile.gettempdir()) / "bench_database"),
+                        help="папка для наборов данных (переиспользуются между запусками)")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="файл эталонных результатов")
+    parser.add_argument("--save-baseline", action="store_true", help="записать результаты как эталон")
+    parser.add_argument("--threshold", type=float, default=0.25, help="допустимое замедление (0.25 = 25%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.2,
+                        help="замедления меньше этого значения (мс) не считаются регрессией")
+    parser.add_argument("--output", help="файл для результатов JSON")
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    baseline_path = Path(args.baseline).resolve()
+    output = Path(args.output).resolve() if args.output else None
+    # Папки заказов, которые проверяет очистка, ищутся относительно рабочей папки
+    os.chdir(workdir)
+    os.environ['METRICS_PORT'] = '0'
+    logging.disable(logging.INFO)
+    warnings.filterwarnings("ignore")
+
+    results = {}
+    for scale in (int(value) for value in args.scales.split(',')):
+        print(f"Масштаб {scale}", flush=True)
+        results[str(scale)] = run_scale(scale, args, workdir)
+
+    baseline = {}
+    if baseline_path.exists():
+        stored = json.loads(baseline_path.read_text(encoding="utf-8"))
+        if stored.get("dataset_version") == DATASET_VERSION:
+            baseline = stored.get("results", {})
+        else:
+            print("Эталон создан для другой версии набора данных и не используется")
+
+    print()
+    print_table(results, baseline)
+
+    payload = {"dataset_version": DATASET_VERSION, "seed": args.seed,
+               "timestamp": datetime.now().isoformat(), "results": results}
+    if output:
+        output.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.save_baseline:
+        # Масштабы, не участвовавшие в этом запуске, сохраняются из старого эталона
+        merged = dict(baseline)
+        merged.update(results)
+        payload["results"] = merged
+        baseline_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\nЭталон сохранен в {baseline_path}")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold, args.min_delta_ms / 1000)
+    if regressions:
+        print(f"\n❌ Регрессии (порог {args.threshold * 100:.0f}%):")
+        for scale, name, reference, current in regressions:
+            print(f"  {name} @ {scale}: {reference * 1000:.3f} мс -> {current * 1000:.3f} мс")
+        return 1
+    if baseline:
+        print("\n✅ Регрессий нет")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+# bench_pools.py - задержка управляющих вызовов во время загрузки больших файлов
+#
+# На локальном сервере-имитации Bot API (telegram_server.py) с ограниченной
+# скоростью передачи одновременно идут загрузки документов и короткие вызовы
+# answerCallbackQuery/editMessageText. Сравниваются два клиента:
+#   shared - один пул соединений на все вызовы (как было до разделения);
+#   split  - bot_request.build_request(): отдельные пулы для файлов и управления.
+#
+#   python benchmarks/bench_pools.py --uploads 16 --size 2 --bandwidth 4 --output pools.json
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+import warnings
+from datetime import datetime
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_conversation import latency_summary  # noqa: E402
+from telegram_server import TelegramServer  # noqa: E402
+
+CHAT_ID = 10_000
+
+
+def shared_request(args):
+    from bot_request import InstrumentedRequest
+    # Загрузки в общем пуле идут по очереди: таймаут с запасом на всю очередь
+    timeout = args.size / args.bandwidth * args.uploads + 60
+    return InstrumentedRequest(connection_pool_size=args.pool_size, connect_timeout=5.0, read_timeout=timeout,
+                               write_timeout=timeout, media_write_timeout=timeout, pool_timeout=timeout)
+
+
+def split_request(args):
+    from bot_request import build_request
+    from config import Config
+    Config.API_MEDIA_POOL_SIZE = args.media_pool_size
+    Config.API_MEDIA_CONCURRENCY = args.media_concurrency
+    return build_request()
+
+
+async def control_loop(bot, samples, stop, interval):
+    """Короткие вызовы, как при нажатии кнопок, пока идут загрузки"""
+    message = await bot.send_message(CHAT_ID, "Статус заказа")
+    while not stop.is_set():
+        for call in (lambda: bot.answer_callback_query("bench"),
+                     lambda: bot.edit_message_text("Статус заказа", CHAT_ID, message.message_id)):
+            start = time.perf_counter()
+            await call()
+            samples.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+
+
+async def run_mode(name, request, server, args):
+    from telegram import Bot
+
+    payload = b"\0" * int(args.size * 1024 * 1024)
+    bot = Bot("123456:BENCHMARK", base_url=server.base_url, base_file_url=server.base_file_url, request=request)
+    samples = []
+    upload_times = []
+
+    async def upload(index):
+        start = time.perf_counter()
+        await bot.send_document(CHAT_ID, payload, filename=f"work{index}.zip")
+        upload_times.append(time.perf_counter() - start)
+
+    async with bot:
+        stop = asyncio.Event()
+        controls = [asyncio.create_task(control_loop(bot, samples, stop, args.interval / 1000))
+                    for _ in range(args.controls)]
+        start = time.perf_counter()
+        await asyncio.gather(*(upload(i) for i in range(args.uploads)))
+        duration = time.perf_counter() - start
+        stop.set()
+        await asyncio.gather(*controls)
+
+    return {
+        "mode": name,
+        "uploads_duration_s": round(duration, 3),
+        "control_latency": latency_summary(samples),
+        "upload_latency": latency_summary(upload_times),
+    }
+
+
+async def run(args):
+    server = TelegramServer(port=0, latency=args.latency / 1000, bandwidth=args.bandwidth * 1024 * 1024)
+    await server.start()
+    try:
+        results = [
+            await run_mode("shared", shared_request(args), server, args),
+            await run_mode("split", split_request(args), server, args),
+        ]
+    finally:
+        await server.stop()
+    return {
+        "benchmark": "pools",
+        "timestamp": datetime.now().isoformat(),
+        "uploads": args.uploads,
+        "upload_size_mb": args.size,
+        "bandwidth_mb_s": args.bandwidth,
+        "simulated_api_latency_ms": args.latency,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк раздельных пулов соединений Bot API")
+    parser.add_argument("--uploads", type=int, default=16, help="число одновременных загрузок документов")
+    parser.add_argument("--size", type=float, default=2.0, help="размер документа, МБ")
+    parser.add_argument("--bandwidth", type=float, default=4.0, help="скорость передачи на соединение, МБ/с")
+    parser.add_argument("--latency", type=float, default=30.0, help="задержка ответа сервера, мс")
+    parser.add_argument("--controls", type=int, default=4, help="число параллельных потоков управляющих вызовов")
+    parser.add_argument("--interval", type=float, default=50.0, help="пауза между управляющими вызовами, мс")
+    parser.add_argument("--pool-size", type=int, default=8, help="размер общего пула в режиме shared")
+    parser.add_argument("--media-pool-size", type=int, default=8, help="размер пула файлов в режиме split")
+    parser.add_argument("--media-concurrency", type=int, default=4, help="лимит одновременных передач файлов")
+    parser.add_argument("--output", default="pools_benchmark.json", help="файл результатов JSON")
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore")
+    logging.disable(logging.WARNING)
+    result = asyncio.run(run(args))
+
+    output = Path(args.output).resolve()
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    for mode in result["results"]:
+        control = mode["control_latency"]
+        print(f"{mode['mode']:>6}: управляющие вызовы p50 {control['p50_ms']} мс, p95 {control['p95_ms']} мс, "
+              f"max {control['max_ms']} мс; загрузки за {mode['uploads_duration_s']} с")
+    print(f"Результаты сохранены в {output}")
+
+
+if __name__ == '__main__':
+    main()
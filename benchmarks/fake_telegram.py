@@ -0,0 +1,175 @@
+# fake_telegram.py - имитация Bot API и генератор обновлений для бенчмарков
+import asyncio
+import hashlib
+import itertools
+import json
+import time
+from collections import Counter
+from telegram import Update
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+# Методы, которые возвращают отправленное сообщение
+_MESSAGE_METHODS = {
+    "sendMessage", "editMessageText", "editMessageCaption", "editMessageReplyMarkup",
+    "sendDocument", "sendPhoto", "sendVoice", "sendVideo", "sendAudio",
+}
+
+# Поля сообщения с файлами и обязательные атрибуты их объектов
+_MEDIA_FIELDS = {
+    "document": {},
+    "voice": {"duration": 1},
+    "video": {"duration": 1, "width": 640, "height": 360},
+    "audio": {"duration": 1},
+    "photo": {"width": 800, "height": 600},
+}
+
+
+class FakeTelegram:
+    """Ответы Bot API без сети
+
+    latency - имитация задержки сети на каждый вызов (в секундах).
+    Файлы, на которые ссылаются обновления, регистрируются через register_file.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1000)
+        self._files = {}
+
+    def register_file(self, file_id, content):
+        self._files[file_id] = content
+
+    def file_content(self, file_path):
+        file_id = file_path.rsplit('/', 1)[-1]
+        content = self._files.get(file_id)
+        if content is None:
+            # Для незарегистрированных файлов содержимое детерминировано по пути
+            content = hashlib.sha256(file_path.encode()).digest() * 64
+        return content
+
+    def _message(self, params):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0) or 0), "type": "private"},
+            "from": BOT_USER,
+        }
+        if params.get("text"):
+            message["text"] = params["text"]
+        if params.get("caption"):
+            message["caption"] = params["caption"]
+        for field, extra in _MEDIA_FIELDS.items():
+            file_id = params.get(field)
+            if isinstance(file_id, str):
+                media = {"file_id": file_id, "file_unique_id": f"u{file_id}",
+                         "file_size": len(self.file_content(file_id)), **extra}
+                message[field] = [media] if field == "photo" else media
+        return message
+
+    def handle(self, method, params):
+        """Результат вызова метода Bot API"""
+        self.calls[method] += 1
+        if method == "getMe":
+            return BOT_USER
+        if method in _MESSAGE_METHODS:
+            return self._message(params)
+        if method == "sendMediaGroup":
+            return [self._message({"chat_id": params.get("chat_id"), item.get("type"): item.get("media")})
+                    for item in params.get("media", [])]
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method == "getFile":
+            file_id = params["file_id"]
+            return {"file_id": file_id, "file_unique_id": f"u{file_id}",
+                    "file_size": len(self.file_content(file_id)), "file_path": f"documents/{file_id}"}
+        if method == "getUpdates":
+            return []
+        return True
+
+    def response(self, method, params):
+        """Тело ответа Bot API в JSON"""
+        return json.dumps({"ok": True, "result": self.handle(method, params)}).encode()
+
+
+class FakeBotRequest(BaseRequest):
+    """Транспорт python-telegram-bot, который отвечает из FakeTelegram вместо сети"""
+
+    def __init__(self, telegram):
+        self.telegram = telegram
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        if self.telegram.latency:
+            await asyncio.sleep(self.telegram.latency)
+        if "/file/bot" in url:
+            self.telegram.calls["file_download"] += 1
+            return 200, self.telegram.file_content(url.split("/file/bot", 1)[1].split("/", 1)[1])
+        api_method = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        return 200, self.telegram.response(api_method, params)
+
+
+class UpdateFactory:
+    """Синтетические обновления от имени пользователей"""
+
+    def __init__(self, bot=None, telegram=None):
+        self.bot = bot
+        self.telegram = telegram
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"Student{user_id}", "username": f"student{user_id}"}
+
+    def _message(self, user_id, **fields):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self.user(user_id),
+        }
+        message.update(fields)
+        return message
+
+    def _update(self, **fields):
+        # Без бота обновления возвращаются словарями, как в ответе getUpdates
+        data = {"update_id": next(self._update_ids), **fields}
+        return Update.de_json(data, self.bot) if self.bot else data
+
+    def command(self, user_id, command, args=""):
+        text = f"/{command} {args}".strip()
+        entities = [{"type": "bot_command", "offset": 0, "length": len(command) + 1}]
+        return self._update(message=self._message(user_id, text=text, entities=entities))
+
+    def text(self, user_id, text):
+        return self._update(message=self._message(user_id, text=text))
+
+    def callback(self, user_id, data):
+        message = self._message(user_id, text="…")
+        message["from"] = BOT_USER
+        return self._update(callback_query={
+            "id": str(next(self._update_ids)),
+            "from": self.user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": message,
+        })
+
+    def document(self, user_id, file_name="task.pdf", mime_type="application/pdf", content=b"%PDF-1.4 bench"):
+        file_id = f"doc{user_id}_{next(self._message_ids)}"
+        if self.telegram:
+            self.telegram.register_file(file_id, content)
+        document = {"file_id": file_id, "file_unique_id": f"u{file_id}", "file_name": file_name,
+                    "mime_type": mime_type, "file_size": len(content)}
+        return self._update(message=self._message(user_id, document=document))
@@ -0,0 +1,206 @@
+# replay.py - воспроизведение записанного потока обновлений (recorder.py) на копии базы
+#
+# Обновления подаются в очередь приложения с исходными интервалами (или
+# ускоренно) и обрабатываются настоящими обработчиками из main.py; Bot API
+# имитируется без сети. Результат - задержки по обработчикам и задержка очереди.
+#
+#   python benchmarks/replay.py recordings/updates-20240101.jsonl.gz --db orders.db --speed 10
+#
+# Id в записи заменены псевдонимами, поэтому заказы из снимка базы им не
+# соответствуют: воспроизводится форма нагрузки, а не результат для конкретных
+# пользователей.
+import argparse
+import asyncio
+import functools
+import gzip
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+from bench_conversation import latency_summary  # noqa: E402
+from fake_telegram import FakeTelegram, FakeBotRequest  # noqa: E402
+
+
+def read_records(paths):
+    """Заголовок (id администратора) и записи [(время прихода, обновление)] по порядку прихода"""
+    admin_id = None
+    records = []
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as log_file:
+            for line in log_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Последняя строка может быть оборвана, если бот был остановлен аварийно
+                    continue
+                if "header" in entry:
+                    if admin_id is not None and entry["header"]["admin_id"] != admin_id:
+                        print(f"⚠️ {path}: другой псевдоним администратора, записи сделаны с разными ключами")
+                    admin_id = entry["header"]["admin_id"]
+                else:
+                    records.append((entry["t"], entry["update"]))
+    records.sort(key=lambda record: record[0])
+    return admin_id, records
+
+
+class HandlerTimer:
+    """Время выполнения каждого обработчика приложения"""
+
+    def __init__(self, application):
+        from metrics import iter_handlers
+
+        self.samples = {}
+        wrapped = {}
+        for group_handlers in application.handlers.values():
+            for handler in iter_handlers(group_handlers):
+                callback = handler.callback
+                if callback not in wrapped:
+                    wrapped[callback] = self._wrap(callback)
+                handler.callback = wrapped[callback]
+
+    def _wrap(self, func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.samples.setdefault(name, []).append(time.perf_counter() - start)
+        return wrapper
+
+
+async def run(args, admin_id, records):
+    import main
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    main.init_db()
+    from config import Config
+    Config.METRICS_PORT = 0
+    Config.ENABLE_2FA = False
+    for folder in (Config.BASE_UPLOAD_FOLDER, Config.COMPLETED_FOLDER, Config.BLOB_FOLDER):
+        Path(folder).mkdir(exist_ok=True, parents=True)
+
+    telegram = FakeTelegram(latency=args.latency / 1000)
+    application = (
+        main.Application.builder()
+        .token("123456:REPLAY")
+        .request(FakeBotRequest(telegram))
+        .get_updates_request(FakeBotRequest(telegram))
+        .build()
+    )
+    main.register_handlers(application)
+    timer = HandlerTimer(application)
+
+    # Время от плановой подачи обновления до начала его обработки
+    scheduled = {}
+    queue_delays = []
+
+    async def mark_started(update, context):
+        planned = scheduled.pop(update.update_id, None)
+        if planned is not None:
+            queue_delays.append(time.perf_counter() - planned)
+
+    application.add_handler(TypeHandler(Update, mark_started), group=-1000)
+    errors = 0
+
+    async def count_error(update, context):
+        nonlocal errors
+        errors += 1
+
+    application.add_error_handler(count_error)
+
+    first_arrival = records[0][0] if records else 0.0
+    async with application:
+        await application.start()
+        start = time.perf_counter()
+        for arrived, data in records:
+            if args.speed:
+                delay = start + (arrived - first_arrival) / args.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            update = Update.de_json(data, application.bot)
+            scheduled[update.update_id] = time.perf_counter()
+            await application.update_queue.put(update)
+        await application.update_queue.join()
+        duration = time.perf_counter() - start
+        await application.stop()
+
+    all_samples = [sample for samples in timer.samples.values() for sample in samples]
+    return {
+        "benchmark": "replay",
+        "timestamp": datetime.now().isoformat(),
+        "logs": [str(path) for path in args.logs],
+        "admin_id": admin_id,
+        "speed": args.speed,
+        "updates": len(records),
+        "recorded_span_s": round(records[-1][0] - first_arrival, 3) if records else 0.0,
+        "duration_s": round(duration, 4),
+        "errors": errors,
+        "queue_delay": latency_summary(queue_delays),
+        "handlers": latency_summary(all_samples),
+        "latency_by_handler": {name: latency_summary(samples) for name, samples in sorted(timer.samples.items())},
+        "api_calls": dict(telegram.calls),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных обновлений")
+    parser.add_argument("logs", nargs="+", help="файлы записи (*.jsonl.gz) в порядке времени")
+    parser.add_argument("--db", help="снимок базы данных (копируется, исходный файл не меняется)")
+    parser.add_argument("--speed", type=float, default=1.0, help="ускорение относительно записи (0 - без пауз)")
+    parser.add_argument("--latency", type=float, default=0.0, help="имитация задержки Bot API, мс")
+    parser.add_argument("--output", default="replay.json", help="файл результатов JSON")
+    parser.add_argument("--workdir", help="рабочая папка для БД и файлов (по умолчанию временная)")
+    parser.add_argument("--verbose", action="store_true", help="не отключать журнал бота уровня INFO")
+    args = parser.parse_args()
+
+    args.logs = [Path(path).resolve() for path in args.logs]
+    output = Path(args.output).resolve()
+    admin_id, records = read_records(args.logs)
+    if admin_id is None:
+        print("В записи нет заголовка с id администратора")
+        return 1
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="replay_")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    database_path = workdir / "replay.db"
+    if args.db:
+        shutil.copyfile(args.db, database_path)
+    # Настройки читаются при импорте config, поэтому задаются до импорта модулей бота
+    os.chdir(workdir)
+    os.environ['DB_NAME'] = str(database_path)
+    os.environ['ADMIN_ID'] = str(admin_id)
+    os.environ['RECORD_UPDATES_PATH'] = ''
+
+    warnings.filterwarnings("ignore")
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    result = asyncio.run(run(args, admin_id, records))
+
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Обновлений: {result['updates']} (запись {result['recorded_span_s']} с) "
+          f"за {result['duration_s']} с, ошибок: {result['errors']}")
+    print(f"Задержка очереди: p50 {result['queue_delay']['p50_ms']} мс, p99 {result['queue_delay']['p99_ms']} мс")
+    print(f"\n{'Обработчик':40}{'вызовов':>10}{'p50, мс':>12}{'p95, мс':>12}{'max, мс':>12}")
+    by_p95 = sorted(result["latency_by_handler"].items(), key=lambda item: item[1]["p95_ms"], reverse=True)
+    for name, summary in by_p95:
+        print(f"{name:40}{summary['count']:>10}{summary['p50_ms']:>12}{summary['p95_ms']:>12}{summary['max_ms']:>12}")
+    print(f"\nРезультаты сохранены в {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
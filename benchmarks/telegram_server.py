@@ -0,0 +1,447 @@
+# telegram_server.py - локальный HTTP-сервер, заменяющий Bot API для нагрузочных тестов
+#
+# Реализует методы Bot API, которыми пользуется бот (getUpdates, sendMessage,
+# editMessageText, answerCallbackQuery, sendDocument, getFile, скачивание
+# файлов, sendVoice, sendMediaGroup и др.), с настраиваемой задержкой, ответами
+# 429 (flood control) и подачей обновлений. Неизмененный бот направляется на
+# сервер переменными окружения:
+#
+#   python benchmarks/telegram_server.py --port 8081 --latency 30 --chat-limit 1 --students 20
+#   TELEGRAM_BOT_API_URL=http://127.0.0.1:8081/bot \
+#   TELEGRAM_BOT_FILE_URL=http://127.0.0.1:8081/file/bot python main.py
+#
+# Синтетические студенты нажимают кнопки быстрее людей: для замеров пропускной
+# способности ограничение частоты отключается (FLOOD_RATE=0).
+#
+# С --local-dir сервер ведет себя как telegram-bot-api --local (боту нужен
+# TELEGRAM_BOT_API_LOCAL=true): файлы не скачиваются, а берутся с диска.
+#
+# Служебные адреса:
+#   POST /_inject  - обновление (или список обновлений) в формате getUpdates
+#   GET  /_stats   - счетчики вызовов, ответов 429 и очереди обновлений
+import argparse
+import asyncio
+import email.parser
+import email.policy
+import itertools
+import json
+import logging
+import math
+import random
+import sys
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import parse_qsl, unquote
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_telegram import FakeTelegram, UpdateFactory, _MESSAGE_METHODS  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+# Методы отправки, на которые распространяются лимиты Telegram
+_SEND_METHODS = (_MESSAGE_METHODS - {"editMessageText", "editMessageCaption", "editMessageReplyMarkup"}) | {
+    "sendMediaGroup", "copyMessage", "forwardMessage",
+}
+# Текстовые параметры не декодируются из JSON, даже если похожи на число
+_TEXT_PARAMS = {"text", "caption", "callback_query_id", "file_id", "username"}
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests"}
+
+
+class FloodLimiter:
+    """Скользящее окно в 1 секунду: общий лимит и лимит на чат"""
+
+    def __init__(self, chat_limit=0, global_limit=0):
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self._chats = {}
+        self._global = deque()
+
+    @staticmethod
+    def _retry_after(window, limit, now):
+        while window and now - window[0] >= 1.0:
+            window.popleft()
+        if len(window) >= limit:
+            return max(1, math.ceil(window[0] + 1.0 - now))
+        return None
+
+    def check(self, chat_id):
+        """Время ожидания в секундах, если лимит превышен, иначе None (вызов засчитывается)"""
+        now = time.monotonic()
+        if self.global_limit:
+            retry_after = self._retry_after(self._global, self.global_limit, now)
+            if retry_after:
+                return retry_after
+        chat_window = None
+        if self.chat_limit and chat_id is not None:
+            chat_window = self._chats.setdefault(chat_id, deque())
+            retry_after = self._retry_after(chat_window, self.chat_limit, now)
+            if retry_after:
+                return retry_after
+        if self.global_limit:
+            self._global.append(now)
+        if chat_window is not None:
+            chat_window.append(now)
+        return None
+
+
+class TelegramServer:
+    """Имитация Bot API по HTTP поверх FakeTelegram
+
+    latency/jitter - задержка ответа в секундах, chat_limit/global_limit -
+    число отправок в секунду до ответа 429, flood_probability - доля отправок,
+    на которые 429 возвращается случайно, bandwidth - скорость передачи файлов
+    в байтах в секунду на одно соединение (0 - без ограничения). С local_dir
+    сервер работает как telegram-bot-api --local: getFile возвращает абсолютный
+    путь к файлу в этой папке, а файлы можно отправлять ссылкой file://.
+    """
+
+    def __init__(self, telegram=None, host="127.0.0.1", port=8081, latency=0.0, jitter=0.0, chat_limit=0,
+                 global_limit=0, flood_probability=0.0, retry_after=1, seed=None, bandwidth=0,
+                 local_dir=None):
+        self.telegram = telegram or FakeTelegram()
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.flood = FloodLimiter(chat_limit, global_limit)
+        self.flood_probability = flood_probability
+        self.retry_after = retry_after
+        self.bandwidth = bandwidth
+        self.local_dir = Path(local_dir).resolve() if local_dir else None
+        self.stats = Counter()
+        self._rng = random.Random(seed)
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._last_update_id = 0
+        self._new_updates = asyncio.Event()
+        self._upload_ids = itertools.count(1)
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/bot"
+
+    @property
+    def base_file_url(self):
+        return f"http://{self.host}:{self.port}/file/bot"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        # Порт 0 - свободный порт, выбранный системой
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Имитация Bot API запущена на {self.base_url}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def inject(self, update):
+        """Добавление обновления в очередь getUpdates; возвращает его update_id"""
+        update = dict(update)
+        if "update_id" not in update:
+            update["update_id"] = max(next(self._update_ids), self._last_update_id + 1)
+        self._last_update_id = max(self._last_update_id, update["update_id"])
+        self._updates.append(update)
+        self.stats["injected"] += 1
+        self._new_updates.set()
+        return update["update_id"]
+
+    @property
+    def pending_updates(self):
+        return len(self._updates)
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        deadline = time.monotonic() + timeout
+        while True:
+            if offset:
+                # Обновления до offset подтверждены ботом
+                self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            if self._updates or time.monotonic() >= deadline:
+                return self._updates[:limit]
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                pass
+
+    def _register_uploads(self, params, files):
+        """Загруженные файлы получают file_id; ссылки attach:// заменяются на него"""
+        uploaded = {}
+        for name, content in files.items():
+            file_id = f"upload{next(self._upload_ids)}"
+            self.telegram.register_file(file_id, content)
+            uploaded[name] = file_id
+
+        referenced = set()
+
+        def resolve(value):
+            if isinstance(value, str) and value.startswith("file://"):
+                file_id = f"upload{next(self._upload_ids)}"
+                self.telegram.register_file(file_id, Path(unquote(value[len("file://"):])).read_bytes())
+                self.stats["local_upload"] += 1
+                return file_id
+            if isinstance(value, str) and value.startswith("attach://"):
+                name = value[len("attach://"):]
+                referenced.add(name)
+                return uploaded.get(name, value)
+            if isinstance(value, list):
+                return [resolve(item) for item in value]
+            if isinstance(value, dict):
+                return {key: resolve(item) for key, item in value.items()}
+            return value
+
+        params = {key: resolve(value) for key, value in params.items()}
+        for name, file_id in uploaded.items():
+            if name not in referenced:
+                params.setdefault(name, file_id)
+        return params
+
+    @staticmethod
+    def _decode(key, value):
+        if key in _TEXT_PARAMS:
+            return value
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+
+    def _parse_body(self, headers, body):
+        """Параметры запроса из JSON, формы или multipart (как их отправляет httpx)"""
+        content_type = headers.get("content-type", "")
+        params, files = {}, {}
+        if not body:
+            return params, files
+        if content_type.startswith("application/json"):
+            return json.loads(body), files
+        if content_type.startswith("multipart/form-data"):
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body)
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                content = part.get_payload(decode=True) or b""
+                if part.get_filename() is not None:
+                    files[name] = content
+                else:
+                    params[name] = self._decode(name, content.decode("utf-8"))
+            return params, files
+        for key, value in parse_qsl(body.decode("utf-8"), keep_blank_values=True):
+            params[key] = self._decode(key, value)
+        return params, files
+
+    def _flood_response(self, method, params):
+        if method not in _SEND_METHODS:
+            return None
+        chat_id = params.get("chat_id")
+        retry_after = self.flood.check(chat_id)
+        if retry_after is None and self.flood_probability and self._rng.random() < self.flood_probability:
+            retry_after = self.retry_after
+        if retry_after is None:
+            return None
+        self.stats["retry_after"] += 1
+        return {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after}}
+
+    async def _api(self, method, headers, body):
+        params, files = self._parse_body(headers, body)
+        params = self._register_uploads(params, files)
+        self.stats[method] += 1
+
+        flood = self._flood_response(method, params)
+        if flood:
+            return 429, flood
+        if method == "getUpdates":
+            updates = await self._get_updates(params)
+            self.telegram.calls[method] += 1
+            return 200, {"ok": True, "result": updates}
+        try:
+            result = self.telegram.handle(method, params)
+            if method == "getFile" and self.local_dir:
+                result["file_path"] = self._store_local(result["file_path"])
+            return 200, {"ok": True, "result": result}
+        except (KeyError, TypeError, ValueError, OSError) as e:
+            return 400, {"ok": False, "error_code": 400, "description": f"Bad Request: {e}"}
+
+    def _store_local(self, file_path):
+        """Файл на диске сервера, как в режиме --local; возвращается абсолютный путь"""
+        path = self.local_dir / file_path
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(self.telegram.file_content(file_path))
+        return str(path)
+
+    async def _delay(self, transferred=0):
+        delay = self.latency + self._rng.random() * self.jitter
+        if self.bandwidth:
+            delay += transferred / self.bandwidth
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def _dispatch(self, method, path, headers, body):
+        path = unquote(path.split("?", 1)[0])
+        if path.startswith("/file/bot"):
+            file_path = path[len("/file/bot"):].split("/", 1)[-1]
+            content = self.telegram.file_content(file_path)
+            await self._delay(len(content))
+            self.stats["file_download"] += 1
+            self.telegram.calls["file_download"] += 1
+            return 200, "application/octet-stream", content
+        if path.startswith("/bot"):
+            # Время передачи считается только для загрузок файлов
+            await self._delay(len(body) if headers.get("content-type", "").startswith("multipart/") else 0)
+            status, payload = await self._api(path.rsplit("/", 1)[-1], headers, body)
+            return status, "application/json", json.dumps(payload).encode()
+        if path == "/_inject" and method == "POST":
+            data = json.loads(body or b"[]")
+            ids = [self.inject(update) for update in (data if isinstance(data, list) else [data])]
+            return 200, "application/json", json.dumps({"ok": True, "result": ids}).encode()
+        if path == "/_stats":
+            payload = {"calls": dict(self.stats), "pending_updates": self.pending_updates}
+            return 200, "application/json", json.dumps(payload).encode()
+        return 404, "application/json", b'{"ok": false, "error_code": 404, "description": "Not Found"}'
+
+    @staticmethod
+    async def _read_request(reader):
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if not size:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            body = b"".join(chunks)
+        else:
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+        return method, path, headers, body
+
+    async def _handle_connection(self, reader, writer):
+        """HTTP/1.1 с keep-alive: httpx держит соединения в пуле"""
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                try:
+                    status, content_type, payload = await self._dispatch(method, path, headers, body)
+                except Exception as e:
+                    logger.error(f"Ошибка обработки {path}: {e}")
+                    status, content_type = 400, "application/json"
+                    payload = json.dumps({"ok": False, "error_code": 400, "description": str(e)}).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}\r\nContent-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def student_flow(factory, user_id, budget=1500):
+    """Обновления одного студента, создающего заказ (как в bench_conversation)"""
+    deadline = (datetime.now() + timedelta(days=10)).strftime("%d.%m.%Y")
+    return [
+        factory.command(user_id, "start"),
+        factory.callback(user_id, "user_create_order"),
+        factory.callback(user_id, "user_disc_math"),
+        factory.callback(user_id, "user_work_course"),
+        factory.text(user_id, deadline),
+        factory.callback(user_id, "user_set_budget"),
+        factory.text(user_id, str(budget)),
+        factory.callback(user_id, "user_plagiarism_no"),
+        factory.document(user_id, content=f"task of {user_id}".encode() * 512),
+        factory.callback(user_id, "user_upload_done"),
+        factory.callback(user_id, "user_skip_description"),
+    ]
+
+
+async def inject_students(server, students, interval):
+    """Диалоги студентов подаются вперемешку, по одному обновлению каждого за шаг"""
+    factory = UpdateFactory(telegram=server.telegram)
+    flows = [student_flow(factory, 10_000 + i) for i in range(students)]
+    for step in itertools.zip_longest(*flows):
+        for update in step:
+            if update:
+                server.inject(update)
+        if interval:
+            await asyncio.sleep(interval)
+
+
+async def serve(args):
+    server = TelegramServer(
+        FakeTelegram(), args.host, args.port, latency=args.latency / 1000, jitter=args.jitter / 1000,
+        chat_limit=args.chat_limit, global_limit=args.global_limit, flood_probability=args.flood_probability,
+        retry_after=args.retry_after, seed=args.seed, bandwidth=args.bandwidth * 1024 * 1024,
+        local_dir=args.local_dir,
+    )
+    await server.start()
+    print(f"Bot API: {server.base_url}\nФайлы:   {server.base_file_url}", flush=True)
+    if args.students:
+        asyncio.create_task(inject_students(server, args.students, args.interval / 1000))
+
+    previous = Counter()
+    try:
+        while True:
+            await asyncio.sleep(args.report_interval)
+            delta = server.stats - previous
+            previous = Counter(server.stats)
+            print(f"{datetime.now():%H:%M:%S} вызовов: {sum(delta.values())}, 429: {delta['retry_after']}, "
+                  f"в очереди обновлений: {server.pending_updates}", flush=True)
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная имитация Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, мс")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, мс")
+    parser.add_argument("--chat-limit", type=int, default=0, help="отправок в секунду в один чат до 429")
+    parser.add_argument("--global-limit", type=int, default=0, help="отправок в секунду всего до 429")
+    parser.add_argument("--flood-probability", type=float, default=0.0, help="доля отправок со случайным 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after для случайных 429, с")
+    parser.add_argument("--bandwidth", type=float, default=0.0,
+                        help="скорость передачи файлов на соединение, МБ/с (0 - без ограничения)")
+    parser.add_argument("--local-dir", help="режим --local: папка, в которой сервер хранит файлы")
+    parser.add_argument("--students", type=int, default=0, help="подать диалоги N студентов при запуске")
+    parser.add_argument("--interval", type=float, default=0.0, help="пауза между шагами диалогов, мс")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="период вывода статистики, с")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
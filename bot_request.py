@@ -0,0 +1,253 @@
+# bot_request.py - HTTP-клиент Bot API: замер времени, повторные попытки и автомат отключения
+import asyncio
+import importlib.util
+import json
+import logging
+import random
+import time
+from collections import Counter
+import httpx
+from telegram.error import NetworkError
+from telegram.request import BaseRequest, HTTPXRequest
+from config import Config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+API_RETRIES = metrics.Counter("bot_api_retries_total", "Повторные попытки запросов к Bot API",
+                              labels=("method", "reason"))
+API_REJECTED = metrics.Counter("bot_api_circuit_rejected_total",
+                               "Запросы, отклоненные без отправки при разомкнутой цепи", labels=("method",))
+
+# Время последнего успешного ответа по методам (для проверок состояния) и число запросов в полете
+_last_success = {}
+_in_flight = Counter()
+_last_started = {}
+
+# Методы, повтор которых не создаст дубликат (сообщения, платежа и т.п.)
+_IDEMPOTENT_PREFIXES = ("get", "answerCallbackQuery", "editMessage", "deleteMessage", "deleteWebhook", "setMy",
+                        "file_download")
+# Методы, которые передают файлы: они идут через отдельный пул соединений
+_MEDIA_METHODS = {"sendDocument", "sendPhoto", "sendVoice", "sendVideo", "sendAudio", "sendAnimation",
+                  "sendVideoNote", "sendMediaGroup", "file_download"}
+# Ошибки httpx, при которых запрос точно не дошел до Telegram
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class CircuitOpenError(NetworkError):
+    """Bot API недоступен: запрос отклонен без отправки"""
+
+
+class CircuitBreaker:
+    """Автомат отключения: после серии сетевых сбоев запросы отклоняются сразу
+
+    Через reset_timeout секунд пропускается один пробный запрос: успех замыкает
+    цепь, неудача снова размыкает ее.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probe_started = None
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def before_request(self, api_method):
+        if self.opened_at is None:
+            return
+        now = time.monotonic()
+        # Пробный запрос разрешается раз в reset_timeout, даже если предыдущий завис
+        if now - self.opened_at >= self.reset_timeout and (
+                self._probe_started is None or now - self._probe_started >= self.reset_timeout):
+            self._probe_started = now
+            return
+        API_REJECTED.inc(api_method)
+        raise CircuitOpenError("Bot API недоступен, запрос не отправлен")
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("Bot API снова доступен, цепь замкнута")
+        self.failures = 0
+        self.opened_at = None
+        self._probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.opened_at is not None:
+            # Неудачная проба: ждем следующего окна
+            self.opened_at = time.monotonic()
+            self._probe_started = None
+        elif self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            logger.error(f"Bot API недоступен ({self.failures} сбоев подряд), цепь разомкнута "
+                         f"на {self.reset_timeout} с")
+
+
+breaker = CircuitBreaker(Config.API_BREAKER_FAILURES, Config.API_BREAKER_RESET_S)
+metrics.gauge("bot_api_circuit_open", "Цепь Bot API разомкнута (1) или замкнута (0)", lambda: int(breaker.is_open))
+
+
+def _method_name(url):
+    """Метод Bot API из URL запроса (токен в метки не попадает)"""
+    if "/file/bot" in url:
+        return "file_download"
+    return url.rsplit('/', 1)[-1] or "unknown"
+
+
+def backoff_delay(attempt, base=None):
+    """Экспоненциальная пауза перед повтором attempt (с 0) со случайной добавкой"""
+    base = Config.API_BACKOFF_BASE if base is None else base
+    return min(Config.API_BACKOFF_MAX, base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def _retry_after(payload):
+    try:
+        return float(json.loads(payload)["parameters"]["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest с метриками, повторами и автоматом отключения для всех вызовов Bot API
+
+    Повторяются: ответы 429 (после паузы retry_after), сбои соединения, при
+    которых запрос не был отправлен, а для идемпотентных методов - также
+    таймауты и ответы 5xx. getUpdates не повторяется: у Updater свой цикл опроса.
+    """
+
+    async def _timed_request(self, api_method, url, method, request_data, read_timeout, write_timeout,
+                             connect_timeout, pool_timeout):
+        start = time.perf_counter()
+        _in_flight[api_method] += 1
+        _last_started[api_method] = time.time()
+        try:
+            status, payload = await super().do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout, pool_timeout=pool_timeout
+            )
+        except Exception as e:
+            metrics.API_ERRORS.inc(api_method, type(e).__name__)
+            raise
+        finally:
+            _in_flight[api_method] -= 1
+            metrics.API_LATENCY.observe(time.perf_counter() - start, api_method)
+
+        if status == 429:
+            metrics.API_RETRY_AFTER.inc(api_method)
+        elif status >= 400:
+            metrics.API_ERRORS.inc(api_method, str(status))
+        else:
+            _last_success[api_method] = time.time()
+        return status, payload
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = _method_name(url)
+        retries = Config.API_MAX_RETRIES if api_method != "getUpdates" else 0
+        idempotent = api_method.startswith(_IDEMPOTENT_PREFIXES)
+        attempt = 0
+        while True:
+            breaker.before_request(api_method)
+            try:
+                status, payload = await self._timed_request(api_method, url, method, request_data, read_timeout,
+                                                            write_timeout, connect_timeout, pool_timeout)
+            except NetworkError as e:
+                breaker.record_failure()
+                not_sent = isinstance(e.__cause__, _NOT_SENT_ERRORS)
+                if attempt >= retries or not (idempotent or not_sent):
+                    raise
+                reason, delay = type(e).__name__, backoff_delay(attempt)
+            else:
+                if status == 429:
+                    # Telegram отвечает, просто ограничивает частоту
+                    breaker.record_success()
+                    delay = _retry_after(payload)
+                    if attempt >= retries or delay is None or delay > Config.API_MAX_RETRY_AFTER:
+                        return status, payload
+                    reason = "retry_after"
+                elif status >= 500:
+                    breaker.record_failure()
+                    if attempt >= retries or not idempotent:
+                        return status, payload
+                    reason, delay = str(status), backoff_delay(attempt)
+                else:
+                    breaker.record_success()
+                    return status, payload
+
+            API_RETRIES.inc(api_method, reason)
+            attempt += 1
+            logger.warning(f"Повтор {api_method} ({reason}) через {delay:.1f} с, попытка {attempt + 1}")
+            await asyncio.sleep(delay)
+
+
+class RoutingRequest(BaseRequest):
+    """Два пула соединений: передача файлов и короткие управляющие вызовы
+
+    Большие загрузки и скачивания не занимают соединения, в очереди за которыми
+    ждут answerCallbackQuery и editMessageText. Число одновременных передач
+    файлов ограничено media_concurrency (0 - без ограничения).
+    """
+
+    def __init__(self, control, media, media_concurrency=0):
+        self.control = control
+        self.media = media
+        self._media_slots = asyncio.Semaphore(media_concurrency) if media_concurrency else None
+
+    @property
+    def read_timeout(self):
+        return self.control.read_timeout
+
+    async def initialize(self):
+        await self.control.initialize()
+        await self.media.initialize()
+
+    async def shutdown(self):
+        await self.control.shutdown()
+        await self.media.shutdown()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        kwargs = dict(request_data=request_data, read_timeout=read_timeout, write_timeout=write_timeout,
+                      connect_timeout=connect_timeout, pool_timeout=pool_timeout)
+        if _method_name(url) not in _MEDIA_METHODS and not (request_data and request_data.contains_files):
+            return await self.control.do_request(url, method, **kwargs)
+        if self._media_slots is None:
+            return await self.media.do_request(url, method, **kwargs)
+        async with self._media_slots:
+            return await self.media.do_request(url, method, **kwargs)
+
+
+def build_request():
+    """Клиент Bot API для бота: раздельные пулы, HTTP/2 для управляющих вызовов, если установлен h2"""
+    http_version = "2" if Config.API_HTTP2 and importlib.util.find_spec("h2") else "1.1"
+    control = InstrumentedRequest(
+        connection_pool_size=Config.API_CONTROL_POOL_SIZE, http_version=http_version,
+        connect_timeout=5.0, read_timeout=Config.API_CONTROL_TIMEOUT, write_timeout=Config.API_CONTROL_TIMEOUT,
+        pool_timeout=Config.API_CONTROL_TIMEOUT,
+    )
+    # Для файлов HTTP/1.1: большая загрузка в общем соединении HTTP/2 задерживала бы остальные потоки
+    media = InstrumentedRequest(
+        connection_pool_size=Config.API_MEDIA_POOL_SIZE, connect_timeout=5.0, read_timeout=Config.API_MEDIA_TIMEOUT,
+        write_timeout=Config.API_MEDIA_TIMEOUT, media_write_timeout=Config.API_MEDIA_TIMEOUT,
+        pool_timeout=Config.API_MEDIA_TIMEOUT,
+    )
+    return RoutingRequest(control, media, Config.API_MEDIA_CONCURRENCY)
+
+
+def last_success(api_method):
+    """Время (unix) последнего успешного запроса метода или None"""
+    return _last_success.get(api_method)
+
+
+def waiting_since(api_method):
+    """Время (unix) начала текущего запроса метода, если ответ еще не получен, иначе None"""
+    return _last_started.get(api_method) if _in_flight[api_method] > 0 else None
+
+
+def in_flight():
+    """Исходящие запросы к Bot API, ожидающие ответа (без длинного опроса getUpdates)"""
+    return sum(count for api_method, count in list(_in_flight.items()) if api_method != "getUpdates")
@@ -0,0 +1,184 @@
+# catchup.py - разбор обновлений, накопившихся за время простоя, перед запуском опроса
+#
+# Пока бот был остановлен, пользователи продолжали нажимать кнопки. Вместо
+# последовательной обработки всей очереди:
+#   - из нескольких нажатий на одно сообщение остается последнее;
+#   - нажатия, заведомо сделанные раньше CATCHUP_CALLBACK_MAX_AGE_S, получают короткий ответ без обработки;
+#   - остальное обрабатывается параллельно по пользователям (у одного пользователя по порядку).
+import asyncio
+import logging
+import time
+from collections import Counter
+from telegram.error import TelegramError
+from telegram.ext import Application
+from config import Config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CATCHUP_UPDATES = metrics.Counter("bot_catchup_updates_total", "Обновления, разобранные при догрузке после простоя",
+                                  labels=("action",))
+
+EXPIRED_TEXT = "⌛ Кнопка устарела. Откройте меню заново: /start"
+
+# Идет обработка накопившихся обновлений (antiflood ее не ограничивает)
+_running = False
+
+
+async def fetch_backlog(bot):
+    """Все неподтвержденные обновления (не больше CATCHUP_MAX_UPDATES)
+
+    Каждый следующий запрос с offset подтверждает предыдущую пачку, поэтому
+    опрос Updater начнется с обновлений, пришедших после догрузки.
+    """
+    updates = []
+    offset = None
+    while len(updates) < Config.CATCHUP_MAX_UPDATES:
+        limit = min(100, Config.CATCHUP_MAX_UPDATES - len(updates))
+        batch = await bot.get_updates(offset=offset, limit=limit, timeout=0)
+        if not batch:
+            break
+        updates.extend(batch)
+        offset = batch[-1].update_id + 1
+    if offset is not None and len(updates) >= Config.CATCHUP_MAX_UPDATES:
+        # Подтверждаем последнюю пачку; остальное получит обычный опрос
+        await bot.get_updates(offset=offset, limit=1, timeout=0)
+    return updates
+
+
+def _known_time(date):
+    # У недоступных сообщений дата равна 0
+    return date.timestamp() if date and date.timestamp() > 0 else None
+
+
+def _message_time(message):
+    """Время события сообщения: для правки - время правки, а не отправки"""
+    return _known_time(getattr(message, "edit_date", None) or message.date)
+
+
+def estimate_times(updates):
+    """Самое позднее возможное время обновлений: update_id -> unix-время или None
+
+    У нажатия кнопки нет времени. Дата сообщения с кнопкой - только нижняя
+    граница (старую карточку могли нажать только что), поэтому берется верхняя:
+    самое раннее время сообщений, пришедших в очереди после нажатия. Если таких
+    нет, время нажатия неизвестно.
+    """
+    times = {}
+    earliest_after = None
+    for update in reversed(updates):
+        if update.callback_query:
+            times[update.update_id] = earliest_after
+            continue
+        message = update.effective_message
+        sent = _message_time(message) if message else None
+        if sent:
+            earliest_after = min(earliest_after or sent, sent)
+        times[update.update_id] = sent
+    return times
+
+
+def _click_key(query):
+    """Пользователь и сообщение, на котором нажата кнопка"""
+    if query.inline_message_id:
+        return query.from_user.id, query.inline_message_id
+    if query.message:
+        return query.from_user.id, (query.message.chat.id, query.message.message_id)
+    return query.from_user.id, query.id
+
+
+def plan(updates, now=None):
+    """Разбор очереди: (к обработке, замененные нажатия, устаревшие нажатия)"""
+    now = now or time.time()
+    updates = sorted(updates, key=lambda update: update.update_id)
+    times = estimate_times(updates)
+
+    # Последнее нажатие на каждое сообщение
+    latest_click = {}
+    for update in updates:
+        query = update.callback_query
+        if query:
+            latest_click[_click_key(query)] = update.update_id
+
+    process, superseded, expired = [], [], []
+    for update in updates:
+        query = update.callback_query
+        if not query:
+            process.append(update)
+            continue
+        # Нажатие устарело, только если оно точно сделано раньше срока
+        clicked_before = times.get(update.update_id)
+        if latest_click[_click_key(query)] != update.update_id:
+            superseded.append(update)
+        elif clicked_before and now - clicked_before > Config.CATCHUP_CALLBACK_MAX_AGE_S:
+            expired.append(update)
+        else:
+            process.append(update)
+    return process, superseded, expired
+
+
+async def _answer(query, text=None):
+    try:
+        await query.answer(text)
+    except TelegramError as e:
+        # Слишком старые нажатия Telegram уже не принимает
+        logger.debug(f"Не удалось ответить на устаревшее нажатие {query.id}: {e}")
+
+
+async def _process_user(application, updates, slots, stats):
+    async with slots:
+        for update in updates:
+            try:
+                await application.process_update(update)
+                stats["processed"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                logger.error(f"Ошибка обработки обновления {update.update_id} при догрузке: {e}")
+
+
+def is_running():
+    """Обрабатываются ли сейчас накопившиеся за простой обновления"""
+    return _running
+
+
+async def run(application: Application):
+    """Догрузка и разбор накопившихся обновлений; возвращает статистику"""
+    global _running
+    if not Config.CATCHUP_ENABLED:
+        return {}
+    start = time.perf_counter()
+    try:
+        updates = await fetch_backlog(application.bot)
+    except TelegramError as e:
+        logger.error(f"Не удалось получить накопившиеся обновления: {e}")
+        return {}
+    if not updates:
+        return {}
+
+    process, superseded, expired = plan(updates)
+    stats = Counter(fetched=len(updates), superseded=len(superseded), expired=len(expired))
+
+    answers = [_answer(update.callback_query) for update in superseded]
+    answers += [_answer(update.callback_query, EXPIRED_TEXT) for update in expired]
+
+    # Обновления одного пользователя обрабатываются по порядку, разные пользователи - параллельно
+    by_user = {}
+    for update in process:
+        key = update.effective_user.id if update.effective_user else update.update_id
+        by_user.setdefault(key, []).append(update)
+    slots = asyncio.Semaphore(max(1, Config.CATCHUP_CONCURRENCY))
+    _running = True
+    try:
+        await asyncio.gather(*answers, *(_process_user(application, user_updates, slots, stats)
+                                         for user_updates in by_user.values()))
+    finally:
+        _running = False
+
+    for action in ("processed", "failed", "superseded", "expired"):
+        if stats[action]:
+            CATCHUP_UPDATES.inc(action, amount=stats[action])
+    stats["duration_s"] = round(time.perf_counter() - start, 3)
+    logger.info(f"Догрузка после простоя: получено {stats['fetched']}, обработано {stats['processed']}, "
+                f"ошибок {stats['failed']}, замененных нажатий {stats['superseded']}, "
+                f"устаревших нажатий {stats['expired']} за {stats['duration_s']} с")
+    return dict(stats)
@@ -6,15 +6,118 @@ load_dotenv()
 
 class Config:
     TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+    # Адреса Bot API (для локальной имитации или собственного сервера)
+    BOT_API_URL = os.getenv('TELEGRAM_BOT_API_URL', 'https://api.telegram.org/bot')
+    BOT_FILE_URL = os.getenv('TELEGRAM_BOT_FILE_URL', 'https://api.telegram.org/file/bot')
+    # Собственный сервер telegram-bot-api в режиме --local: файлы берутся с его диска, а не
+    # скачиваются, загрузки передаются путем к файлу, лимит размера файла - 2000 МБ
+    BOT_API_LOCAL = os.getenv('TELEGRAM_BOT_API_LOCAL', 'False').lower() == 'true'
+    # Папка данных сервера и путь к ней у бота, если они различаются (например, в контейнере)
+    BOT_API_LOCAL_DIR = os.getenv('TELEGRAM_BOT_API_LOCAL_DIR', '')
+    BOT_API_LOCAL_MOUNT = os.getenv('TELEGRAM_BOT_API_LOCAL_MOUNT', '')
+    # Переносить файлы из папки сервера в хранилище. Сервер в режиме --local свои копии не удаляет,
+    # поэтому при False (жесткая ссылка) очистка не освобождает место: папку сервера чистят отдельно
+    BOT_API_LOCAL_MOVE = os.getenv('TELEGRAM_BOT_API_LOCAL_MOVE', 'True').lower() == 'true'
     ADMIN_ID = int(os.getenv('ADMIN_ID'))
     DB_NAME = os.getenv('DB_NAME', 'orders.db')
     MAX_ACTIVE_ORDERS = int(os.getenv('MAX_ACTIVE_ORDERS', 3))
     MIN_BUDGET = int(os.getenv('MIN_BUDGET', 0))
-    MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', 20971520))
+    # Лимит Bot API на скачивание ботом: 20 МБ, у собственного сервера - 2000 МБ
+    MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', 2097152000 if BOT_API_LOCAL else 20971520))
+    # Квоты на объем загруженных файлов (в байтах); с собственным сервером они увеличены,
+    # чтобы в заказ помещалось хотя бы два файла максимального размера
+    MAX_USER_STORAGE = int(os.getenv('MAX_USER_STORAGE', 8388608000 if BOT_API_LOCAL else 209715200))
+    MAX_ORDER_STORAGE = int(os.getenv('MAX_ORDER_STORAGE', 4194304000 if BOT_API_LOCAL else 104857600))
     BASE_UPLOAD_FOLDER = "uploads"
     COMPLETED_FOLDER = "completed_work"
+    # Общее хранилище содержимого файлов (по SHA-256), папки заказов ссылаются на него
+    BLOB_FOLDER = "blobs"
     MAX_MESSAGE_LENGTH = 4096
     MAX_FILES_PER_MESSAGE = 10
+    # Сроки хранения файлов для ежедневной очистки
+    COMPLETED_RETENTION_DAYS = int(os.getenv('COMPLETED_RETENTION_DAYS', 30))
+    CANCELLED_RETENTION_DAYS = int(os.getenv('CANCELLED_RETENTION_DAYS', 7))
+    VOICE_RETENTION_DAYS = int(os.getenv('VOICE_RETENTION_DAYS', 30))
+    ORPHAN_GRACE_HOURS = int(os.getenv('ORPHAN_GRACE_HOURS', 24))
+    CLEANUP_BATCH_SIZE = int(os.getenv('CLEANUP_BATCH_SIZE', 100))
+    # Количество потоков для файловых операций
+    FS_WORKERS = int(os.getenv('FS_WORKERS', 4))
+    # Количество потоков для чтения из БД (database.read)
+    DB_READ_WORKERS = int(os.getenv('DB_READ_WORKERS', 4))
+    # Окно сбора файлов альбома (в секундах) и лимит параллельных загрузок
+    MEDIA_GROUP_WINDOW = float(os.getenv('MEDIA_GROUP_WINDOW', 1.0))
+    MAX_PARALLEL_DOWNLOADS = int(os.getenv('MAX_PARALLEL_DOWNLOADS', 4))
+    # Пакетная запись истории переписки и размер страницы просмотра
+    HISTORY_FLUSH_INTERVAL = int(os.getenv('HISTORY_FLUSH_INTERVAL', 5))
+    HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', 50))
+    HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 10))
+    # Сколько пересланных сообщений помнить для ответов через reply
+    RELAY_MAP_SIZE = int(os.getenv('RELAY_MAP_SIZE', 5000))
+    # Повторы запросов к Bot API: число повторов, экспоненциальная пауза (база и предел, с),
+    # максимальный retry_after, который имеет смысл ждать, и автомат отключения (сбоев подряд, пауза в с)
+    API_MAX_RETRIES = int(os.getenv('API_MAX_RETRIES', 3))
+    API_BACKOFF_BASE = float(os.getenv('API_BACKOFF_BASE', 0.5))
+    API_BACKOFF_MAX = float(os.getenv('API_BACKOFF_MAX', 10))
+    API_MAX_RETRY_AFTER = float(os.getenv('API_MAX_RETRY_AFTER', 30))
+    API_BREAKER_FAILURES = int(os.getenv('API_BREAKER_FAILURES', 5))
+    API_BREAKER_RESET_S = float(os.getenv('API_BREAKER_RESET_S', 30))
+    # Пулы соединений Bot API: управляющие вызовы и передача файлов (размер пула и таймаут в с),
+    # число одновременных передач файлов (0 - без ограничения) и HTTP/2 (если установлен пакет h2)
+    API_CONTROL_POOL_SIZE = int(os.getenv('API_CONTROL_POOL_SIZE', 64))
+    API_CONTROL_TIMEOUT = float(os.getenv('API_CONTROL_TIMEOUT', 10))
+    API_MEDIA_POOL_SIZE = int(os.getenv('API_MEDIA_POOL_SIZE', 8))
+    API_MEDIA_TIMEOUT = float(os.getenv('API_MEDIA_TIMEOUT', 120))
+    API_MEDIA_CONCURRENCY = int(os.getenv('API_MEDIA_CONCURRENCY', 4))
+    API_HTTP2 = os.getenv('API_HTTP2', 'True').lower() == 'true'
+    # Ограничение частоты запросов пользователя: запросов в секунду (0 отключает), запас подряд,
+    # число отброшенных за минуту запросов до блокировки и ее длительность в секундах
+    FLOOD_RATE = float(os.getenv('FLOOD_RATE', 2))
+    FLOOD_BURST = int(os.getenv('FLOOD_BURST', 10))
+    FLOOD_BAN_THRESHOLD = int(os.getenv('FLOOD_BAN_THRESHOLD', 30))
+    FLOOD_BAN_SECONDS = int(os.getenv('FLOOD_BAN_SECONDS', 300))
+    # Параллельная обработка обновлений: общее число мест и сколько из них доступно только
+    # администратору и платежным решениям (обновления одного пользователя идут по порядку)
+    UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', 32))
+    UPDATE_RESERVED_SLOTS = int(os.getenv('UPDATE_RESERVED_SLOTS', 4))
+    # Догрузка обновлений, накопившихся за время простоя: лимит их числа, возраст нажатия кнопки
+    # (в секундах), после которого оно не обрабатывается, и число пользователей, обрабатываемых
+    # одновременно
+    CATCHUP_ENABLED = os.getenv('CATCHUP_ENABLED', 'True').lower() == 'true'
+    CATCHUP_MAX_UPDATES = int(os.getenv('CATCHUP_MAX_UPDATES', 5000))
+    CATCHUP_CALLBACK_MAX_AGE_S = int(os.getenv('CATCHUP_CALLBACK_MAX_AGE_S', 3600))
+    CATCHUP_CONCURRENCY = int(os.getenv('CATCHUP_CONCURRENCY', 16))
+    # Локальный HTTP-эндпоинт метрик Prometheus (порт 0 отключает его)
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', 9101))
+    # Проверки /live, /ready и /health для супервизора (порт 0 отключает их): допустимая задержка
+    # цикла событий, возраст последнего успешного getUpdates и ожидание блокировки БД (в секундах)
+    HEALTH_HOST = os.getenv('HEALTH_HOST', '127.0.0.1')
+    HEALTH_PORT = int(os.getenv('HEALTH_PORT', 9102))
+    HEALTH_MAX_LAG_S = float(os.getenv('HEALTH_MAX_LAG_S', 10))
+    HEALTH_MAX_POLL_AGE_S = float(os.getenv('HEALTH_MAX_POLL_AGE_S', 120))
+    HEALTH_DB_TIMEOUT_S = float(os.getenv('HEALTH_DB_TIMEOUT_S', 2))
+    # Выборочное профилирование обработчиков: доля вызовов (0 - выключено) и период снимков стека
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_INTERVAL_MS = int(os.getenv('PROFILE_INTERVAL_MS', 5))
+    # Контроль блокировок цикла событий: порог (0 - выключено), период проверки и время отчета
+    LAG_THRESHOLD_MS = int(os.getenv('LAG_THRESHOLD_MS', 250))
+    LAG_CHECK_INTERVAL_MS = int(os.getenv('LAG_CHECK_INTERVAL_MS', 100))
+    LAG_REPORT_TIME = os.getenv('LAG_REPORT_TIME', '09:00')
+    # Журнал медленных запросов к БД: порог в мс (0 - выключено) и сколько записей хранить
+    SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 100))
+    SLOW_QUERY_KEEP = int(os.getenv('SLOW_QUERY_KEEP', 10000))
+    # Журнал: уровень, файл JSON (пусто - только консоль), ротация по размеру и времени (0 - только по размеру)
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10485760))
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 10))
+    LOG_ROTATE_HOURS = int(os.getenv('LOG_ROTATE_HOURS', 24))
+    # Доля подробных отладочных записей (например, полных данных заказа)
+    LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 0.01))
+    # Запись входящих обновлений для воспроизведения (пусто - выключено; путь может содержать %Y%m%d)
+    RECORD_UPDATES_PATH = os.getenv('RECORD_UPDATES_PATH', '')
+    # Ключ псевдонимов id в записи; без него псевдонимы меняются при каждом запуске
+    RECORD_SALT = os.getenv('RECORD_SALT', '')
 
     # Новые атрибуты для резервного копирования и 2FA
     BACKUP_ENABLED = os.getenv('BACKUP_ENABLED', 'False').lower() == 'true'
@@ -1,11 +1,174 @@
+import asyncio
+import copy
+import itertools
 import sqlite3
 import logging
+import random
+import re
+import sys
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+# Списки параметров IN (?, ?, ...) разной длины считаются одним запросом
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+# Кадры стека, которые пропускаются при поиске функции, выполнившей запрос
+_TIMING_FRAMES = {"_begin", "execute", "executemany"}
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+
+def _query_shape(sql):
+    return _IN_LIST.sub("(?, ...)", " ".join(sql.split()))
+
+
+class _TimedCursor(sqlite3.Cursor):
+    """Курсор, который замеряет запрос вместе с чтением его результатов"""
+
+    def __init__(self, connection):
+        super().__init__(connection)
+        # [sql, параметры, executemany, время, прочитано строк, функция]
+        self._statement = None
+
+    def _begin(self, sql, parameters, many):
+        self._finish()
+        frame = sys._getframe(1)
+        while frame.f_back is not None and frame.f_code.co_name in _TIMING_FRAMES:
+            frame = frame.f_back
+        self._statement = [sql, parameters, many, 0.0, 0, frame.f_code.co_name]
+
+    def _finish(self):
+        """Запрос завершен (следующий запрос или закрытие соединения): проверка порога"""
+        statement, self._statement = self._statement, None
+        if statement is None:
+            return
+        sql, parameters, many, elapsed, fetched, function = statement
+        if elapsed * 1000 >= Config.SLOW_QUERY_MS:
+            rows = self.rowcount if self.rowcount >= 0 else fetched
+            self.connection._record_slow(sql, parameters, many, elapsed, rows, function)
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._statement is not None:
+                self._statement[3] += time.perf_counter() - start
+
+    def execute(self, sql, parameters=()):
+        self._begin(sql, parameters, False)
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        # Параметры нужны еще и для EXPLAIN, поэтому генератор превращается в список
+        seq_of_parameters = list(seq_of_parameters)
+        self._begin(sql, seq_of_parameters, True)
+        return self._timed(super().executemany, sql, seq_of_parameters)
+
+    def _count(self, rows):
+        if self._statement is not None:
+            self._statement[4] += rows
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        self._count(row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._count(len(rows))
+        return rows
+
+    def __next__(self):
+        row = self._timed(super().__next__)
+        self._count(1)
+        return row
+
+
+# Версия данных: меняется при каждом commit, чтобы совместное чтение не вернуло данные до записи
+_versions = itertools.count(1)
+_data_version = 0
+
+
+class _TrackedConnection(sqlite3.Connection):
+    """Соединение, которое отмечает каждую запись для совместных чтений (read)"""
+
+    def commit(self):
+        global _data_version
+        super().commit()
+        _data_version = next(_versions)
+
+
+class _TimedConnection(_TrackedConnection):
+    """Соединение, которое собирает медленные запросы и сохраняет их после закрытия"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cursors = weakref.WeakSet()
+        self._slow = []
+
+    def cursor(self, factory=_TimedCursor):
+        cursor = super().cursor(factory)
+        self._cursors.add(cursor)
+        return cursor
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def _record_slow(self, sql, parameters, many, elapsed, rows, function):
+        bound = (parameters[0] if parameters else ()) if many else parameters
+        plan = ""
+        if sql.lstrip()[:7].upper().startswith(_EXPLAINABLE):
+            try:
+                # Обычный курсор: сам EXPLAIN не замеряется
+                details = sqlite3.Cursor(self).execute(f"EXPLAIN QUERY PLAN {sql}", bound).fetchall()
+                plan = "\n".join(str(row[3]) for row in details)
+            except sqlite3.Error as e:
+                plan = f"(не удалось получить план: {e})"
+        self._slow.append((function, _query_shape(sql), len(bound), len(parameters) if many else 1, rows,
+                           round(elapsed * 1000, 3), plan, datetime.now().isoformat()))
+        logger.warning(f"Медленный запрос {elapsed * 1000:.0f} мс в {function}: {_query_shape(sql)[:200]}")
+
+    def close(self):
+        try:
+            for cursor in list(self._cursors):
+                cursor._finish()
+        finally:
+            super().close()
+        if self._slow:
+            _save_slow_queries(self._slow)
+            self._slow = []
+
+
+def _save_slow_queries(records):
+    """Запись медленных запросов отдельным соединением без замеров"""
+    conn = None
+    try:
+        conn = sqlite3.connect(Config.DB_NAME, timeout=1)
+        conn.executemany("INSERT INTO slow_queries (function, sql, params_count, batch_size, rows, duration_ms, "
+                         "plan, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", records)
+        # Храним только последние SLOW_QUERY_KEEP записей
+        conn.execute("DELETE FROM slow_queries WHERE id <= (SELECT MAX(id) FROM slow_queries) - ?",
+                     (Config.SLOW_QUERY_KEEP,))
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка сохранения медленных запросов: {e}")
+    finally:
+        if conn:
+            conn.close()
+
 
 def init_db():
     """Инициализация базы данных"""
@@ -13,6 +176,9 @@ def init_db():
         conn = sqlite3.connect(Config.DB_NAME)
         c = conn.cursor()
 
+        # Журнал WAL: чтения в пуле database.read не блокируют записи из цикла событий
+        c.execute("PRAGMA journal_mode=WAL")
+
         # Таблица заказов
         c.execute('''CREATE TABLE IF NOT EXISTS orders (
             order_id TEXT PRIMARY KEY,
@@ -39,7 +205,9 @@ def init_db():
             rating INTEGER DEFAULT 0,
             feedback TEXT DEFAULT '',
             completed_at TEXT,
-            tags TEXT DEFAULT ''
+            tags TEXT DEFAULT '',
+            cancelled_at TEXT,
+            files_reaped_at TEXT
         )''')
 
         # Таблица для логирования действий администратора
@@ -68,20 +236,54 @@ def init_db():
             category TEXT DEFAULT 'general'
         )''')
 
+        # Таблица содержимого файлов (дедупликация по SHA-256)
+        c.execute('''CREATE TABLE IF NOT EXISTS file_blobs (
+            sha256 TEXT PRIMARY KEY,
+            size INTEGER,
+            ref_count INTEGER DEFAULT 0,
+            file_unique_id TEXT,
+            created_at TEXT
+        )''')
+
+        # Таблица ссылок из папок заказов на содержимое файлов
+        c.execute('''CREATE TABLE IF NOT EXISTS file_refs (
+            path TEXT PRIMARY KEY,
+            sha256 TEXT
+        )''')
+
+        # Таблица медленных запросов с планами выполнения
+        c.execute('''CREATE TABLE IF NOT EXISTS slow_queries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            function TEXT,
+            sql TEXT,
+            params_count INTEGER,
+            batch_size INTEGER,
+            rows INTEGER,
+            duration_ms REAL,
+            plan TEXT,
+            created_at TEXT
+        )''')
+
         # Создаем индексы для улучшения производительности
         c.execute('''CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders (user_id)''')
         c.execute('''CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status)''')
         c.execute('''CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_orders_status_completed_at ON orders (status, completed_at)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_orders_status_created_at ON orders (status, created_at)''')
         c.execute('''CREATE INDEX IF NOT EXISTS idx_admin_logs_admin_id ON admin_logs (admin_id)''')
         c.execute('''CREATE INDEX IF NOT EXISTS idx_admin_logs_timestamp ON admin_logs (timestamp)''')
         c.execute('''CREATE INDEX IF NOT EXISTS idx_message_history_order_id ON message_history (order_id)''')
         c.execute('''CREATE INDEX IF NOT EXISTS idx_response_templates_category ON response_templates (category)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_file_blobs_unique_id ON file_blobs (file_unique_id)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_file_refs_sha256 ON file_refs (sha256)''')
 
         # Проверяем и добавляем отсутствующие столбцы
         columns_to_add = [
             ('completed_at', 'TEXT'),
             ('payment_status', 'TEXT DEFAULT "unpaid"'),
             ('tags', 'TEXT DEFAULT ""'),
+            ('cancelled_at', 'TEXT'),
+            ('files_reaped_at', 'TEXT'),
             # Добавьте другие столбцы по необходимости
         ]
 
@@ -92,6 +294,23 @@ def init_db():
                 # Столбец уже существует
                 pass
 
+        # Отмененным до появления cancelled_at заказам срок хранения отсчитывается с момента обновления
+        c.execute("UPDATE orders SET cancelled_at = ? WHERE status = 'cancelled' AND cancelled_at IS NULL",
+                  (datetime.now().isoformat(),))
+
+        # Индексы очистки: только заказы, файлы которых еще не удалялись
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_orders_reaper_completed
+                     ON orders (status, files_reaped_at, completed_at)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_orders_reaper_cancelled
+                     ON orders (status, files_reaped_at, cancelled_at)''')
+
+        # Тип сообщения и file_id Telegram для пересланных медиа
+        for column_name, column_type in [('message_type', "TEXT DEFAULT 'text'"), ('file_id', "TEXT DEFAULT ''")]:
+            try:
+                c.execute(f"ALTER TABLE message_history ADD COLUMN {column_name} {column_type}")
+            except sqlite3.OperationalError:
+                pass
+
         # Добавляем несколько базовых шаблонов ответов
         default_templates = [
             ("Приветствие",
@@ -125,7 +344,9 @@ def init_db():
 def get_connection():
     """Получение соединения с базой данных"""
     try:
-        conn = sqlite3.connect(Config.DB_NAME)
+        # При SLOW_QUERY_MS > 0 каждый запрос замеряется, медленные попадают в slow_queries
+        factory = _TimedConnection if Config.SLOW_QUERY_MS > 0 else _TrackedConnection
+        conn = sqlite3.connect(Config.DB_NAME, factory=factory)
         conn.row_factory = sqlite3.Row
         return conn
     except Exception as e:
@@ -133,6 +354,57 @@ def get_connection():
         raise
 
 
+# Чтения вне цикла событий: отдельный пул и выполняющиеся сейчас вызовы
+# (функция, аргументы) -> [версия данных, future, число присоединившихся].
+# Ключ - сам объект функции: одноименные функции разных модулей не смешиваются
+_read_executor = ThreadPoolExecutor(max_workers=Config.DB_READ_WORKERS, thread_name_prefix="db-read")
+_in_flight_reads = {}
+read_stats = {'executed': 0, 'shared': 0}
+
+
+def _copy_rows(result):
+    """Копия результата чтения для участника: строки (словари) копируются, значения нет"""
+    if isinstance(result, list):
+        return [dict(row) if isinstance(row, dict) else row for row in result]
+    if isinstance(result, dict):
+        return dict(result)
+    return copy.deepcopy(result)
+
+
+async def read(func, *args):
+    """Тяжелое чтение из БД в пуле потоков с объединением одинаковых одновременных вызовов
+
+    Только для выборок по всей таблице (списки заказов администратора): они
+    занимают десятки миллисекунд и не должны задерживать цикл событий, а
+    одинаковые запросы от повторных нажатий выполняются один раз. Точечные
+    чтения по индексу быстрее выполнить сразу, чем передавать в поток.
+    func должна только читать: без записей и без изменения состояния модуля.
+
+    Если такой же вызов (та же функция и аргументы) уже выполняется и с его начала
+    не было записей, новый вызов ждет его результата, а не повторяет запрос.
+    Каждый участник получает собственную копию строк результата.
+    """
+    key = (func, args)
+    entry = _in_flight_reads.get(key)
+    if entry and entry[0] == _data_version and not entry[1].done():
+        entry[2] += 1
+        read_stats['shared'] += 1
+        return _copy_rows(await asyncio.shield(entry[1]))
+
+    future = asyncio.get_running_loop().run_in_executor(_read_executor, func, *args)
+    entry = _in_flight_reads[key] = [_data_version, future, 0]
+
+    def _forget(_):
+        if _in_flight_reads.get(key) is entry:
+            del _in_flight_reads[key]
+
+    future.add_done_callback(_forget)
+    read_stats['executed'] += 1
+    result = await asyncio.shield(future)
+    # Исходный объект не отдается никому, если результат разделен с другими вызовами
+    return _copy_rows(result) if entry[2] else result
+
+
 def log_admin_action(admin_id, action, order_id=None):
     """Логирование действий администратора"""
     try:
@@ -163,8 +435,9 @@ def save_order_to_db(order_data):
         conn = get_connection()
         c = conn.cursor()
 
-        # Добавьте отладочную информацию
-        logger.info(f"Сохранение заказа: {order_data}")
+        # Полные данные заказа пишутся только в выборочные отладочные записи
+        if logger.isEnabledFor(logging.DEBUG) and random.random() < Config.LOG_DEBUG_SAMPLE_RATE:
+            logger.debug(f"Сохранение заказа: {order_data}")
 
         # Проверяем, существует ли уже заказ с таким ID
         c.execute("SELECT order_id FROM orders WHERE order_id = ?", (order_data['order_id'],))
@@ -314,6 +587,10 @@ def update_order_status(order_id, status):
             completed_at = datetime.now().isoformat()
             c.execute("UPDATE orders SET status = ?, completed_at = ? WHERE order_id = ?",
                       (status, completed_at, order_id))
+        elif status == 'cancelled':
+            # Срок хранения файлов отмененного заказа отсчитывается от отмены
+            c.execute("UPDATE orders SET status = ?, cancelled_at = ?, files_reaped_at = NULL WHERE order_id = ?",
+                      (status, datetime.now().isoformat(), order_id))
         else:
             c.execute("UPDATE orders SET status = ? WHERE order_id = ?", (status, order_id))
 
@@ -325,13 +602,17 @@ def update_order_status(order_id, status):
         conn.close()
 
 
+def completed_files_value(files):
+    """Значение поля completed_files: имена файлов через запятую"""
+    return ",".join([Path(f).name for f in files]) if files else ""
+
+
 def update_order_completed_files(order_id, files):
     """Обновление списка выполненных файлов заказа"""
     try:
         conn = get_connection()
         c = conn.cursor()
-        files_str = ",".join([Path(f).name for f in files]) if files else ""
-        c.execute("UPDATE orders SET completed_files = ? WHERE order_id = ?", (files_str, order_id))
+        c.execute("UPDATE orders SET completed_files = ? WHERE order_id = ?", (completed_files_value(files), order_id))
         conn.commit()
         logger.info(f"Обновлены выполненные файлы для заказа {order_id}")
     except Exception as e:
@@ -382,6 +663,32 @@ def update_order_tags(order_id, tags):
         conn.close()
 
 
+# Поля заказа, которые можно менять через update_order_fields
+_ORDER_FIELDS = ("final_amount", "status", "completed_at", "cancelled_at", "files_reaped_at", "completed_files",
+                 "payment_status", "payment_url", "tags")
+
+
+def update_order_fields(order_id, fields):
+    """Обновление нескольких полей заказа одним запросом"""
+    unknown = set(fields) - set(_ORDER_FIELDS)
+    if unknown:
+        raise ValueError(f"Неизвестные поля заказа: {', '.join(sorted(unknown))}")
+    if not fields:
+        return
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        c.execute(f"UPDATE orders SET {assignments} WHERE order_id = ?", (*fields.values(), order_id))
+        conn.commit()
+        # Значения (платежные ссылки, имена файлов) в лог не попадают, как и у однопольных обновлений
+        logger.info(f"Заказ {order_id} обновлен: {', '.join(fields)}")
+    except Exception as e:
+        logger.error(f"Ошибка обновления заказа: {e}")
+    finally:
+        conn.close()
+
+
 def get_user_active_orders_count(user_id):
     """Получение количества активных заказов пользователя"""
     try:
@@ -434,14 +741,18 @@ def delete_order(order_id):
         conn.close()
 
 
-def save_message_to_history(order_id, sender_type, message_text):
-    """Сохранение сообщения в историю"""
+def save_message_to_history(order_id, sender_type, message_text, message_type="text", file_id=""):
+    """Сохранение сообщения в историю
+
+    Для медиа сохраняется file_id, по которому файл можно отправить повторно без загрузки.
+    """
     try:
         conn = get_connection()
         c = conn.cursor()
         timestamp = datetime.now().isoformat()
-        c.execute("INSERT INTO message_history (order_id, sender_type, message_text, timestamp) VALUES (?, ?, ?, ?)",
-                  (order_id, sender_type, message_text, timestamp))
+        c.execute("INSERT INTO message_history (order_id, sender_type, message_text, timestamp, message_type, file_id) "
+                  "VALUES (?, ?, ?, ?, ?, ?)",
+                  (order_id, sender_type, message_text, timestamp, message_type, file_id or ""))
         conn.commit()
         logger.info(f"Сообщение для заказа {order_id} сохранено в историю")
     except Exception as e:
@@ -465,6 +776,72 @@ def get_message_history(order_id):
         conn.close()
 
 
+# Сообщения переписки, ожидающие записи в message_history
+_pending_history = []
+
+
+def queue_message_to_history(order_id, sender_type, message_text, message_type="text", file_id=""):
+    """Постановка сообщения в очередь на запись в историю
+
+    Очередь записывается одной транзакцией задачей flush_message_history
+    или сразу при накоплении Config.HISTORY_BATCH_SIZE сообщений.
+    """
+    _pending_history.append((order_id, sender_type, message_text, datetime.now().isoformat(),
+                             message_type, file_id or ""))
+    if len(_pending_history) >= Config.HISTORY_BATCH_SIZE:
+        flush_message_history()
+
+
+def flush_message_history():
+    """Запись накопленных сообщений в историю одной транзакцией"""
+    if not _pending_history:
+        return 0
+
+    batch = _pending_history[:]
+    del _pending_history[:len(batch)]
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.executemany("INSERT INTO message_history (order_id, sender_type, message_text, timestamp, message_type, "
+                      "file_id) VALUES (?, ?, ?, ?, ?, ?)", batch)
+        conn.commit()
+        return len(batch)
+    except Exception as e:
+        # Возвращаем сообщения в очередь, чтобы записать их при следующей попытке
+        _pending_history[:0] = batch
+        logger.error(f"Ошибка записи истории сообщений: {e}")
+        return 0
+    finally:
+        conn.close()
+
+
+def get_message_history_page(order_id, before_id=None, limit=10):
+    """Страница истории сообщений заказа, от новых к старым
+
+    Пагинация по ключу: следующая страница запрашивается с before_id, равным
+    id последнего показанного сообщения, поэтому запрос не зависит от длины
+    переписки. Индекс по order_id хранит rowid (id), сортировка берется из него.
+    Возвращает (сообщения, есть ли более старые).
+    """
+    flush_message_history()
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        if before_id:
+            c.execute("SELECT * FROM message_history WHERE order_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                      (order_id, before_id, limit + 1))
+        else:
+            c.execute("SELECT * FROM message_history WHERE order_id = ? ORDER BY id DESC LIMIT ?",
+                      (order_id, limit + 1))
+        messages = [dict(message) for message in c.fetchall()]
+        return messages[:limit], len(messages) > limit
+    except Exception as e:
+        logger.error(f"Ошибка получения истории сообщений: {e}")
+        return [], False
+    finally:
+        conn.close()
+
+
 def get_response_templates(category=None):
     """Получение шаблонов ответов"""
     try:
@@ -529,4 +906,169 @@ def get_orders_by_tags(tags):
         logger.error(f"Ошибка получения заказов по тегам: {e}")
         return []
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+def get_blob_by_unique_id(file_unique_id):
+    """Поиск сохраненного содержимого по file_unique_id Telegram"""
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute("SELECT * FROM file_blobs WHERE file_unique_id = ? AND ref_count > 0", (file_unique_id,))
+        blob = c.fetchone()
+        return dict(blob) if blob else None
+    except Exception as e:
+        logger.error(f"Ошибка поиска файла в хранилище: {e}")
+        return None
+    finally:
+        conn.close()
+
+
+def add_file_reference(path, sha256, size, file_unique_id=None):
+    """Регистрация ссылки из папки заказа на содержимое файла"""
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute("INSERT OR IGNORE INTO file_blobs (sha256, size, ref_count, file_unique_id, created_at) "
+                  "VALUES (?, ?, 0, ?, ?)", (sha256, size, file_unique_id, datetime.now().isoformat()))
+        c.execute("INSERT OR REPLACE INTO file_refs (path, sha256) VALUES (?, ?)", (path, sha256))
+        c.execute("UPDATE file_blobs SET ref_count = ref_count + 1, "
+                  "file_unique_id = COALESCE(file_unique_id, ?) WHERE sha256 = ?", (file_unique_id, sha256))
+        conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка регистрации ссылки на файл: {e}")
+        return False
+    finally:
+        conn.close()
+
+
+def release_file_references(folder):
+    """Удаление ссылок на файлы из папки
+
+    Возвращает SHA-256 содержимого, на которое больше никто не ссылается.
+    """
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        prefix = str(folder).rstrip('/') + '/'
+        c.execute("SELECT path, sha256 FROM file_refs WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+        refs = c.fetchall()
+        if not refs:
+            return []
+
+        c.executemany("DELETE FROM file_refs WHERE path = ?", [(ref['path'],) for ref in refs])
+        c.executemany("UPDATE file_blobs SET ref_count = ref_count - 1 WHERE sha256 = ?",
+                      [(ref['sha256'],) for ref in refs])
+
+        hashes = list({ref['sha256'] for ref in refs})
+        placeholders = ','.join(['?'] * len(hashes))
+        c.execute(f"SELECT sha256 FROM file_blobs WHERE ref_count <= 0 AND sha256 IN ({placeholders})", hashes)
+        orphaned = [row['sha256'] for row in c.fetchall()]
+        if orphaned:
+            c.executemany("DELETE FROM file_blobs WHERE sha256 = ?", [(sha256,) for sha256 in orphaned])
+
+        conn.commit()
+        return orphaned
+    except Exception as e:
+        logger.error(f"Ошибка освобождения ссылок на файлы: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+def get_expired_completed_orders(before):
+    """Получение завершенных заказов, выполненных раньше указанной даты, файлы которых еще не удалены"""
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute("SELECT order_id, user_id FROM orders WHERE status = 'completed' AND files_reaped_at IS NULL "
+                  "AND completed_at < ?", (before.isoformat(),))
+        return [dict(order) for order in c.fetchall()]
+    except Exception as e:
+        logger.error(f"Ошибка получения устаревших заказов: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+def get_stale_cancelled_orders(before):
+    """Получение заказов, отмененных раньше указанной даты, файлы которых еще не удалены"""
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute("SELECT order_id, user_id FROM orders WHERE status = 'cancelled' AND files_reaped_at IS NULL "
+                  "AND cancelled_at < ?", (before.isoformat(),))
+        return [dict(order) for order in c.fetchall()]
+    except Exception as e:
+        logger.error(f"Ошибка получения отмененных заказов: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+def mark_orders_reaped(order_ids):
+    """Отметка заказов, файлы которых удалены очисткой"""
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        reaped_at = datetime.now().isoformat()
+        c.executemany("UPDATE orders SET files_reaped_at = ? WHERE order_id = ?",
+                      [(reaped_at, order_id) for order_id in order_ids])
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка отметки очищенных заказов: {e}")
+    finally:
+        conn.close()
+
+
+def get_existing_order_ids(order_ids):
+    """Проверка, какие из переданных ID заказов есть в базе"""
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        order_ids = list(order_ids)
+        existing = set()
+
+        # Ограничение SQLite на количество параметров в запросе
+        for start in range(0, len(order_ids), 500):
+            chunk = order_ids[start:start + 500]
+            placeholders = ','.join(['?'] * len(chunk))
+            c.execute(f"SELECT order_id FROM orders WHERE order_id IN ({placeholders})", chunk)
+            existing.update(row['order_id'] for row in c.fetchall())
+
+        return existing
+    except Exception as e:
+        logger.error(f"Ошибка проверки существования заказов: {e}")
+        return None
+    finally:
+        conn.close()
+
+
+def get_slow_query_summary(limit=10):
+    """Самые затратные запросы: суммарное время, число, среднее и максимум, последний план"""
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute("""SELECT sql, function, COUNT(*) AS count, SUM(duration_ms) AS total_ms,
+                     AVG(duration_ms) AS avg_ms, MAX(duration_ms) AS max_ms, MAX(rows) AS max_rows,
+                     (SELECT plan FROM slow_queries AS last WHERE last.sql = s.sql ORDER BY id DESC LIMIT 1) AS plan
+                     FROM slow_queries AS s GROUP BY sql ORDER BY total_ms DESC LIMIT ?""", (limit,))
+        return [dict(row) for row in c.fetchall()]
+    except Exception as e:
+        logger.error(f"Ошибка получения медленных запросов: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+def clear_slow_queries():
+    """Очистка журнала медленных запросов"""
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute("DELETE FROM slow_queries")
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка очистки медленных запросов: {e}")
+    finally:
+        conn.close()
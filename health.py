@@ -0,0 +1,179 @@
+# health.py - проверки живости и готовности для супервизора (/live, /ready, /health)
+#
+# HTTP-сервер работает в отдельном потоке: если цикл событий завис,
+# /live отвечает 503 с величиной задержки, а не молчит и не отвечает 200.
+# Задержка цикла берется из отметок loop_watchdog.
+import asyncio
+import concurrent.futures
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import Config
+import bot_request
+import database
+from loop_watchdog import loop_lag
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать снимка расписания задач из цикла событий (в секундах)
+JOBS_TIMEOUT = 1.0
+
+_application = None
+_loop = None
+_server = None
+_draining = False
+# Последний снимок расписания: отдается, если цикл событий не ответил вовремя
+_jobs_snapshot = {}
+
+
+def probe_database():
+    """Пробная блокировка записи: (время в секундах, ошибка или None)
+
+    BEGIN IMMEDIATE берет ту же блокировку, что и запись, но ничего не меняет;
+    если файл БД заблокирован, проба не проходит за HEALTH_DB_TIMEOUT_S.
+    """
+    start = time.perf_counter()
+    conn = None
+    try:
+        conn = sqlite3.connect(Config.DB_NAME, timeout=Config.HEALTH_DB_TIMEOUT_S, isolation_level=None)
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("ROLLBACK")
+        return time.perf_counter() - start, None
+    except sqlite3.Error as e:
+        return time.perf_counter() - start, str(e)
+    finally:
+        if conn:
+            conn.close()
+
+
+async def _read_jobs():
+    """Снимок расписания задач; выполняется в цикле событий, где живет job_queue"""
+    global _jobs_snapshot
+    _jobs_snapshot = {job.name: job.next_t.isoformat() if job.next_t else None
+                      for job in _application.job_queue.jobs()}
+    return _jobs_snapshot
+
+
+def _jobs():
+    if not _application or not _application.job_queue or not _loop:
+        return {}
+    try:
+        return asyncio.run_coroutine_threadsafe(_read_jobs(), _loop).result(timeout=JOBS_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        # Цикл событий занят: снимок обновится, когда он дойдет до запроса
+        return _jobs_snapshot
+    except Exception as e:
+        logger.debug(f"Ошибка чтения расписания задач: {e}")
+        return _jobs_snapshot
+
+
+def snapshot():
+    """Состояние бота и причины, по которым он не жив или не готов"""
+    lag = loop_lag()
+    db_latency, db_error = probe_database()
+    last_poll = bot_request.last_success("getUpdates")
+    poll_age = time.time() - last_poll if last_poll else None
+    # Длинный опрос, который еще ждет ответа, не считается проблемой, пока не превысит лимит
+    waiting = bot_request.waiting_since("getUpdates")
+    wait_age = time.time() - waiting if waiting else None
+
+    live_problems = []
+    if lag is None:
+        live_problems.append("цикл событий еще не запущен")
+    elif lag > Config.HEALTH_MAX_LAG_S:
+        live_problems.append(f"цикл событий не отвечает {lag:.1f} с")
+
+    ready_problems = list(live_problems)
+    if _draining:
+        ready_problems.append("бот останавливается")
+    polling = (poll_age is not None and poll_age <= Config.HEALTH_MAX_POLL_AGE_S) or \
+        (wait_age is not None and wait_age <= Config.HEALTH_MAX_POLL_AGE_S)
+    if not polling:
+        ready_problems.append(f"нет успешного getUpdates {poll_age:.0f} с" if poll_age is not None
+                              else "getUpdates еще не выполнялся успешно")
+    if db_error:
+        ready_problems.append(f"БД недоступна для записи: {db_error}")
+
+    return {
+        "live": not live_problems,
+        "ready": not ready_problems,
+        "problems": ready_problems,
+        "timestamp": datetime.now().isoformat(),
+        "event_loop_lag_s": round(lag, 4) if lag is not None else None,
+        "last_get_updates": datetime.fromtimestamp(last_poll).isoformat() if last_poll else None,
+        "last_get_updates_age_s": round(poll_age, 1) if poll_age is not None else None,
+        "db_write_probe_ms": round(db_latency * 1000, 3),
+        "db_error": db_error,
+        "update_queue": _application.update_queue.qsize() if _application else 0,
+        "bot_api_in_flight": bot_request.in_flight(),
+        "history_queue": len(database._pending_history),
+        "jobs_next_run": _jobs(),
+    }
+
+
+class _HealthHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path not in ("/live", "/ready", "/health"):
+            self._reply(404, {"error": "not found"})
+            return
+        if path == "/live":
+            # Живость не зависит от БД и Telegram: перезапуск их не исправит
+            lag = loop_lag()
+            live = lag is not None and lag <= Config.HEALTH_MAX_LAG_S
+            self._reply(200 if live else 503, {"live": live, "event_loop_lag_s": lag})
+            return
+        state = snapshot()
+        if path == "/ready":
+            self._reply(200 if state["ready"] else 503, {"ready": state["ready"], "problems": state["problems"]})
+        else:
+            self._reply(200 if state["live"] else 503, state)
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Проверка состояния: {format % args}")
+
+
+def start(application):
+    """Запуск HTTP-сервера проверок (HEALTH_PORT=0 отключает его); после loop_watchdog.start"""
+    global _application, _loop, _server, _draining
+    if not Config.HEALTH_PORT or _server:
+        return
+    _application = application
+    _loop = asyncio.get_running_loop()
+    _draining = False
+    try:
+        _server = ThreadingHTTPServer((Config.HEALTH_HOST, Config.HEALTH_PORT), _HealthHandler)
+    except OSError as e:
+        logger.error(f"Не удалось запустить сервер проверок состояния: {e}")
+        return
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="health-server", daemon=True).start()
+    logger.info(f"Проверки состояния доступны на http://{Config.HEALTH_HOST}:{Config.HEALTH_PORT}/health")
+
+
+def mark_draining():
+    """Бот останавливается: /ready отвечает 503, чтобы на него не направляли работу"""
+    global _draining
+    _draining = True
+
+
+async def stop():
+    """Остановка сервера проверок"""
+    global _server
+    mark_draining()
+    if _server:
+        server, _server = _server, None
+        await asyncio.get_running_loop().run_in_executor(None, server.shutdown)
+        server.server_close()
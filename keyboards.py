@@ -90,6 +90,7 @@ def get_admin_order_actions_keyboard(order_id):
     """Клавиатура действий с заказом для админа"""
     keyboard = [
         [InlineKeyboardButton("💬 Написать студенту", callback_data=f"admin_send_msg_{order_id}")],
+        [InlineKeyboardButton("📜 История переписки", callback_data=f"admin_history_{order_id}")],
         [InlineKeyboardButton("💰 Установить цену", callback_data=f"admin_force_set_price_{order_id}")],
         [InlineKeyboardButton("📤 Загрузить работу", callback_data=f"admin_upload_work_{order_id}")],
         [InlineKeyboardButton("✅ Завершить заказ", callback_data=f"admin_complete_{order_id}")],
@@ -282,6 +283,29 @@ def get_order_details_keyboard(order_id, status, can_download=False):
     return InlineKeyboardMarkup(keyboard)
 
 
+def get_history_keyboard(order_id, oldest_id=None, has_older=False, is_first_page=True):
+    """Клавиатура просмотра истории переписки (пагинация по id сообщения)"""
+    keyboard = []
+    nav_buttons = []
+    if has_older and oldest_id:
+        nav_buttons.append(InlineKeyboardButton("⬅️ Раньше", callback_data=f"admin_history_{order_id}_{oldest_id}"))
+    if not is_first_page:
+        nav_buttons.append(InlineKeyboardButton("⏭ Последние", callback_data=f"admin_history_{order_id}"))
+    if nav_buttons:
+        keyboard.append(nav_buttons)
+
+    keyboard.append([InlineKeyboardButton("🔙 К заказу", callback_data=f"admin_order_{order_id}")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def get_user_chat_keyboard():
+    """Клавиатура переписки студента с экспертом"""
+    keyboard = [
+        [InlineKeyboardButton("✅ Завершить переписку", callback_data="user_back_to_orders")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+
 def get_admin_templates_keyboard(templates):
     """Клавиатура шаблонов ответов для админа"""
     keyboard = []
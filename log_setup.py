@@ -0,0 +1,154 @@
+# log_setup.py - журналирование через очередь: запись на диск и в консоль в фоновом потоке
+import atexit
+import contextvars
+import functools
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import time
+from datetime import datetime
+from telegram import Update
+from config import Config
+from metrics import iter_handlers
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Обновление и обработчик, в контексте которых пишется запись
+_update_id = contextvars.ContextVar("log_update_id", default=None)
+_handler_name = contextvars.ContextVar("log_handler", default=None)
+
+_listener = None
+
+
+class _ContextFilter(logging.Filter):
+    """Добавляет к записи id обновления и имя обработчика (в потоке, который пишет запись)"""
+
+    def filter(self, record):
+        record.update_id = _update_id.get()
+        record.handler = _handler_name.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in ("update_id", "handler"):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        elif record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Ротация по размеру и по времени; старые файлы сжимаются в .gz"""
+
+    def __init__(self, filename, max_bytes, backup_count, interval_hours):
+        # delay: файл создается при первой записи, а не при импорте
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        self.interval = interval_hours * 3600
+        self.next_rollover = time.time() + self.interval if self.interval else None
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self._compress
+
+    @staticmethod
+    def _compress(source, dest):
+        with open(source, "rb") as plain, gzip.open(dest, "wb") as packed:
+            shutil.copyfileobj(plain, packed)
+        os.remove(source)
+
+    def shouldRollover(self, record):
+        if self.next_rollover and time.time() >= self.next_rollover:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        if self.interval:
+            self.next_rollover = time.time() + self.interval
+
+
+def configure():
+    """Корневой логгер пишет в очередь; форматирование и запись идут в потоке QueueListener"""
+    global _listener
+    if _listener:
+        return
+
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers = [console]
+
+    if Config.LOG_FILE:
+        json_file = CompressingRotatingFileHandler(Config.LOG_FILE, Config.LOG_MAX_BYTES, Config.LOG_BACKUP_COUNT,
+                                                   Config.LOG_ROTATE_HOURS)
+        json_file.setFormatter(JsonFormatter())
+        handlers.append(json_file)
+
+    # Действия администратора по-прежнему пишутся отдельно в admin_actions.log
+    admin_file = CompressingRotatingFileHandler('admin_actions.log', Config.LOG_MAX_BYTES, Config.LOG_BACKUP_COUNT,
+                                                Config.LOG_ROTATE_HOURS)
+    admin_file.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    admin_file.addFilter(logging.Filter('admin_actions'))
+    handlers.append(admin_file)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(_ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(Config.LOG_LEVEL)
+    # httpx пишет строку на каждый запрос к Bot API, и в ней URL с токеном бота
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop)
+
+
+def stop():
+    """Дописывает очередь журнала и останавливает фоновый поток"""
+    global _listener
+    if _listener:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def _with_context(func):
+    @functools.wraps(func)
+    async def wrapper(update, *args, **kwargs):
+        update_token = _update_id.set(update.update_id if isinstance(update, Update) else None)
+        handler_token = _handler_name.set(func.__name__)
+        try:
+            return await func(update, *args, **kwargs)
+        finally:
+            _handler_name.reset(handler_token)
+            _update_id.reset(update_token)
+    return wrapper
+
+
+def instrument_application(application):
+    """Записи журнала из обработчиков получают id обновления и имя обработчика"""
+    wrapped = {}
+    for group_handlers in application.handlers.values():
+        for handler in iter_handlers(group_handlers):
+            callback = handler.callback
+            if callback not in wrapped:
+                wrapped[callback] = _with_context(callback)
+            handler.callback = wrapped[callback]
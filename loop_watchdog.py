@@ -0,0 +1,171 @@
+# loop_watchdog.py - контроль задержек цикла событий и поиск блокирующих вызовов
+import asyncio
+import collections
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+from telegram.ext import CallbackContext
+from config import Config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = metrics.Histogram("bot_event_loop_lag_seconds", "Задержка цикла событий относительно расписания",
+                             buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+LOOP_STALLS = metrics.Counter("bot_event_loop_stalls_total", "Блокировки цикла событий дольше порога",
+                              labels=("handler",))
+
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Код обработчиков -> имя, для определения виновника блокировки
+_handler_codes = {}
+# (обработчик, место в коде) -> [количество, максимальная длительность]
+_offenders = {}
+_lock = threading.Lock()
+# Снимок стека текущей блокировки, сделанный потоком watchdog
+_pending = None
+_last_beat = 0.0
+_loop_thread_id = None
+_heartbeat_task = None
+_thread = None
+
+
+def _describe_stack(frame):
+    """Обработчик и ближайшее к месту блокировки место в коде проекта"""
+    handler = None
+    site = None
+    while frame is not None:
+        code = frame.f_code
+        if site is None and code.co_filename.startswith(_PROJECT_DIR) and code.co_filename != __file__:
+            site = f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}"
+        if code in _handler_codes:
+            # Нужен самый внешний обработчик, поэтому продолжаем подниматься по стеку
+            handler = _handler_codes[code]
+        frame = frame.f_back
+    return handler or "<вне обработчиков>", site or "<библиотека>"
+
+
+def _watch():
+    """Поток watchdog: снимает стек цикла событий, если тот не отвечает дольше порога"""
+    global _pending
+    threshold = Config.LAG_THRESHOLD_MS / 1000
+    interval = Config.LAG_CHECK_INTERVAL_MS / 1000
+    captured_beat = None
+    while True:
+        time.sleep(interval)
+        beat = _last_beat
+        # Задержка - опоздание следующей отметки сверх периода проверки, а не возраст отметки
+        if time.monotonic() - beat - interval < threshold or beat == captured_beat:
+            continue
+        frame = sys._current_frames().get(_loop_thread_id)
+        if frame is None:
+            continue
+        with _lock:
+            _pending = _describe_stack(frame)
+        captured_beat = beat
+
+
+async def _heartbeat():
+    """Периодическая отметка из цикла событий; опоздание отметки и есть задержка цикла"""
+    global _last_beat, _pending
+    interval = Config.LAG_CHECK_INTERVAL_MS / 1000
+    threshold = Config.LAG_THRESHOLD_MS / 1000
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        _last_beat = time.monotonic()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        LOOP_LAG.observe(lag)
+        if not threshold or lag < threshold:
+            # Стек, снятый во время короткой задержки, не относится к следующим блокировкам
+            if _pending:
+                with _lock:
+                    _pending = None
+            continue
+
+        with _lock:
+            key = _pending or ("<не определено>", "<блокировка короче периода проверки>")
+            _pending = None
+            entry = _offenders.setdefault(key, [0, 0.0])
+            entry[0] += 1
+            entry[1] = max(entry[1], lag)
+        LOOP_STALLS.inc(key[0])
+        logger.warning(f"Цикл событий заблокирован на {lag * 1000:.0f} мс: {key[0]} ({key[1]})")
+
+
+def loop_lag():
+    """Насколько цикл событий сейчас опаздывает с отметкой (в секундах); None, если отметки не идут
+
+    Читается и из других потоков (проверки состояния в health.py).
+    """
+    if _heartbeat_task is None:
+        return None
+    return max(0.0, time.monotonic() - _last_beat - Config.LAG_CHECK_INTERVAL_MS / 1000)
+
+
+def start(application):
+    """Запуск отметок и контроля задержек; вызывается из цикла событий после регистрации обработчиков
+
+    Отметки идут всегда (по ним health.py судит о живости), поиск блокирующих
+    вызовов - только при LAG_THRESHOLD_MS > 0.
+    """
+    global _loop_thread_id, _heartbeat_task, _thread, _last_beat
+    if _heartbeat_task:
+        return
+
+    for group_handlers in application.handlers.values():
+        for handler in metrics.iter_handlers(group_handlers):
+            callback = inspect.unwrap(handler.callback)
+            _handler_codes[callback.__code__] = callback.__name__
+
+    _loop_thread_id = threading.get_ident()
+    _last_beat = time.monotonic()
+    _heartbeat_task = asyncio.get_running_loop().create_task(_heartbeat())
+    if not Config.LAG_THRESHOLD_MS:
+        return
+    if not _thread:
+        _thread = threading.Thread(target=_watch, name="loop-watchdog", daemon=True)
+        _thread.start()
+    logger.info(f"Контроль задержек цикла событий: порог {Config.LAG_THRESHOLD_MS} мс")
+
+
+async def stop():
+    """Остановка отметок цикла событий"""
+    global _heartbeat_task
+    if _heartbeat_task:
+        _heartbeat_task.cancel()
+        try:
+            await _heartbeat_task
+        except asyncio.CancelledError:
+            pass
+        _heartbeat_task = None
+
+
+def top_offenders(limit=10):
+    """Самые частые блокировки: [((обработчик, место), количество, максимум в секундах)]"""
+    with _lock:
+        items = [(key, count, longest) for key, (count, longest) in _offenders.items()]
+    items.sort(key=lambda item: (item[1], item[2]), reverse=True)
+    return items[:limit]
+
+
+async def send_daily_report(context: CallbackContext):
+    """Ежедневный отчет администратору о блокировках цикла событий"""
+    offenders = top_offenders()
+    with _lock:
+        _offenders.clear()
+    if not offenders:
+        return
+
+    lines = [f"🐢 Блокировки цикла событий за сутки (порог {Config.LAG_THRESHOLD_MS} мс)\n"]
+    for (handler, site), count, longest in offenders:
+        lines.append(f"• {handler} - {site}\n  {count} раз, максимум {longest * 1000:.0f} мс")
+
+    try:
+        await context.bot.send_message(chat_id=Config.ADMIN_ID, text="\n".join(lines)[:Config.MAX_MESSAGE_LENGTH])
+    except Exception as e:
+        logger.error(f"Ошибка отправки отчета о блокировках: {e}")
@@ -7,8 +7,20 @@ from datetime import datetime, time
 
 # Импорты из наших модулей
 from config import Config
+import antiflood
+import catchup
+import database
+import health
+import log_setup
+import loop_watchdog
+import metrics
+import profiler
+import recorder
+import utils
+from bot_request import InstrumentedRequest, build_request
 from database import init_db
-from utils import error_handler, check_deadlines, handle_wrong_input, cleanup_old_files
+from update_processor import PriorityUpdateProcessor
+from utils import error_handler, check_deadlines, handle_wrong_input, cleanup_old_files, flush_message_history
 from user_handlers import (
     user_start, user_cancel, user_create_order, user_choose_discipline, user_choose_work_type,
     user_set_custom_work_type, user_handle_deadline, user_handle_budget_type, user_handle_budget,
@@ -19,10 +31,11 @@ from user_handlers import (
     user_info, user_info_commands, user_info_prices, user_info_requisites,
     user_info_rules, user_info_back,
     user_view_order, user_download_work, user_back_to_orders, user_orders_navigation,
+    user_message_expert, user_chat_message, user_reply_relay,
     USER_SELECTING_ACTION, USER_CHOOSE_DISCIPLINE, USER_CHOOSE_WORK_TYPE, USER_SET_CUSTOM_WORK_TYPE,
     USER_SET_DEADLINE, USER_SELECT_BUDGET_TYPE, USER_SET_BUDGET, USER_SET_PLAGIARISM_REQUIRED,
     USER_CHOOSING_PLAGIARISM_SYSTEM, USER_SET_PLAGIARISM_PERCENT, USER_UPLOAD_FILES, USER_SET_DESCRIPTION,
-    USER_VIEWING_ORDERS, USER_INFO_MENU, USER_ORDER_DETAILS
+    USER_VIEWING_ORDERS, USER_INFO_MENU, USER_ORDER_DETAILS, USER_CHAT
 )
 from admin_handlers import (
     admin_start, admin_cancel, admin_view_all_orders, admin_orders_by_status, admin_handle_orders_navigation,
@@ -31,69 +44,111 @@ from admin_handlers import (
     admin_delete_order_completely, admin_start_from_query, admin_manage_tags, admin_handle_tags,
     admin_manage_templates, admin_create_template, admin_handle_template_name,
     admin_handle_template_category, admin_handle_template_text, admin_use_template,
-    admin_verify_2fa, admin_all_orders_navigation,
+    admin_verify_2fa, admin_all_orders_navigation, admin_start_message, admin_reply_relay, admin_view_history,
+    admin_profile, admin_slow_queries,
     ADMIN_MAIN, ADMIN_VIEW_ORDERS, ADMIN_ORDER_DETAILS, ADMIN_SEND_MESSAGE, ADMIN_SET_PRICE,
     ADMIN_UPLOAD_WORK, ADMIN_2FA_VERIFICATION, ADMIN_MANAGE_TAGS, ADMIN_MANAGE_TEMPLATES,
     ADMIN_CREATE_TEMPLATE
 )
 
-# Настройка логгирования
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO
-)
+# Медиа, которые администратор может отправить студенту (пересылаются через copy_message)
+RELAY_MEDIA_FILTER = filters.VOICE | filters.PHOTO | filters.VIDEO | filters.Document.ALL
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-# Создаем логгер для действий администратора
+# Логгер для действий администратора (пишется в admin_actions.log)
 admin_logger = logging.getLogger('admin_actions')
-admin_handler = logging.FileHandler('admin_actions.log')
-admin_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
-admin_logger.addHandler(admin_handler)
 admin_logger.setLevel(logging.INFO)
 
 
-def main() -> None:
-    """Основная функция запуска бота"""
-    # Инициализация базы данных
-    init_db()
+async def post_init(application: Application) -> None:
+    """Действия после инициализации приложения"""
+    await metrics.start_server()
+    profiler.start()
+    loop_watchdog.start(application)
+    health.start(application)
+    # До запуска опроса: накопившиеся за простой обновления разбираются отдельно
+    await catchup.run(application)
 
-    # Создаем необходимые директории
-    Path(Config.BASE_UPLOAD_FOLDER).mkdir(exist_ok=True, parents=True)
-    Path(Config.COMPLETED_FOLDER).mkdir(exist_ok=True, parents=True)
-    Path("voices").mkdir(exist_ok=True, parents=True)
-    Path("backups").mkdir(exist_ok=True, parents=True)
 
-    # Создаем приложение
-    application = Application.builder().token(Config.TOKEN).build()
+async def post_shutdown(application: Application) -> None:
+    """Действия при остановке приложения"""
+    await health.stop()
+    await loop_watchdog.stop()
+    await metrics.stop_server()
+    recorder.stop()
+
+
+def register_metrics(application: Application) -> None:
+    """Подключение метрик к обработчикам, базе данных и очередям"""
+    metrics.instrument_module(database)
+    metrics.instrument_application(application)
+    metrics.gauge("bot_update_queue_size", "Обновления, ожидающие обработки",
+                  lambda: application.update_queue.qsize())
+    metrics.gauge("bot_db_reads_executed", "Чтения database.read, выполненные запросом к БД",
+                  lambda: database.read_stats['executed'])
+    metrics.gauge("bot_db_reads_shared", "Чтения database.read, получившие результат такого же одновременного вызова",
+                  lambda: database.read_stats['shared'])
+    metrics.gauge("bot_history_queue_size", "Сообщения переписки, ожидающие записи в БД",
+                  lambda: len(database._pending_history))
+    metrics.gauge("bot_media_groups_pending", "Альбомы, ожидающие окончания сбора",
+                  lambda: len(utils._media_groups))
+    metrics.gauge("bot_upload_tasks_pending", "Незавершенные задачи сохранения альбомов",
+                  lambda: sum(len(tasks) for tasks in utils._pending_uploads.values()))
+
+
+def register_jobs(application: Application) -> None:
+    """Регистрация периодических задач"""
+    # Задачи выполняются в полосе jobs обработчика обновлений, после обновлений пользователей
+    lanes = application.update_processor
 
     # Добавляем задачу для проверки дедлайнов в очередь заданий приложения
     application.job_queue.run_repeating(
-        check_deadlines,
+        lanes.wrap_job(check_deadlines),
         interval=86400,  # 24 часа в секундах
         first=10  # Первый запуск через 10 секунд после старта
     )
 
+    # Пакетная запись истории переписки
+    application.job_queue.run_repeating(
+        lanes.wrap_job(flush_message_history),
+        interval=Config.HISTORY_FLUSH_INTERVAL,
+        first=Config.HISTORY_FLUSH_INTERVAL,
+        name="flush_message_history"
+    )
+
     # Добавляем задачу для очистки старых файлов (каждый день в 3:00)
     application.job_queue.run_daily(
-        cleanup_old_files,
+        lanes.wrap_job(cleanup_old_files),
         time=time(hour=3, minute=0),
         name="cleanup_old_files"
     )
 
+    # Ежедневный отчет о блокировках цикла событий
+    if Config.LAG_THRESHOLD_MS:
+        application.job_queue.run_daily(
+            lanes.wrap_job(loop_watchdog.send_daily_report),
+            time=datetime.strptime(Config.LAG_REPORT_TIME, "%H:%M").time(),
+            name="loop_lag_report"
+        )
+
     # Добавляем задачу для резервного копирования (если включено)
     if hasattr(Config, 'BACKUP_ENABLED') and Config.BACKUP_ENABLED:
         try:
             from utils import create_backup
             backup_time = datetime.strptime(Config.BACKUP_TIME, "%H:%M").time()
             application.job_queue.run_daily(
-                create_backup,
+                lanes.wrap_job(create_backup),
                 time=backup_time,
                 name="daily_backup"
             )
         except Exception as e:
             logger.error(f"Ошибка настройки задачи резервного копирования: {e}")
 
+
+def register_handlers(application: Application) -> None:
+    """Регистрация диалогов и обработчиков обновлений"""
     # Обработчик диалога для пользователей
     user_conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', user_start)],
@@ -153,8 +208,14 @@ def main() -> None:
             ],
             USER_ORDER_DETAILS: [
                 CallbackQueryHandler(user_download_work, pattern=r"^user_download_work_"),
+                CallbackQueryHandler(user_message_expert, pattern=r"^user_message_expert_"),
                 CallbackQueryHandler(user_back_to_orders, pattern="^user_back_to_orders$")
             ],
+            USER_CHAT: [
+                MessageHandler((filters.TEXT & ~filters.COMMAND) | RELAY_MEDIA_FILTER, user_chat_message),
+                CallbackQueryHandler(user_back_to_orders, pattern="^user_back_to_orders$"),
+                MessageHandler(~filters.TEXT & ~RELAY_MEDIA_FILTER & ~filters.COMMAND, handle_wrong_input)
+            ],
             USER_INFO_MENU: [
                 CallbackQueryHandler(user_info_commands, pattern="^user_info_commands$"),
                 CallbackQueryHandler(user_info_prices, pattern="^user_info_prices$"),
@@ -189,7 +250,9 @@ def main() -> None:
                 CallbackQueryHandler(admin_start_from_query, pattern="^admin_back$")
             ],
             ADMIN_ORDER_DETAILS: [
-                CallbackQueryHandler(admin_handle_message, pattern=r"^admin_send_msg_"),
+                CallbackQueryHandler(admin_start_message, pattern=r"^admin_send_msg_"),
+                CallbackQueryHandler(admin_view_history, pattern=r"^admin_history_"),
+                CallbackQueryHandler(admin_order_details, pattern=r"^admin_order_"),
                 CallbackQueryHandler(admin_manage_tags, pattern=r"^admin_tags_"),
                 CallbackQueryHandler(admin_force_set_price, pattern=r"^admin_force_set_price_"),
                 CallbackQueryHandler(admin_upload_work, pattern=r"^admin_upload_work_"),
@@ -200,9 +263,10 @@ def main() -> None:
             ],
             ADMIN_SEND_MESSAGE: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, admin_handle_message),
-                MessageHandler(filters.VOICE, admin_handle_message),
-                CallbackQueryHandler(admin_handle_message, pattern="^admin_send_msg_"),
-                MessageHandler(~filters.TEXT & ~filters.VOICE & ~filters.COMMAND, handle_wrong_input)
+                MessageHandler(RELAY_MEDIA_FILTER, admin_handle_message),
+                CallbackQueryHandler(admin_start_message, pattern="^admin_send_msg_"),
+                CallbackQueryHandler(admin_order_details, pattern=r"^admin_order_"),
+                MessageHandler(~filters.TEXT & ~RELAY_MEDIA_FILTER & ~filters.COMMAND, handle_wrong_input)
             ],
             ADMIN_SET_PRICE: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, admin_handle_force_price),
@@ -254,13 +318,71 @@ def main() -> None:
     application.add_handler(CallbackQueryHandler(admin_force_set_price, pattern=r"^admin_force_set_price_"))
     application.add_handler(CallbackQueryHandler(admin_delete_order_completely, pattern=r"^admin_delete_completely_"))
     application.add_handler(CallbackQueryHandler(admin_all_orders_navigation, pattern=r"^admin_all_orders_(prev|next)_"))
+    application.add_handler(CallbackQueryHandler(admin_view_history, pattern=r"^admin_history_"))
+
+    # Результаты профилирования для администратора
+    application.add_handler(CommandHandler('profile', admin_profile, filters=filters.User(Config.ADMIN_ID)))
+    application.add_handler(CommandHandler('slowqueries', admin_slow_queries, filters=filters.User(Config.ADMIN_ID)))
+
+    # Переписка вне диалогов: ответы (reply) на пересланные сообщения уходят другой стороне
+    relay_reply_filter = filters.REPLY & ((filters.TEXT & ~filters.COMMAND) | RELAY_MEDIA_FILTER)
+    application.add_handler(MessageHandler(relay_reply_filter & filters.Chat(Config.ADMIN_ID), admin_reply_relay))
+    application.add_handler(MessageHandler(relay_reply_filter & ~filters.Chat(Config.ADMIN_ID), user_reply_relay))
 
     # Добавляем обработчик ошибок
     application.add_error_handler(error_handler)
 
+
+def main() -> None:
+    """Основная функция запуска бота"""
+    # Настройка логгирования: записи уходят в очередь, на диск их пишет фоновый поток.
+    # Здесь, а не при импорте: импорт main (replay, бенчмарки) не должен менять логирование
+    log_setup.configure()
+
+    # Инициализация базы данных
+    init_db()
+
+    # Создаем необходимые директории
+    Path(Config.BASE_UPLOAD_FOLDER).mkdir(exist_ok=True, parents=True)
+    Path(Config.COMPLETED_FOLDER).mkdir(exist_ok=True, parents=True)
+    Path(Config.BLOB_FOLDER).mkdir(exist_ok=True, parents=True)
+    Path("backups").mkdir(exist_ok=True, parents=True)
+
+    # Создаем приложение
+    # HTTP-клиенты Bot API записывают время запросов в метрики; файлы и управляющие вызовы
+    # идут через разные пулы соединений. Обновления обрабатываются параллельно по полосам
+    # приоритета, у одного пользователя - по порядку
+    application = (
+        Application.builder()
+        .token(Config.TOKEN)
+        .base_url(Config.BOT_API_URL)
+        .base_file_url(Config.BOT_FILE_URL)
+        .local_mode(Config.BOT_API_LOCAL)
+        .request(build_request())
+        .get_updates_request(InstrumentedRequest())
+        .concurrent_updates(PriorityUpdateProcessor(Config.UPDATE_CONCURRENCY, Config.UPDATE_RESERVED_SLOTS))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    register_jobs(application)
+    register_handlers(application)
+    recorder.attach(application)
+
+    # Профилирование и метрики подключаются после регистрации всех обработчиков
+    profiler.instrument_application(application)
+    log_setup.instrument_application(application)
+    register_metrics(application)
+    # Ограничение частоты подключается после оберток: его ApplicationHandlerStop - не ошибка обработчика
+    antiflood.attach(application)
+
     logger.info("Бот запущен...")
     application.run_polling()
 
+    # Дописываем историю переписки, накопленную к моменту остановки
+    database.flush_message_history()
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,283 @@
+# metrics.py - метрики производительности в формате Prometheus
+import asyncio
+import bisect
+import functools
+import inspect
+import logging
+import threading
+import time
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм времени (в секундах)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = {}
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """Счетчик с метками"""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и метками"""
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # метки -> [счетчики по корзинам (последняя - +Inf), сумма]
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def totals(self):
+        """Количество и сумма наблюдений по меткам: {метки: (количество, сумма)}"""
+        with self._lock:
+            return {label_values: (sum(counts), total) for label_values, (counts, total) in self._values.items()}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(label_values, list(counts), total) for label_values, (counts, total) in self._values.items()]
+        for label_values, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, ("le", bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Показатель, значение которого вычисляется при чтении метрик
+
+    С метками callback возвращает словарь: значение метки (или кортеж значений) -> значение.
+    """
+
+    def __init__(self, name, documentation, callback, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labels = tuple(labels)
+        _registry[name] = self
+
+    def render(self):
+        try:
+            value = self.callback()
+        except Exception as e:
+            logger.error(f"Ошибка вычисления метрики {self.name}: {e}")
+            return []
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        if not self.labels:
+            return lines + [f"{self.name} {value}"]
+        for label_values, item in value.items():
+            if not isinstance(label_values, tuple):
+                label_values = (label_values,)
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {item}")
+        return lines
+
+
+HANDLER_LATENCY = Histogram("bot_handler_duration_seconds", "Время обработки обновления обработчиком",
+                            labels=("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в обработчиках", labels=("handler",))
+DB_LATENCY = Histogram("bot_db_duration_seconds", "Время выполнения функций database.py",
+                       labels=("function",))
+API_LATENCY = Histogram("bot_api_request_duration_seconds", "Время запросов к Bot API", labels=("method",))
+API_ERRORS = Counter("bot_api_errors_total", "Ошибки запросов к Bot API", labels=("method", "error"))
+API_RETRY_AFTER = Counter("bot_api_retry_after_total", "Ответы RetryAfter (flood control) от Bot API",
+                          labels=("method",))
+
+
+def gauge(name, documentation, callback, labels=()):
+    """Регистрация показателя, например глубины очереди"""
+    return Gauge(name, documentation, callback, labels)
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in list(_registry.values()):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _timed(func, histogram, label, errors=None):
+    """Обертка функции с замером времени выполнения"""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                if errors:
+                    errors.inc(label)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, label)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            if errors:
+                errors.inc(label)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start, label)
+    return wrapper
+
+
+def iter_handlers(handlers):
+    """Обход обработчиков, включая вложенные в ConversationHandler"""
+    from telegram.ext import ConversationHandler
+
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            yield from iter_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                yield from iter_handlers(state_handlers)
+            yield from iter_handlers(handler.fallbacks)
+        else:
+            yield handler
+
+
+def instrument_application(application):
+    """Замер времени всех обработчиков приложения
+
+    Вызывается после регистрации обработчиков. Один и тот же callback
+    оборачивается один раз, даже если зарегистрирован в нескольких состояниях.
+    """
+    wrapped = {}
+    count = 0
+    for group_handlers in application.handlers.values():
+        for handler in iter_handlers(group_handlers):
+            callback = handler.callback
+            if getattr(callback, '_metrics_wrapped', False):
+                continue
+            if callback not in wrapped:
+                wrapped[callback] = _timed(callback, HANDLER_LATENCY, callback.__name__, HANDLER_ERRORS)
+                wrapped[callback]._metrics_wrapped = True
+            handler.callback = wrapped[callback]
+            count += 1
+
+    logger.info(f"Метрики: подключено обработчиков {count}")
+
+
+def instrument_module(module, histogram=DB_LATENCY):
+    """Замер времени всех публичных функций модуля
+
+    Функции заменяются в самом модуле, поэтому вызовы вида module.func()
+    из других модулей и внутри модуля попадают в метрики.
+    """
+    for name, func in list(vars(module).items()):
+        if name.startswith('_') or not inspect.isfunction(func) or func.__module__ != module.__name__:
+            continue
+        if getattr(func, '_metrics_wrapped', False):
+            continue
+        wrapper = _timed(func, histogram, name)
+        wrapper._metrics_wrapped = True
+        setattr(module, name, wrapper)
+
+
+async def _handle_connection(reader, writer):
+    """Минимальный HTTP-обработчик: GET /metrics"""
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Заголовки запроса не нужны, дочитываем их до пустой строки
+        while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+            pass
+
+        parts = request_line.decode('latin-1').split()
+        path = parts[1] if len(parts) > 1 else "/"
+        if path.split('?')[0] == "/metrics":
+            status, content_type, body = "200 OK", "text/plain; version=0.0.4; charset=utf-8", render()
+        else:
+            status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", "Not Found\n"
+
+        payload = body.encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode('latin-1') + payload
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.debug(f"Ошибка обработки запроса метрик: {e}")
+    finally:
+        writer.close()
+
+
+_server = None
+
+
+async def start_server():
+    """Запуск HTTP-эндпоинта метрик (METRICS_PORT=0 отключает его)"""
+    global _server
+    if not Config.METRICS_PORT or _server:
+        return
+    try:
+        _server = await asyncio.start_server(_handle_connection, Config.METRICS_HOST, Config.METRICS_PORT)
+        logger.info(f"Метрики доступны на http://{Config.METRICS_HOST}:{Config.METRICS_PORT}/metrics")
+    except OSError as e:
+        logger.error(f"Не удалось запустить сервер метрик: {e}")
+
+
+async def stop_server():
+    """Остановка HTTP-эндпоинта метрик"""
+    global _server
+    if _server:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
@@ -0,0 +1,99 @@
+# order_session.py - заказы в рамках одного обновления: одно чтение и одна запись на заказ
+#
+# Обработчик, отмеченный @unit_of_work, получает свою карту заказов: get_order
+# читает заказ из БД только при первом обращении, update_order и set_status
+# меняют поля в памяти, а в конце обработчика (или при явном flush) все
+# изменения заказа записываются одним UPDATE. Вне @unit_of_work функции
+# читают и пишут сразу.
+import contextvars
+import functools
+from datetime import datetime
+import database
+
+_session = contextvars.ContextVar("order_session", default=None)
+
+
+class OrderSession:
+    """Карта заказов одного обновления и их несохраненные изменения"""
+
+    def __init__(self):
+        self.orders = {}
+        self.changes = {}
+
+    async def get(self, order_id):
+        if order_id not in self.orders:
+            order = database.get_order_details(order_id)
+            if order is not None:
+                # Изменения, сделанные до первого чтения, не должны потеряться
+                order.update(self.changes.get(order_id, {}))
+            self.orders[order_id] = order
+        return self.orders[order_id]
+
+    def update(self, order_id, fields):
+        self.changes.setdefault(order_id, {}).update(fields)
+        order = self.orders.get(order_id)
+        if order is not None:
+            order.update(fields)
+
+    def flush(self):
+        changes, self.changes = self.changes, {}
+        for order_id, fields in changes.items():
+            database.update_order_fields(order_id, fields)
+
+
+async def get_order(order_id):
+    """Заказ по ID (в рамках обновления - один и тот же объект) или None"""
+    session = _session.get()
+    if session is None:
+        return database.get_order_details(order_id)
+    return await session.get(order_id)
+
+
+def update_order(order_id, **fields):
+    """Изменение полей заказа; в рамках обновления запись откладывается до flush"""
+    session = _session.get()
+    if session is None:
+        database.update_order_fields(order_id, fields)
+    else:
+        session.update(order_id, fields)
+
+
+def set_status(order_id, status):
+    """Статус заказа; при завершении и отмене также их время (как update_order_status)"""
+    fields = {'status': status}
+    if status == 'completed':
+        fields['completed_at'] = datetime.now().isoformat()
+    elif status == 'cancelled':
+        fields['cancelled_at'] = datetime.now().isoformat()
+        fields['files_reaped_at'] = None
+    update_order(order_id, **fields)
+
+
+def set_completed_files(order_id, files):
+    """Список выполненных файлов заказа (как update_order_completed_files)"""
+    update_order(order_id, completed_files=database.completed_files_value(files))
+
+
+def flush():
+    """Запись накопленных изменений сейчас, например перед уведомлением другого пользователя"""
+    session = _session.get()
+    if session is not None:
+        session.flush()
+
+
+def unit_of_work(func):
+    """Декоратор обработчика: своя карта заказов и запись изменений по его окончании"""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = _session.set(OrderSession())
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            try:
+                # Изменения, сделанные до ошибки, сохраняются, как и при немедленной записи
+                _session.get().flush()
+            finally:
+                _session.reset(token)
+
+    return wrapper
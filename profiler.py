@@ -0,0 +1,155 @@
+# profiler.py - выборочное профилирование обработчиков в продакшене
+import collections
+import functools
+import inspect
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from config import Config
+from metrics import iter_handlers
+
+logger = logging.getLogger(__name__)
+
+# Свернутые стеки "обработчик;функция;...;функция" -> количество снимков
+_samples = collections.Counter()
+# Количество профилированных вызовов по обработчикам
+_profiled_calls = collections.Counter()
+# Кадр корутины выполняемого сейчас профилируемого вызова -> (имя, код обработчика).
+# Ключ - сам вызов: непрофилируемые параллельные вызовы того же обработчика не учитываются
+_active = {}
+_lock = threading.Lock()
+_wake = threading.Event()
+_loop_thread_id = None
+_sampler = None
+
+
+def is_enabled():
+    return Config.PROFILE_SAMPLE_RATE > 0
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _take_sample():
+    """Снимок стека потока цикла событий и привязка его к обработчику"""
+    frame = sys._current_frames().get(_loop_thread_id)
+    stack = []
+    while frame is not None:
+        stack.append(frame)
+        frame = frame.f_back
+    stack.reverse()
+
+    with _lock:
+        # Первый сверху профилируемый обработчик - тот, кто сейчас занимает цикл событий
+        for index, frame in enumerate(stack):
+            entry = _active.get(frame)
+            if entry:
+                name, code = entry
+                # Обертки (метрики, логирование) пропускаются: стек начинается с кода обработчика
+                start = next((i for i in range(index, len(stack)) if stack[i].f_code is code), index)
+                key = ";".join([name] + [_frame_label(f) for f in stack[start:]])
+                _samples[key] += 1
+                return
+
+
+def _sample_loop():
+    """Поток выборки: работает, только пока выполняются профилируемые обработчики"""
+    interval = Config.PROFILE_INTERVAL_MS / 1000
+    while True:
+        _wake.wait()
+        time.sleep(interval)
+        try:
+            _take_sample()
+        except Exception as e:
+            logger.debug(f"Ошибка снимка стека: {e}")
+
+
+def _enter(frame, name, code):
+    with _lock:
+        _active[frame] = (name, code)
+        _profiled_calls[name] += 1
+    _wake.set()
+
+
+def _exit(frame):
+    with _lock:
+        _active.pop(frame, None)
+        if not _active:
+            _wake.clear()
+
+
+def profiled(func):
+    """Декоратор: доля PROFILE_SAMPLE_RATE вызовов обработчика профилируется сэмплером стека"""
+    code = inspect.unwrap(func).__code__
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if random.random() >= Config.PROFILE_SAMPLE_RATE:
+            return await func(*args, **kwargs)
+        coroutine = func(*args, **kwargs)
+        frame = coroutine.cr_frame
+        _enter(frame, name, code)
+        try:
+            return await coroutine
+        finally:
+            _exit(frame)
+
+    wrapper._profiled = True
+    return wrapper
+
+
+def instrument_application(application):
+    """Подключение профилирования ко всем обработчикам (только при PROFILE_SAMPLE_RATE > 0)"""
+    if not is_enabled():
+        return
+
+    wrapped = {}
+    for group_handlers in application.handlers.values():
+        for handler in iter_handlers(group_handlers):
+            callback = handler.callback
+            if getattr(callback, '_profiled', False) or not inspect.iscoroutinefunction(callback):
+                continue
+            if callback not in wrapped:
+                wrapped[callback] = profiled(callback)
+            handler.callback = wrapped[callback]
+
+    logger.info(f"Профилирование: обработчиков {len(wrapped)}, доля вызовов {Config.PROFILE_SAMPLE_RATE}")
+
+
+def start():
+    """Запуск потока выборки; вызывается из потока цикла событий"""
+    global _loop_thread_id, _sampler
+    if not is_enabled() or _sampler:
+        return
+    _loop_thread_id = threading.get_ident()
+    _sampler = threading.Thread(target=_sample_loop, name="profiler", daemon=True)
+    _sampler.start()
+
+
+def collapsed_stacks():
+    """Результаты в формате collapsed stacks (flamegraph.pl, speedscope)"""
+    with _lock:
+        items = sorted(_samples.items())
+    return "".join(f"{stack} {count}\n" for stack, count in items)
+
+
+def summary(limit=10):
+    """Обработчики с наибольшим числом снимков: [(имя, снимки, профилированные вызовы)]"""
+    with _lock:
+        by_handler = collections.Counter()
+        for stack, count in _samples.items():
+            by_handler[stack.split(';', 1)[0]] += count
+        return [(name, count, _profiled_calls[name]) for name, count in by_handler.most_common(limit)]
+
+
+def reset():
+    """Сброс накопленных результатов"""
+    with _lock:
+        _samples.clear()
+        _profiled_calls.clear()
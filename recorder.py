@@ -0,0 +1,170 @@
+# recorder.py - запись входящих обновлений для воспроизведения нагрузки (benchmarks/replay.py)
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from telegram import Update
+from telegram.ext import Application, CallbackContext, TypeHandler
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+# Объекты (или списки объектов) с id пользователя или чата и поля, которые из них удаляются;
+# sender_user, sender_chat и chat встречаются и в forward_origin пересланных сообщений
+_PERSON_KEYS = ("from", "chat", "user", "sender_chat", "sender_user", "forward_from", "forward_from_chat",
+                "new_chat_members", "left_chat_member")
+_PERSONAL_FIELDS = ("last_name", "username", "title", "bio", "phone_number")
+# Имена и подписи вне объектов пользователя заменяются обезличенным именем
+_NAME_FIELDS = ("forward_sender_name", "sender_user_name", "forward_signature", "author_signature")
+# Идентификаторы файлов заменяются псевдонимами: по ним Telegram отдает сам файл
+_FILE_ID_FIELDS = ("file_id", "file_unique_id")
+# Содержимое, которое не нужно для воспроизведения и не записывается
+_DROPPED_KEYS = ("contact", "location", "venue", "poll", "dice")
+# Тексты, от которых зависят переходы диалогов, сохраняются как есть, но только в форматах,
+# которые принимают эти шаги: срок (ДД.ММ.ГГГГ) и сумма (до 7 цифр, копейки через точку).
+# Номера карт, телефонов и документов в них не попадают и вырезаются как обычный текст
+_STRUCTURAL_TEXT = re.compile(r"^(?:\d{2}\.\d{2}\.\d{4}|\d{1,7}(?:\.\d{1,2})?)$")
+# Длинные числа в callback_data - это id пользователей (в том числе внутри номеров заказов)
+_ID_IN_DATA = re.compile(r"\d{5,}")
+
+_salt = (Config.RECORD_SALT or os.urandom(16).hex()).encode()
+_queue = queue.Queue()
+_thread = None
+
+
+def anonymize_id(value):
+    """Стабильный в пределах записи псевдоним id (знак сохраняется для групп и каналов)"""
+    digest = hmac.new(_salt, str(abs(int(value))).encode(), hashlib.sha256).hexdigest()
+    pseudonym = 1_000_000_000 + int(digest[:12], 16) % 8_000_000_000
+    return -pseudonym if int(value) < 0 else pseudonym
+
+
+def anonymize_file_id(value):
+    """Стабильный в пределах записи псевдоним file_id (одинаковые файлы остаются одинаковыми)"""
+    return "f" + hmac.new(_salt, value.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def _anonymize_person(value):
+    person = anonymize(value)
+    if "id" in person:
+        person["id"] = anonymize_id(person["id"])
+    if "first_name" in person:
+        # Обязательное поле пользователя в Bot API
+        person["first_name"] = "User"
+    return person
+
+
+def _strip_text(text):
+    if _STRUCTURAL_TEXT.match(text):
+        return text
+    if text.startswith("/"):
+        # Команда сохраняется, аргументы заменяются; длина не меняется, чтобы entities остались верными
+        command, _, rest = text.partition(" ")
+        return command + (" " + "x" * len(rest) if rest else "")
+    return "x" * len(text)
+
+
+def anonymize(data):
+    """Копия обновления без персональных данных: id заменены псевдонимами, тексты вырезаны"""
+    if isinstance(data, list):
+        return [anonymize(item) for item in data]
+    if not isinstance(data, dict):
+        return data
+
+    result = {}
+    for key, value in data.items():
+        if key in _DROPPED_KEYS or key in _PERSONAL_FIELDS:
+            continue
+        if key in _PERSON_KEYS and isinstance(value, dict):
+            result[key] = _anonymize_person(value)
+        elif key in _PERSON_KEYS and isinstance(value, list):
+            result[key] = [_anonymize_person(item) if isinstance(item, dict) else item for item in value]
+        elif key in _NAME_FIELDS and isinstance(value, str):
+            result[key] = "User"
+        elif key in _FILE_ID_FIELDS and isinstance(value, str):
+            result[key] = anonymize_file_id(value)
+        elif key in ("text", "caption") and isinstance(value, str):
+            result[key] = _strip_text(value)
+        elif key == "file_name" and isinstance(value, str):
+            result[key] = "file" + Path(value).suffix
+        elif key in ("data", "callback_data") and isinstance(value, str):
+            result[key] = _ID_IN_DATA.sub(lambda match: str(anonymize_id(match.group())), value)
+        elif key == "user_id" and isinstance(value, int):
+            result[key] = anonymize_id(value)
+        else:
+            result[key] = anonymize(value)
+    return result
+
+
+def _header():
+    return {"header": {"version": FORMAT_VERSION, "admin_id": anonymize_id(Config.ADMIN_ID),
+                       "started": datetime.now().isoformat()}}
+
+
+def _write_loop():
+    """Поток записи: сжатие и диск не занимают цикл событий"""
+    current_path = None
+    log_file = None
+    last_flush = time.monotonic()
+    while True:
+        item = _queue.get()
+        try:
+            if item is None:
+                break
+            arrived, data = item
+            # Шаблон пути может содержать дату (например, updates-%Y%m%d.jsonl.gz)
+            path = datetime.fromtimestamp(arrived).strftime(Config.RECORD_UPDATES_PATH)
+            if path != current_path:
+                if log_file:
+                    log_file.close()
+                Path(path).parent.mkdir(parents=True, exist_ok=True)
+                log_file = gzip.open(path, "at", encoding="utf-8")
+                log_file.write(json.dumps(_header(), ensure_ascii=False) + "\n")
+                current_path = path
+            log_file.write(json.dumps({"t": arrived, "update": anonymize(data)}, ensure_ascii=False) + "\n")
+            if _queue.empty() and time.monotonic() - last_flush > 1:
+                log_file.flush()
+                last_flush = time.monotonic()
+        except Exception as e:
+            logger.error(f"Ошибка записи обновления: {e}")
+        finally:
+            _queue.task_done()
+    if log_file:
+        log_file.close()
+
+
+async def record_update(update: Update, context: CallbackContext):
+    """Постановка обновления в очередь записи; обработка идет дальше без ожидания"""
+    _queue.put((time.time(), update.to_dict()))
+
+
+def attach(application: Application):
+    """Запись всех обновлений приложения, если задан RECORD_UPDATES_PATH"""
+    global _thread
+    if not Config.RECORD_UPDATES_PATH:
+        return
+    # Группа раньше всех остальных: записываются и обновления, которые затем отбросят
+    application.add_handler(TypeHandler(Update, record_update), group=-100)
+    if not _thread:
+        _thread = threading.Thread(target=_write_loop, name="update-recorder", daemon=True)
+        _thread.start()
+    logger.info(f"Запись обновлений включена: {Config.RECORD_UPDATES_PATH}")
+
+
+def stop():
+    """Дописывает очередь и закрывает файл записи"""
+    global _thread
+    if _thread:
+        _queue.put(None)
+        _thread.join(timeout=10)
+        _thread = None
@@ -0,0 +1,170 @@
+# storage.py - дедуплицированное хранилище файлов заказов
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+from config import Config
+import aiofs
+import database
+
+logger = logging.getLogger(__name__)
+
+
+def blob_path(sha256):
+    """Путь к содержимому файла в хранилище (шардирование по первым байтам хеша)"""
+    return Path(Config.BLOB_FOLDER) / sha256[:2] / sha256[2:4] / sha256
+
+
+def _hash_file(path):
+    """Вычисление SHA-256 файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link(source, target):
+    """Создание ссылки на содержимое в папке заказа
+
+    Используется жесткая ссылка, поэтому остальной код работает с файлами
+    заказа как с обычными файлами. Если хранилище на другом разделе, файл копируется.
+    """
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _commit_blob(tmp_path, target_path):
+    """Перенос загруженного файла в хранилище и создание ссылки в папке заказа"""
+    if not tmp_path.exists() or tmp_path.stat().st_size == 0:
+        return None
+
+    sha256 = _hash_file(tmp_path)
+    size = tmp_path.stat().st_size
+    destination = blob_path(sha256)
+
+    if destination.exists():
+        tmp_path.unlink()
+    else:
+        destination.parent.mkdir(exist_ok=True, parents=True)
+        os.replace(tmp_path, destination)
+
+    _link(destination, target_path)
+    return sha256, size
+
+
+def _replace_prefix(path, old, new):
+    path = Path(path)
+    if old and new and path.is_relative_to(old):
+        return Path(new) / path.relative_to(old)
+    return path
+
+
+def local_path(server_path):
+    """Путь к файлу локального сервера Bot API на стороне бота"""
+    return _replace_prefix(server_path, Config.BOT_API_LOCAL_DIR, Config.BOT_API_LOCAL_MOUNT)
+
+
+def server_path(path):
+    """Путь к файлу бота, как его видит локальный сервер Bot API"""
+    return _replace_prefix(Path(path).resolve(), Config.BOT_API_LOCAL_MOUNT, Config.BOT_API_LOCAL_DIR)
+
+
+def _commit_local(source, target_path):
+    """Перенос файла из папки локального сервера Bot API в хранилище без скачивания
+
+    По умолчанию (BOT_API_LOCAL_MOVE) файл переносится: копия сервера иначе
+    осталась бы на диске и после удаления заказа очисткой. При отключенном
+    переносе содержимое связывается жесткой ссылкой и копия сервера остается.
+    """
+    source = Path(source)
+    if not source.exists() or source.stat().st_size == 0:
+        return None
+
+    sha256 = _hash_file(source)
+    size = source.stat().st_size
+    destination = blob_path(sha256)
+
+    if not destination.exists():
+        destination.parent.mkdir(exist_ok=True, parents=True)
+        if Config.BOT_API_LOCAL_MOVE:
+            shutil.move(source, destination)
+        else:
+            _link(source, destination)
+    elif Config.BOT_API_LOCAL_MOVE:
+        source.unlink()
+
+    _link(destination, target_path)
+    return sha256, size
+
+
+def _link_existing(sha256, target_path):
+    """Создание ссылки на уже сохраненное содержимое"""
+    source = blob_path(sha256)
+    if not source.exists():
+        return False
+    _link(source, target_path)
+    return True
+
+
+async def store_file(file, target_path):
+    """Сохранение файла Telegram по пути target_path через хранилище
+
+    Если файл с таким file_unique_id уже есть в хранилище, повторная загрузка
+    не выполняется. Иначе файл скачивается, хешируется и при совпадении хеша
+    с уже сохраненным содержимым временная копия удаляется. С локальным
+    сервером Bot API файл не скачивается, а берется из папки сервера.
+    Работа с диском выполняется в пуле aiofs.
+    """
+    target_path = Path(target_path)
+    file_unique_id = getattr(file, 'file_unique_id', None)
+
+    blob = database.get_blob_by_unique_id(file_unique_id) if file_unique_id else None
+    if blob and await aiofs.run(_link_existing, blob['sha256'], target_path):
+        database.add_file_reference(str(target_path), blob['sha256'], blob['size'], file_unique_id)
+        logger.info(f"Файл {file_unique_id} уже в хранилище, загрузка пропущена")
+        return True
+
+    # Получаем объект File из документа или фото
+    file_obj = await file.get_file() if hasattr(file, 'get_file') else file
+
+    # Локальный сервер отдает абсолютный путь к файлу на своем диске
+    if Config.BOT_API_LOCAL and file_obj.file_path and Path(file_obj.file_path).is_absolute():
+        result = await aiofs.run(_commit_local, local_path(file_obj.file_path), target_path)
+    else:
+        tmp_folder = Path(Config.BLOB_FOLDER) / "tmp"
+        await aiofs.mkdir(tmp_folder)
+        tmp_path = tmp_folder / uuid.uuid4().hex
+        try:
+            await file_obj.download_to_drive(custom_path=tmp_path)
+            result = await aiofs.run(_commit_blob, tmp_path, target_path)
+        finally:
+            await aiofs.unlink(tmp_path)
+
+    if not result:
+        return False
+
+    sha256, size = result
+    database.add_file_reference(str(target_path), sha256, size, file_unique_id)
+    return True
+
+
+def release_folder(folder):
+    """Освобождение ссылок папки заказа перед ее удалением
+
+    Содержимое, на которое больше не ссылается ни один заказ, удаляется из хранилища.
+    """
+    orphaned = database.release_file_references(folder)
+    for sha256 in orphaned:
+        try:
+            blob_path(sha256).unlink(missing_ok=True)
+        except OSError as e:
+            logger.error(f"Ошибка удаления файла {sha256} из хранилища: {e}")
+
+    if orphaned:
+        logger.info(f"Из хранилища удалено файлов: {len(orphaned)}")
+    return len(orphaned)
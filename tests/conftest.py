@@ -0,0 +1,11 @@
+# conftest.py - окружение для тестов: модули бота читают Config при импорте
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123:test')
+os.environ.setdefault('ADMIN_ID', '1')
+os.environ.setdefault('DB_NAME', os.path.join(tempfile.mkdtemp(prefix="bot-tests-"), 'orders.db'))
+os.environ.setdefault('LOG_FILE', '')
@@ -0,0 +1,65 @@
+# test_catchup.py - разбор очереди обновлений после простоя
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from telegram import CallbackQuery, Chat, Message, Update, User
+
+import catchup
+from config import Config
+
+NOW = datetime(2026, 10, 19, 12, 0, tzinfo=timezone.utc)
+STUDENT = User(id=42, first_name="Student", is_bot=False)
+CHAT = Chat(id=42, type=Chat.PRIVATE)
+
+
+def message_update(update_id, sent, message_id=None):
+    message = Message(message_id=message_id or update_id, date=sent, chat=CHAT, from_user=STUDENT, text="текст")
+    return Update(update_id, message=message)
+
+
+def click_update(update_id, card_sent, card_id=1, data="student_paid_ORD-1"):
+    card = Message(message_id=card_id, date=card_sent, chat=CHAT, text="карточка заказа")
+    query = CallbackQuery(id=str(update_id), from_user=STUDENT, chat_instance="ci", message=card, data=data)
+    return Update(update_id, callback_query=query)
+
+
+def plan(updates):
+    return catchup.plan(updates, now=NOW.timestamp())
+
+
+def test_old_keyboard_recent_press_is_processed():
+    # Карточка отправлена вчера, кнопку нажали во время короткого простоя
+    click = click_update(10, NOW - timedelta(days=1))
+    process, superseded, expired = plan([click])
+    assert process == [click] and not superseded and not expired
+
+
+def test_old_keyboard_press_before_recent_message_is_processed():
+    click = click_update(10, NOW - timedelta(days=1))
+    later = message_update(11, NOW - timedelta(minutes=5), message_id=100)
+    process, _, expired = plan([click, later])
+    assert process == [click, later] and not expired
+
+
+def test_press_followed_by_old_message_expires():
+    click = click_update(10, NOW - timedelta(days=2))
+    later = message_update(11, NOW - timedelta(seconds=Config.CATCHUP_CALLBACK_MAX_AGE_S + 60), message_id=100)
+    process, _, expired = plan([click, later])
+    assert expired == [click] and process == [later]
+
+
+def test_repeated_presses_on_one_card_keep_the_last():
+    first = click_update(10, NOW - timedelta(hours=1))
+    second = click_update(11, NOW - timedelta(hours=1))
+    process, superseded, expired = plan([first, second])
+    assert process == [second] and superseded == [first] and not expired
+
+
+def test_antiflood_skips_updates_during_catchup(monkeypatch):
+    # Десятки нажатий за простой не должны тратить корзину пользователя
+    import antiflood
+    monkeypatch.setattr(Config, "FLOOD_BURST", 1)
+    monkeypatch.setattr(catchup, "_running", True)
+    for update_id in range(10):
+        asyncio.run(antiflood.check_flood(click_update(update_id, NOW), None))
+    assert STUDENT.id not in antiflood._buckets
@@ -0,0 +1,108 @@
+# test_loop_stalls.py - файловые операции обработчиков не блокируют цикл событий
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import aiofs
+import database
+import utils
+
+# Допустимая задержка цикла: переключение GIL между потоками занимает до 5 мс
+STALL_LIMIT_S = 0.02
+FILES = 5000
+
+
+async def max_loop_lag(coroutine):
+    """Выполнение корутины с замером наибольшей задержки цикла событий"""
+    lag = 0.0
+    last_beat = time.perf_counter()
+    done = False
+
+    def beat():
+        nonlocal lag, last_beat
+        now = time.perf_counter()
+        lag = max(lag, now - last_beat)
+        last_beat = now
+
+    async def heartbeat():
+        while not done:
+            beat()
+            await asyncio.sleep(0)
+
+    task = asyncio.create_task(heartbeat())
+    try:
+        result = await coroutine
+    finally:
+        # Если корутина ни разу не уступила цикл, пульс не успел бы отметиться
+        beat()
+        done = True
+        await task
+    return result, lag
+
+
+@pytest.fixture
+def order_folder(tmp_path, monkeypatch):
+    """Папка заказа с большим числом файлов"""
+    monkeypatch.chdir(tmp_path)
+    database.init_db()
+    folder = utils.create_order_folder("T-1", 42)
+    payload = os.urandom(2048)
+    for i in range(FILES):
+        (folder / f"file_{i}.bin").write_bytes(payload)
+    return folder
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_document(self, **kwargs):
+        self.sent.append(kwargs)
+
+    async def send_message(self, **kwargs):
+        self.sent.append(kwargs)
+
+
+def test_list_files_does_not_block(order_folder):
+    files, lag = asyncio.run(max_loop_lag(aiofs.list_files(order_folder)))
+    assert len(files) == FILES
+    assert lag < STALL_LIMIT_S
+
+
+def test_delete_order_files_does_not_block(order_folder):
+    deleted, lag = asyncio.run(max_loop_lag(utils.delete_order_files("T-1", 42)))
+    assert deleted and not order_folder.exists()
+    assert lag < STALL_LIMIT_S
+
+
+def test_send_files_as_archive_does_not_block(order_folder):
+    files = sorted(order_folder.iterdir())
+    bot = FakeBot()
+    update = SimpleNamespace(effective_chat=SimpleNamespace(id=42))
+    sent, lag = asyncio.run(max_loop_lag(
+        utils.send_files_as_archive(update, SimpleNamespace(bot=bot), files, "Файлы")))
+    assert sent and bot.sent[0]['filename'] == "files.zip"
+    assert lag < STALL_LIMIT_S
+
+
+def test_upload_source_reads_file_off_loop(tmp_path):
+    path = tmp_path / "work.pdf"
+    path.write_bytes(os.urandom(20 * 1024 * 1024))
+    source, lag = asyncio.run(max_loop_lag(utils.upload_source(path)))
+    assert source.filename == "work.pdf"
+    assert lag < STALL_LIMIT_S
+
+
+def test_create_backup_does_not_block(order_folder, monkeypatch):
+    monkeypatch.setattr(utils.Config, 'BACKUP_ENABLED', True)
+    backups = order_folder.parent.parent.parent / "backups"
+    backups.mkdir()
+    for i in range(FILES):
+        (backups / f"backup_{i:05d}.db").touch()
+    bot = FakeBot()
+    _, lag = asyncio.run(max_loop_lag(utils.create_backup(SimpleNamespace(bot=bot))))
+    assert len(list(backups.glob("backup_*.db"))) == 7
+    assert lag < STALL_LIMIT_S
@@ -0,0 +1,55 @@
+# test_recorder.py - обезличивание записанных обновлений
+import json
+
+import recorder
+
+STUDENT_ID = 303823076
+ORIGINAL_VALUES = ("303823076", "Иван", "Петров", "ivan_petrov", "Мария Скрытая", "Канал Ивана",
+                   "BQACAgIAAxkBAAIBZ2Zk", "AgADsQ8AAk")
+
+
+def sample_update():
+    student = {"id": STUDENT_ID, "is_bot": False, "first_name": "Иван", "last_name": "Петров",
+               "username": "ivan_petrov"}
+    chat = {"id": STUDENT_ID, "type": "private", "first_name": "Иван", "username": "ivan_petrov"}
+    message = {
+        "message_id": 10, "date": 1760000000, "chat": chat, "from": student,
+        "caption": "работа Иван Петров",
+        "document": {"file_id": "BQACAgIAAxkBAAIBZ2Zk", "file_unique_id": "AgADsQ8AAk",
+                     "file_name": "Петров_курсовая.pdf"},
+        "forward_origin": {"type": "user", "date": 1760000000, "sender_user": student},
+        "forward_sender_name": "Мария Скрытая",
+        "reply_markup": {"inline_keyboard": [[
+            {"text": "Оплачено", "callback_data": f"student_paid_ORD-{STUDENT_ID}-1"}]]},
+    }
+    hidden = {"message_id": 11, "date": 1760000000, "chat": chat, "from": student, "text": "x",
+              "forward_origin": {"type": "hidden_user", "date": 1760000000, "sender_user_name": "Мария Скрытая"}}
+    channel = {"message_id": 12, "date": 1760000000, "chat": chat, "from": student, "text": "x",
+               "forward_origin": {"type": "channel", "date": 1760000000, "message_id": 5,
+                                  "chat": {"id": -100 * STUDENT_ID, "type": "channel", "title": "Канал Ивана"},
+                                  "author_signature": "Иван"}}
+    return {
+        "update_id": 1,
+        "message": message,
+        "edited_message": hidden,
+        "channel_post": channel,
+        "callback_query": {"id": "q1", "from": student, "chat_instance": "ci", "message": message,
+                           "data": f"admin_accept_{STUDENT_ID}"},
+    }
+
+
+def test_anonymize_leaves_no_original_ids_or_names():
+    dumped = json.dumps(recorder.anonymize(sample_update()), ensure_ascii=False)
+    for value in ORIGINAL_VALUES:
+        assert value not in dumped, value
+
+
+def test_anonymize_is_stable_within_recording():
+    first = recorder.anonymize(sample_update())
+    second = recorder.anonymize(sample_update())
+    assert first == second
+    message = first["message"]
+    assert message["from"]["id"] == message["forward_origin"]["sender_user"]["id"]
+    assert str(message["from"]["id"]) in first["callback_query"]["data"]
+    button = message["reply_markup"]["inline_keyboard"][0][0]
+    assert str(message["from"]["id"]) in button["callback_data"]
@@ -0,0 +1,182 @@
+# update_processor.py - параллельная обработка обновлений с приоритетами
+#
+# Обновления делятся на полосы: администратор, платежные решения студентов,
+# остальные действия студентов и прочие обновления (без пользователя); задачи
+# JobQueue (очистка, резервные копии, проверка сроков) идут последней полосой.
+# Освободившееся место получает ожидающее обновление самой приоритетной полосы,
+# а часть мест студентам недоступна совсем, поэтому нажатия администратора не
+# ждут за загрузками файлов. Обновления одного пользователя обрабатываются
+# строго по порядку: состояния диалогов ConversationHandler не перемешиваются.
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from config import Config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Полосы в порядке приоритета
+LANES = ("admin", "payment", "student", "other", "jobs")
+# Полосы, которым доступны зарезервированные места
+_PRIORITY_LANES = {"admin", "payment"}
+# Решения студента по цене, оплате и приемке работы
+_PAYMENT_CALLBACKS = ("student_approve_", "student_reject_", "student_paid_", "user_paid_",
+                      "student_accept_work_", "student_revise_work_")
+# Ограничение на число задач, ожидающих места (защита от неограниченного роста)
+_MAX_PENDING = 10_000
+
+LANE_WAIT = metrics.Histogram("bot_update_lane_wait_seconds", "Ожидание места для обработки обновления по полосам",
+                              labels=("lane",))
+LANE_LATENCY = metrics.Histogram("bot_update_lane_duration_seconds",
+                                 "Время от получения до конца обработки обновления по полосам", labels=("lane",))
+
+
+def classify(update):
+    """Полоса приоритета обновления"""
+    if not isinstance(update, Update):
+        return "other"
+    user = update.effective_user
+    if user is None:
+        return "other"
+    if user.id == Config.ADMIN_ID:
+        return "admin"
+    query = update.callback_query
+    if query and query.data and query.data.startswith(_PAYMENT_CALLBACKS):
+        return "payment"
+    return "student"
+
+
+class _LaneSlots:
+    """Семафор с приоритетами полос и местами, зарезервированными для приоритетных полос"""
+
+    def __init__(self, limit, reserved):
+        self.limit = limit
+        self.student_limit = max(1, limit - reserved)
+        self.in_use = 0
+        self.low_in_use = 0
+        self.waiters = {lane: deque() for lane in LANES}
+
+    def _can_start(self, lane):
+        if self.in_use >= self.limit:
+            return False
+        return lane in _PRIORITY_LANES or self.low_in_use < self.student_limit
+
+    def _take(self, lane):
+        self.in_use += 1
+        if lane not in _PRIORITY_LANES:
+            self.low_in_use += 1
+
+    async def acquire(self, lane):
+        if self._can_start(lane) and not any(self.waiters[name] for name in LANES[:LANES.index(lane) + 1]):
+            self._take(lane)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[lane].append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Место уже передано этой задаче: возвращаем его следующей
+                self.release(lane)
+            else:
+                self.waiters[lane].remove(future)
+            raise
+
+    def release(self, lane):
+        self.in_use -= 1
+        if lane not in _PRIORITY_LANES:
+            self.low_in_use -= 1
+        for name in LANES:
+            queue = self.waiters[name]
+            while queue and queue[0].done():
+                queue.popleft()
+            if queue and self._can_start(name):
+                self._take(name)
+                queue.popleft().set_result(None)
+                return
+
+    def waiting(self, lane):
+        return sum(1 for future in self.waiters[lane] if not future.done())
+
+
+class PriorityUpdateProcessor(BaseUpdateProcessor):
+    """Обработчик обновлений для Application.concurrent_updates с полосами приоритета"""
+
+    def __init__(self, max_concurrent_updates, reserved_slots=0):
+        # Семафор базового класса только ограничивает число ожидающих задач:
+        # реальный лимит и очередность задаются местами полос
+        super().__init__(_MAX_PENDING)
+        self.slots = _LaneSlots(max_concurrent_updates, reserved_slots)
+        self._user_locks = {}
+        metrics.gauge("bot_update_lane_waiting", "Обновления и задачи, ожидающие места, по полосам",
+                      lambda: {lane: self.slots.waiting(lane) for lane in LANES}, labels=("lane",))
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _lock_for(self, update):
+        """Блокировка пользователя (или None) и ключ для ее освобождения"""
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            return None, None
+        entry = self._user_locks.setdefault(user.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        return entry[0], user.id
+
+    def _unlock(self, key):
+        entry = self._user_locks.get(key)
+        if entry:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._user_locks[key]
+
+    async def _run(self, lane, received, coroutine):
+        await self.slots.acquire(lane)
+        LANE_WAIT.observe(time.perf_counter() - received, lane)
+        try:
+            await coroutine
+        finally:
+            self.slots.release(lane)
+
+    def wrap_job(self, callback):
+        """Задача JobQueue, выполняемая в полосе jobs: не занимает места администратора"""
+
+        @functools.wraps(callback)
+        async def wrapper(context):
+            received = time.perf_counter()
+            coroutine = callback(context)
+            try:
+                await self._run("jobs", received, coroutine)
+            except asyncio.CancelledError:
+                coroutine.close()
+                raise
+            finally:
+                LANE_LATENCY.observe(time.perf_counter() - received, "jobs")
+
+        return wrapper
+
+    async def do_process_update(self, update, coroutine):
+        lane = classify(update)
+        received = time.perf_counter()
+        lock, key = self._lock_for(update)
+        try:
+            if lock is None:
+                await self._run(lane, received, coroutine)
+            else:
+                # Сначала очередь пользователя, потом общее место: ожидание своей очереди мест не занимает
+                async with lock:
+                    await self._run(lane, received, coroutine)
+        except asyncio.CancelledError:
+            # Отмена до начала обработки (остановка бота): корутина так и не была запущена
+            coroutine.close()
+            raise
+        finally:
+            self._unlock(key)
+            LANE_LATENCY.observe(time.perf_counter() - received, lane)
@@ -1,11 +1,13 @@
 # user_handlers.py - обработчики для пользовательской части бота
+import functools
 import logging
-import shutil
 from pathlib import Path
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext, ConversationHandler
 from config import Config
+import aiofs
 import database
+import order_session
 import utils
 from keyboards import (
     get_disciplines_keyboard, get_work_types_keyboard, get_plagiarism_systems_keyboard,
@@ -13,7 +15,7 @@ from keyboards import (
     get_skip_description_keyboard, get_user_main_keyboard, get_info_keyboard,
     get_back_to_info_keyboard, get_payment_confirmation_keyboard,
     get_student_confirmation_keyboard, get_payment_keyboard, get_work_approval_keyboard,
-    get_orders_list_keyboard, get_order_details_keyboard
+    get_orders_list_keyboard, get_order_details_keyboard, get_user_chat_keyboard
 )
 
 logger = logging.getLogger(__name__)
@@ -23,8 +25,8 @@ logger = logging.getLogger(__name__)
     USER_SELECTING_ACTION, USER_CHOOSE_DISCIPLINE, USER_CHOOSE_WORK_TYPE, USER_SET_CUSTOM_WORK_TYPE,
     USER_SET_DEADLINE, USER_SELECT_BUDGET_TYPE, USER_SET_BUDGET, USER_SET_PLAGIARISM_REQUIRED,
     USER_CHOOSING_PLAGIARISM_SYSTEM, USER_SET_PLAGIARISM_PERCENT, USER_UPLOAD_FILES,
-    USER_SET_DESCRIPTION, USER_VIEWING_ORDERS, USER_INFO_MENU, USER_ORDER_DETAILS
-) = range(15)
+    USER_SET_DESCRIPTION, USER_VIEWING_ORDERS, USER_INFO_MENU, USER_ORDER_DETAILS, USER_CHAT
+) = range(16)
 
 
 async def user_start(update: Update, context: CallbackContext):
@@ -404,42 +406,52 @@ async def user_handle_files(update: Update, context: CallbackContext):
         await update.message.reply_text("Ошибка: данные заказа не найдены. Начните заново.")
         return USER_SELECTING_ACTION
 
-    # Сохраняем файл
-    file = None
-    file_path = None
+    file = utils.get_message_file(update.message)
 
-    if update.message.document:
-        file = update.message.document
-    elif update.message.photo:
-        file = update.message.photo[-1]  # Берем самое большое фото
-
-    if file:
-        file_path = await utils.save_file(file, Path(order_data['files_folder']))
-
-    if file_path:
-        # Добавляем файл в список
-        if 'files' not in order_data:
-            order_data['files'] = []
-
-        order_data['files'].append(file_path)
-        context.user_data['order_data'] = order_data
+    if not file:
+        await update.message.reply_text("❌ Не удалось сохранить файл. Попробуйте еще раз.")
+        return USER_UPLOAD_FILES
 
-        await update.message.reply_text(
-            f"✅ Файл сохранен. Загружено файлов: {len(order_data['files'])}\n\n"
-            f"Продолжайте загрузку или нажмите 'Завершить загрузку':",
-            reply_markup=get_upload_done_keyboard()
+    if update.message.media_group_id:
+        # Файлы альбома сохраняются одной пачкой после окончания сбора
+        utils.collect_media_group(
+            update.message, context, file,
+            functools.partial(_store_order_files, order_data=order_data)
         )
     else:
-        await update.message.reply_text("❌ Не удалось сохранить файл. Попробуйте еще раз.")
+        await _store_order_files(update.message, [file], order_data)
 
     return USER_UPLOAD_FILES
 
 
+async def _store_order_files(message, files, order_data):
+    """Сохранение пачки файлов заказа с одним итоговым ответом"""
+    saved, rejected, status_message = await utils.save_files_batch(
+        message, files, Path(order_data['files_folder']),
+        quota=(order_data['user_id'], order_data['order_id'])
+    )
+
+    # Добавляем файлы в список
+    order_data.setdefault('files', []).extend(saved)
+
+    text = utils.format_upload_result(
+        len(saved), len(files), rejected, len(order_data['files']),
+        "Продолжайте загрузку или нажмите 'Завершить загрузку':"
+    )
+    await utils.send_upload_summary(
+        message, status_message, text,
+        reply_markup=get_upload_done_keyboard() if saved else None
+    )
+
+
 async def user_handle_upload_done(update: Update, context: CallbackContext):
     """Завершение загрузки файлов"""
     query = update.callback_query
     await query.answer()
 
+    # Дожидаемся сохранения альбомов, отправленных перед нажатием кнопки
+    await utils.wait_media_groups(query.message.chat_id)
+
     order_data = context.user_data.get('order_data', {})
 
     if not order_data:
@@ -741,20 +753,19 @@ async def user_download_work(update: Update, context: CallbackContext):
 
     # Отправляем файлы пользователю
     user_id = order['user_id']
-    completed_folder = utils.create_order_folder(order_id, user_id, "completed")
+    completed_folder = utils.get_order_folder(order_id, user_id, "completed")
+    files = await aiofs.list_files(completed_folder)
 
-    if completed_folder and completed_folder.exists():
-        files = list(completed_folder.glob('*'))
+    if files:
         for file in files:
-            if file.is_file():
-                try:
-                    await context.bot.send_document(
-                        chat_id=query.message.chat_id,
-                        document=open(file, 'rb'),
-                        caption=f"Файл из заказа #{order_id}"
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка отправки файла {file.name}: {e}")
+            try:
+                await context.bot.send_document(
+                    chat_id=query.message.chat_id,
+                    document=await utils.upload_source(file),
+                    caption=f"Файл из заказа #{order_id}"
+                )
+            except Exception as e:
+                logger.error(f"Ошибка отправки файла {file.name}: {e}")
 
         await query.answer("Файлы отправлены в чат.")
     else:
@@ -772,6 +783,68 @@ async def user_back_to_orders(update: Update, context: CallbackContext):
     return await show_orders_page(update, context, page)
 
 
+async def user_message_expert(update: Update, context: CallbackContext):
+    """Начало переписки с экспертом по заказу"""
+    query = update.callback_query
+    await query.answer()
+
+    order_id = query.data.replace('user_message_expert_', '')
+    order = database.get_order_details(order_id)
+
+    if not order or order['user_id'] != query.from_user.id:
+        await query.edit_message_text("Заказ не найден.")
+        return USER_VIEWING_ORDERS
+
+    context.user_data['chat_order_id'] = order_id
+    await query.edit_message_text(
+        f"💬 Переписка по заказу #{order_id}\n\n"
+        "Отправьте сообщение, голосовое, фото, видео или документ - эксперт получит их сразу.",
+        reply_markup=get_user_chat_keyboard()
+    )
+    return USER_CHAT
+
+
+async def _relay_to_admin(update: Update, context: CallbackContext, order_id):
+    """Пересылка сообщения студента администратору с записью в историю"""
+    message = update.message
+    try:
+        message_type, file_id, history_text, sent_id = await utils.relay_message(
+            context.bot, message, Config.ADMIN_ID,
+            f"📩 Сообщение от студента @{update.effective_user.username or 'Не указано'} "
+            f"по заказу #{order_id} (ответьте на него, чтобы написать студенту)"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка пересылки сообщения администратору: {e}")
+        await message.reply_text("❌ Не удалось отправить сообщение. Попробуйте позже.")
+        return False
+
+    utils.remember_relay(context, Config.ADMIN_ID, sent_id, order_id)
+    database.queue_message_to_history(order_id, "student", history_text, message_type, file_id)
+    return True
+
+
+async def user_chat_message(update: Update, context: CallbackContext):
+    """Сообщение студента в режиме переписки с экспертом"""
+    order_id = context.user_data.get('chat_order_id')
+    if not order_id:
+        await update.message.reply_text("Заказ не выбран. Откройте заказ в разделе «Мои заказы».")
+        return USER_VIEWING_ORDERS
+
+    if await _relay_to_admin(update, context, order_id):
+        await update.message.reply_text("✅ Сообщение отправлено эксперту.", reply_markup=get_user_chat_keyboard())
+    return USER_CHAT
+
+
+async def user_reply_relay(update: Update, context: CallbackContext):
+    """Ответ студента на сообщение эксперта вне режима переписки"""
+    order_id = utils.get_relayed_order(context, update.message)
+    if not order_id:
+        return
+
+    if await _relay_to_admin(update, context, order_id):
+        await update.message.reply_text("✅ Ответ отправлен эксперту.")
+
+
 async def user_orders_navigation(update: Update, context: CallbackContext):
     """Навигация по страницам заказов"""
     query = update.callback_query
@@ -900,6 +973,7 @@ async def user_info_back(update: Update, context: CallbackContext):
 
 
 # Обработчики для студента
+@order_session.unit_of_work
 async def student_approve_order(update: Update, context: CallbackContext):
     """Обработка подтверждения заказа студентом"""
     query = update.callback_query
@@ -908,13 +982,13 @@ async def student_approve_order(update: Update, context: CallbackContext):
     order_id = query.data.split('_')[-1]
 
     # Получаем информацию о заказе
-    order = database.get_order_details(order_id)
+    order = await order_session.get_order(order_id)
     if not order:
         await query.edit_message_text("Заказ не найден.")
         return
 
     # Обновляем статус заказа
-    database.update_order_status(order_id, 'waiting_payment')
+    order_session.set_status(order_id, 'waiting_payment')
 
     # Генерируем платежную ссылку
     from payment import generate_robokassa_payment_link
@@ -925,8 +999,9 @@ async def student_approve_order(update: Update, context: CallbackContext):
         user_id=order['user_id']
     )
 
-    # Обновляем платежную ссылку в базе
-    database.update_payment_url(order_id, payment_url)
+    # Сохраняем статус и платежную ссылку одним запросом
+    order_session.update_order(order_id, payment_url=payment_url)
+    order_session.flush()
 
     # Отправляем сообщение с кнопкой оплаты
     payment_message = (
@@ -969,10 +1044,7 @@ async def student_reject_order(update: Update, context: CallbackContext):
 
     # Удаляем файлы заказа
     if order:
-        user_id = order['user_id']
-        order_folder = utils.create_order_folder(order_id, user_id)
-        if order_folder and order_folder.exists():
-            shutil.rmtree(order_folder)
+        await utils.delete_order_files(order_id, order['user_id'], ("uploads",))
 
     # Уведомляем администратора
     try:
@@ -987,6 +1059,7 @@ async def student_reject_order(update: Update, context: CallbackContext):
     await query.edit_message_text("❌ Заказ отменен и удален.")
 
 
+@order_session.unit_of_work
 async def student_paid_order(update: Update, context: CallbackContext):
     """Обработка подтверждения оплаты студентом"""
     query = update.callback_query
@@ -994,9 +1067,10 @@ async def student_paid_order(update: Update, context: CallbackContext):
 
     order_id = query.data.split('_')[-1]
 
-    # Обновляем статус заказа
-    database.update_order_status(order_id, 'paid')
-    database.update_payment_status(order_id, 'paid')
+    # Обновляем статус заказа и оплаты одним запросом
+    order_session.set_status(order_id, 'paid')
+    order_session.update_order(order_id, payment_status='paid')
+    order_session.flush()
 
     # Уведомляем администратора
     try:
@@ -5,13 +5,19 @@ import uuid
 import asyncio
 import functools
 import shutil
+import sqlite3
 import zipfile
 from pathlib import Path
 from datetime import datetime, timedelta
 from io import BytesIO
-from telegram import Update
+from telegram import InputFile, Update
+from telegram.error import BadRequest, Forbidden, RetryAfter
 from telegram.ext import CallbackContext
 from config import Config
+import aiofs
+import database
+import storage
+from bot_request import CircuitOpenError, backoff_delay
 
 logger = logging.getLogger(__name__)
 
@@ -22,14 +28,17 @@ def generate_order_id(user_id):
     return f"{user_id}-{date_str}-{uuid.uuid4().hex[:4]}"
 
 
+def get_order_folder(order_id, user_id, folder_type="uploads"):
+    """Путь к папке файлов заказа (без создания)"""
+    if folder_type == "completed":
+        return Path(Config.COMPLETED_FOLDER) / str(user_id) / order_id
+    return Path(Config.BASE_UPLOAD_FOLDER) / str(user_id) / order_id
+
+
 def create_order_folder(order_id, user_id, folder_type="uploads"):
     """Создание папки для файлов заказа"""
     try:
-        if folder_type == "completed":
-            base_path = Path(Config.COMPLETED_FOLDER) / str(user_id) / order_id
-        else:
-            base_path = Path(Config.BASE_UPLOAD_FOLDER) / str(user_id) / order_id
-
+        base_path = get_order_folder(order_id, user_id, folder_type)
         base_path.mkdir(exist_ok=True, parents=True)
         return base_path
     except Exception as e:
@@ -37,10 +46,25 @@ def create_order_folder(order_id, user_id, folder_type="uploads"):
         return None
 
 
+def _free_file_path(file_path):
+    """Первое свободное имя вида name, name_1, name_2..."""
+    counter = 1
+    original_name = file_path.stem
+    candidate = file_path
+    while candidate.exists():
+        candidate = file_path.with_name(f"{original_name}_{counter}{file_path.suffix}")
+        counter += 1
+    return candidate
+
+
+def _is_nonempty_file(path):
+    return path.exists() and path.stat().st_size > 0
+
+
 async def save_file(file, order_folder, file_name=None):
     """Сохранение загруженного файла"""
     try:
-        if not order_folder or not order_folder.exists():
+        if not order_folder or not await aiofs.exists(order_folder):
             return None
 
         if not file_name:
@@ -52,25 +76,14 @@ async def save_file(file, order_folder, file_name=None):
                 file_ext = '.jpg'
             file_name = f"{uuid.uuid4().hex[:8]}{file_ext}"
 
-        file_path = order_folder / file_name
-
         # Проверяем, существует ли файл с таким именем
-        counter = 1
-        original_name = file_path.stem
-        while file_path.exists():
-            file_name = f"{original_name}_{counter}{file_path.suffix}"
-            file_path = order_folder / file_name
-            counter += 1
-
-        # Получаем объект File из документа или фото
-        if hasattr(file, 'file_id'):
-            file_obj = await file.get_file()
-            await file_obj.download_to_drive(custom_path=file_path)
-        else:
-            # Для фото
-            await file.download_to_drive(custom_path=file_path)
+        file_path = await aiofs.run(_free_file_path, order_folder / file_name)
+
+        # Содержимое сохраняется в общее хранилище, в папке заказа остается ссылка
+        if not await storage.store_file(file, file_path):
+            return None
 
-        if file_path.exists() and file_path.stat().st_size > 0:
+        if await aiofs.run(_is_nonempty_file, file_path):
             return str(file_path)
         return None
     except Exception as e:
@@ -78,23 +91,346 @@ async def save_file(file, order_folder, file_name=None):
         return None
 
 
+# Занятое загрузками место: user_id / order_id -> байты
+_storage_usage = {'users': {}, 'orders': {}}
+
+
+def _folder_size(folder):
+    """Суммарный размер файлов в папке"""
+    folder = Path(folder)
+    if not folder.exists():
+        return 0
+    return sum(path.stat().st_size for path in folder.rglob('*') if path.is_file())
+
+
+def _get_storage_usage(user_id, order_id):
+    """Текущий объем файлов пользователя и заказа
+
+    Значения считаются с диска один раз, дальше учитываются инкрементально.
+    """
+    users = _storage_usage['users']
+    orders = _storage_usage['orders']
+    if user_id not in users:
+        users[user_id] = _folder_size(Path(Config.BASE_UPLOAD_FOLDER) / str(user_id))
+    if order_id not in orders:
+        orders[order_id] = _folder_size(Path(Config.BASE_UPLOAD_FOLDER) / str(user_id) / order_id)
+    return users[user_id], orders[order_id]
+
+
+async def load_storage_usage(user_id, order_id):
+    """Подсчет объема файлов с диска в пуле aiofs до первой проверки квоты"""
+    if user_id not in _storage_usage['users'] or order_id not in _storage_usage['orders']:
+        await aiofs.run(_get_storage_usage, user_id, order_id)
+
+
+def _add_storage_usage(user_id, order_id, size):
+    """Изменение учтенного объема файлов пользователя и заказа"""
+    _get_storage_usage(user_id, order_id)
+    _storage_usage['users'][user_id] = max(0, _storage_usage['users'][user_id] + size)
+    _storage_usage['orders'][order_id] = max(0, _storage_usage['orders'][order_id] + size)
+
+
+def release_order_storage(order_id, user_id):
+    """Снятие с учета файлов удаленного заказа"""
+    size = _storage_usage['orders'].pop(order_id, None)
+    if size and user_id in _storage_usage['users']:
+        _storage_usage['users'][user_id] = max(0, _storage_usage['users'][user_id] - size)
+
+
+def validate_upload(file, quota=None, check_type=True):
+    """Проверка файла по метаданным Telegram до загрузки
+
+    quota - пара (user_id, order_id), для которой проверяются и резервируются
+    квоты на объем. Возвращает (True, None) или (False, причина отказа).
+    """
+    size = getattr(file, 'file_size', None) or 0
+    if size > Config.MAX_FILE_SIZE:
+        return False, (f"Файл слишком большой ({format_file_size(size)}). "
+                       f"Максимальный размер: {format_file_size(Config.MAX_FILE_SIZE)}")
+
+    # У фото нет mime_type, Telegram всегда отдает их в JPEG
+    mime_type = getattr(file, 'mime_type', None)
+    if check_type and mime_type and mime_type not in Config.ALLOWED_FILE_TYPES:
+        file_name = getattr(file, 'file_name', None) or mime_type
+        return False, f"Тип файла {file_name} не поддерживается"
+
+    if quota:
+        user_id, order_id = quota
+        user_usage, order_usage = _get_storage_usage(user_id, order_id)
+        if order_usage + size > Config.MAX_ORDER_STORAGE:
+            return False, f"Превышен лимит файлов заказа ({format_file_size(Config.MAX_ORDER_STORAGE)})"
+        if user_usage + size > Config.MAX_USER_STORAGE:
+            return False, f"Превышен лимит ваших файлов ({format_file_size(Config.MAX_USER_STORAGE)})"
+        # Резервируем место сразу, чтобы параллельные загрузки не превысили квоту
+        _add_storage_usage(user_id, order_id, size)
+
+    return True, None
+
+
+# Альбомы, ожидающие окончания сбора: (chat_id, media_group_id) -> файлы
+_media_groups = {}
+# Незавершенные задачи сохранения альбомов по чатам
+_pending_uploads = {}
+# Общий лимит одновременных загрузок с серверов Telegram
+_download_semaphore = asyncio.Semaphore(Config.MAX_PARALLEL_DOWNLOADS)
+
+
+def get_message_file(message):
+    """Получение документа или самого большого фото из сообщения"""
+    if message.document:
+        return message.document
+    if message.photo:
+        return message.photo[-1]
+    return None
+
+
+# Типы медиа, которые пересылаются через copy_message, и их подписи в истории
+RELAY_MEDIA_TYPES = {
+    'voice': "🎤 Голосовое сообщение",
+    'photo': "🖼 Фото",
+    'video': "🎬 Видео",
+    'document': "📎 Документ",
+}
+
+
+def get_relay_media(message):
+    """Тип и file_id медиа в сообщении, (None, None) для остальных сообщений"""
+    for message_type in RELAY_MEDIA_TYPES:
+        media = getattr(message, message_type, None)
+        if media:
+            if message_type == 'photo':
+                media = media[-1]
+            return message_type, media.file_id
+    return None, None
+
+
+async def relay_message(bot, message, chat_id, header):
+    """Пересылка сообщения переписки без загрузки файлов на диск
+
+    Медиа остаются на серверах Telegram: copy_message отправляет их повторно
+    по file_id, к подписи добавляется заголовок header. Текст отправляется
+    с заголовком обычным сообщением. Возвращает (тип, file_id, текст для
+    истории, id отправленного сообщения).
+    """
+    if message.text:
+        sent = await bot.send_message(chat_id=chat_id, text=f"{header}:\n\n{message.text}")
+        return "text", "", message.text, sent.message_id
+
+    message_type, file_id = get_relay_media(message)
+    history_text = message.caption or RELAY_MEDIA_TYPES[message_type]
+    caption = f"{header}\n\n{message.caption}" if message.caption else header
+    sent = await bot.copy_message(
+        chat_id=chat_id,
+        from_chat_id=message.chat_id,
+        message_id=message.message_id,
+        caption=caption[:1024]
+    )
+    return message_type, file_id, history_text, sent.message_id
+
+
+def remember_relay(context, chat_id, message_id, order_id):
+    """Запоминание заказа пересланного сообщения, чтобы ответ на него ушел по адресу"""
+    relays = context.bot_data.setdefault('relay_map', {})
+    relays[(chat_id, message_id)] = order_id
+    # Словарь хранит порядок вставки, старые записи удаляются первыми
+    while len(relays) > Config.RELAY_MAP_SIZE:
+        del relays[next(iter(relays))]
+
+
+def get_relayed_order(context, message):
+    """Заказ, к которому относится сообщение-ответ, или None"""
+    reply = message.reply_to_message if message else None
+    if not reply:
+        return None
+    return context.bot_data.get('relay_map', {}).get((message.chat_id, reply.message_id))
+
+
+async def flush_message_history(context: CallbackContext):
+    """Периодическая запись накопленной истории переписки"""
+    database.flush_message_history()
+
+
+def format_history_page(order_id, messages, has_older):
+    """Текст страницы истории переписки (сообщения выводятся от старых к новым)"""
+    if not messages:
+        return f"📜 История переписки по заказу #{order_id} пуста."
+
+    senders = {'admin': "👨‍💼 Эксперт", 'student': "👤 Студент"}
+    lines = [f"📜 История переписки по заказу #{order_id}\n"]
+    if has_older:
+        lines.append("…\n")
+    for message in reversed(messages):
+        timestamp = message['timestamp'][:16].replace('T', ' ')
+        sender = senders.get(message['sender_type'], message['sender_type'])
+        text = message['message_text'] or ""
+        if message.get('message_type', 'text') not in ('text', None):
+            label = RELAY_MEDIA_TYPES.get(message['message_type'], "📎 Файл")
+            text = label if text == label else f"{label}: {text}"
+        lines.append(f"{sender} ({timestamp}):\n{text}\n")
+
+    return "\n".join(lines)[:Config.MAX_MESSAGE_LENGTH]
+
+
+def collect_media_group(message, context, file, on_complete):
+    """Сбор файлов альбома в одну пачку
+
+    Файлы с одинаковым media_group_id накапливаются, пока в течение
+    Config.MEDIA_GROUP_WINDOW не перестанут приходить новые, после чего
+    on_complete(message, files) вызывается один раз для всего альбома.
+    """
+    loop = asyncio.get_running_loop()
+    key = (message.chat_id, message.media_group_id)
+
+    group = _media_groups.get(key)
+    if group:
+        group['files'].append(file)
+        group['last_seen'] = loop.time()
+        return
+
+    _media_groups[key] = {'files': [file], 'last_seen': loop.time()}
+    task = context.application.create_task(_flush_media_group(key, message, on_complete))
+
+    chat_tasks = _pending_uploads.setdefault(message.chat_id, set())
+    chat_tasks.add(task)
+    task.add_done_callback(chat_tasks.discard)
+
+
+async def _flush_media_group(key, message, on_complete):
+    """Ожидание окончания альбома и передача его файлов обработчику"""
+    loop = asyncio.get_running_loop()
+    while True:
+        remaining = _media_groups[key]['last_seen'] + Config.MEDIA_GROUP_WINDOW - loop.time()
+        if remaining <= 0:
+            break
+        await asyncio.sleep(remaining)
+
+    files = _media_groups.pop(key)['files']
+    try:
+        await on_complete(message, files)
+    except Exception as e:
+        logger.error(f"Ошибка обработки альбома {key[1]}: {e}")
+
+
+async def wait_media_groups(chat_id):
+    """Ожидание сохранения всех альбомов, отправленных в чат"""
+    tasks = list(_pending_uploads.get(chat_id, ()))
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def save_files_batch(message, files, order_folder, quota=None, check_type=True):
+    """Параллельное сохранение пачки файлов
+
+    Перед загрузкой каждый файл проверяется validate_upload, отклоненные не
+    скачиваются. Для нескольких файлов отправляется одно сообщение о прогрессе,
+    которое редактируется по мере загрузки. Возвращает список сохраненных путей,
+    список причин отказа и это сообщение (None для одиночного файла).
+    """
+    if quota:
+        await load_storage_usage(*quota)
+
+    rejected = []
+    accepted = []
+    for file in files:
+        is_valid, reason = validate_upload(file, quota, check_type)
+        if is_valid:
+            accepted.append(file)
+        else:
+            rejected.append(reason)
+
+    files = accepted
+    total = len(files)
+    if not total:
+        return [], rejected, None
+
+    status_message = None
+    if total > 1:
+        status_message = await message.reply_text(f"⏳ Сохранение файлов: 0/{total}")
+
+    loop = asyncio.get_running_loop()
+    progress = {'done': 0, 'last_edit': loop.time()}
+
+    async def _save(file):
+        async with _download_semaphore:
+            file_path = await save_file(file, order_folder)
+
+        if not file_path and quota:
+            # Возвращаем зарезервированное место
+            _add_storage_usage(*quota, -(getattr(file, 'file_size', None) or 0))
+
+        progress['done'] += 1
+        # Не чаще раза в секунду, чтобы не упираться в лимиты на редактирование
+        if status_message and progress['done'] < total and loop.time() - progress['last_edit'] >= 1:
+            progress['last_edit'] = loop.time()
+            try:
+                await status_message.edit_text(f"⏳ Сохранение файлов: {progress['done']}/{total}")
+            except Exception as e:
+                logger.warning(f"Не удалось обновить прогресс загрузки: {e}")
+        return file_path
+
+    results = await asyncio.gather(*(_save(file) for file in files))
+    return [file_path for file_path in results if file_path], rejected, status_message
+
+
+def format_upload_result(saved_count, batch_size, rejected, total_count, hint):
+    """Текст итога загрузки пачки файлов"""
+    if not saved_count:
+        text = "❌ Не удалось сохранить файл. Попробуйте еще раз."
+    elif batch_size == 1:
+        text = f"✅ Файл сохранен. Загружено файлов: {total_count}"
+    else:
+        text = f"✅ Сохранено файлов: {saved_count} из {batch_size}. Загружено файлов: {total_count}"
+
+    for reason in rejected:
+        text += f"\n⚠️ {reason}"
+
+    if saved_count:
+        text += f"\n\n{hint}"
+    return text
+
+
+async def send_upload_summary(message, status_message, text, reply_markup=None):
+    """Итоговый ответ о загрузке: правка сообщения о прогрессе или новый ответ"""
+    if status_message:
+        await status_message.edit_text(text, reply_markup=reply_markup)
+    else:
+        await message.reply_text(text, reply_markup=reply_markup)
+
+
+def _build_zip(files):
+    # Создаем архив в памяти
+    zip_buffer = BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for file_path in files:
+            if Path(file_path).exists():
+                zip_file.write(file_path, Path(file_path).name)
+
+    zip_buffer.seek(0)
+    return zip_buffer
+
+
 async def create_zip_archive(files, archive_name="files.zip"):
     """Создание ZIP-архива из файлов"""
     try:
-        # Создаем архив в памяти
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for file_path in files:
-                if Path(file_path).exists():
-                    zip_file.write(file_path, Path(file_path).name)
-
-        zip_buffer.seek(0)
-        return zip_buffer
+        # Сжатие выполняется в пуле aiofs, чтобы не задерживать другие обновления
+        return await aiofs.run(_build_zip, files)
     except Exception as e:
         logger.error(f"Ошибка создания архива: {e}")
         return None
 
 
+async def upload_source(file_path):
+    """Файл для отправки: локальному серверу Bot API передается только путь, без загрузки
+
+    Иначе содержимое читается в пуле файловых операций: путь PTB открыл бы
+    и прочитал прямо в цикле событий.
+    """
+    if Config.BOT_API_LOCAL:
+        # as_uri кодирует %, # и ? в имени файла
+        return storage.server_path(file_path).as_uri()
+    return InputFile(await aiofs.read_bytes(file_path), filename=Path(file_path).name)
+
+
 async def send_files_as_archive(update, context, files, caption):
     """Отправка файлов в виде архива"""
     try:
@@ -112,13 +448,12 @@ async def send_files_as_archive(update, context, files, caption):
 
         # Если файл один или не удалось создать архив, отправляем по отдельности
         for file_path in files:
-            if Path(file_path).exists():
-                with open(file_path, 'rb') as file:
-                    await context.bot.send_document(
-                        chat_id=update.effective_chat.id,
-                        document=file,
-                        caption=caption if len(files) == 1 else None
-                    )
+            if await aiofs.exists(file_path):
+                await context.bot.send_document(
+                    chat_id=update.effective_chat.id,
+                    document=await upload_source(file_path),
+                    caption=caption if len(files) == 1 else None
+                )
         return True
     except Exception as e:
         logger.error(f"Ошибка отправки файлов: {e}")
@@ -190,7 +525,13 @@ def validate_plagiarism_percent(percent_str):
 
 
 def with_retry(max_retries=3, delay=1):
-    """Декоратор для повторных попыток выполнения функции"""
+    """Декоратор для повторных попыток выполнения функции
+
+    Паузы растут экспоненциально со случайной добавкой, RetryAfter выдерживается.
+    Ошибки запроса (BadRequest, Forbidden) и недоступный Bot API не повторяются.
+    Сами запросы к Bot API уже повторяются в bot_request, декоратор нужен для
+    составных операций.
+    """
 
     def decorator(func):
         @functools.wraps(func)
@@ -199,11 +540,16 @@ def with_retry(max_retries=3, delay=1):
             for attempt in range(max_retries):
                 try:
                     return await func(*args, **kwargs)
+                except (BadRequest, Forbidden, CircuitOpenError):
+                    raise
                 except Exception as e:
                     last_exception = e
                     logger.warning(f"Попытка {attempt + 1} из {max_retries} не удалась: {e}")
                     if attempt < max_retries - 1:
-                        await asyncio.sleep(delay * (attempt + 1))
+                        if isinstance(e, RetryAfter):
+                            await asyncio.sleep(float(e.retry_after))
+                        else:
+                            await asyncio.sleep(backoff_delay(attempt, delay))
             logger.error(f"Все {max_retries} попыток не удались: {last_exception}")
             raise last_exception
 
@@ -288,6 +634,11 @@ async def check_deadlines(context: CallbackContext):
 
 async def error_handler(update: object, context: CallbackContext) -> None:
     """Обработка ошибок"""
+    if isinstance(context.error, CircuitOpenError):
+        # Bot API недоступен: ни пользователю, ни администратору сообщить об ошибке не получится
+        logger.warning(f"Обновление не обработано, Bot API недоступен: {context.error}")
+        return
+
     logger.error("Exception while handling an update:", exc_info=context.error)
 
     # Отправляем сообщение об ошибке пользователю
@@ -332,39 +683,174 @@ def is_file_available(completed_at):
         return False
 
 
-async def cleanup_old_files(context: CallbackContext):
-    """Очистка файлов старше 30 дней"""
-    try:
-        from database import get_all_orders
+def _reclaimable_size(path):
+    """Объем, который освободится при удалении
 
-        orders = get_all_orders()
-        current_time = datetime.now()
+    Файлы, на которые есть другие жесткие ссылки (общее хранилище), не учитываются.
+    """
+    path = Path(path)
+    files = [path] if path.is_file() else [p for p in path.rglob('*') if p.is_file()]
+    total = 0
+    for file in files:
+        stat = file.stat()
+        if stat.st_nlink <= 1:
+            total += stat.st_size
+    return total
 
-        for order in orders:
-            if order['status'] == 'completed' and order.get('completed_at'):
-                try:
-                    completed_date = datetime.fromisoformat(order['completed_at'])
-                    days_passed = (current_time - completed_date).days
-
-                    if days_passed > 30:
-                        # Удаляем папку с выполненной работой
-                        completed_folder = create_order_folder(
-                            order['order_id'],
-                            order['user_id'],
-                            "completed"
-                        )
-
-                        if completed_folder and completed_folder.exists():
-                            shutil.rmtree(completed_folder)
-                            logger.info(f"Удалена папка с выполненной работой для заказа {order['order_id']}")
-
-                except ValueError:
+
+def _remove_paths(paths):
+    """Удаление папок и файлов: (удаленные пути, неудаленные пути, освобожденное место)"""
+    removed = []
+    failed = []
+    reclaimed = 0
+    for path in paths:
+        try:
+            if not path.exists():
+                continue
+            size = _reclaimable_size(path)
+            if path.is_dir():
+                shutil.rmtree(path)
+                # Ссылки на хранилище освобождаются только после удаления папки
+                storage.release_folder(path)
+            else:
+                path.unlink()
+            removed.append(path)
+            reclaimed += size
+        except Exception as e:
+            failed.append(path)
+            logger.error(f"Ошибка удаления {path}: {e}")
+    return removed, failed, reclaimed
+
+
+def _find_order_folders():
+    """Поиск папок заказов на диске: order_id -> [(путь, user_id, время изменения)]"""
+    folders = {}
+    for base in (Config.BASE_UPLOAD_FOLDER, Config.COMPLETED_FOLDER):
+        if not os.path.isdir(base):
+            continue
+        for user_dir in os.scandir(base):
+            if not user_dir.is_dir():
+                continue
+            user_id = int(user_dir.name) if user_dir.name.isdigit() else user_dir.name
+            for order_dir in os.scandir(user_dir.path):
+                if order_dir.is_dir():
+                    folders.setdefault(order_dir.name, []).append(
+                        (Path(order_dir.path), user_id, order_dir.stat().st_mtime)
+                    )
+    return folders
+
+
+def _find_old_files(folder, before):
+    """Поиск файлов в папке, измененных раньше указанного времени"""
+    if not os.path.isdir(folder):
+        return []
+    timestamp = before.timestamp()
+    return [Path(entry.path) for entry in os.scandir(folder)
+            if entry.is_file() and entry.stat().st_mtime < timestamp]
+
+
+async def cleanup_old_files(context: CallbackContext):
+    """Ежедневная очистка файлов
+
+    Удаляются готовые работы старше срока хранения, файлы давно отмененных
+    заказов, папки без заказа в базе (брошенные черновики), старые голосовые
+    сообщения и недокачанные файлы хранилища. Удаление идет пачками
+    в отдельном потоке, итог отправляется администратору.
+    """
+    try:
+        from database import (get_expired_completed_orders, get_stale_cancelled_orders, get_existing_order_ids,
+                              mark_orders_reaped)
+
+        now = datetime.now()
+        to_remove = []
+        released_orders = []
+
+        # Выполненные заказы: удаляем готовые работы
+        expired = get_expired_completed_orders(now - timedelta(days=Config.COMPLETED_RETENTION_DAYS))
+        for order in expired:
+            to_remove.append(get_order_folder(order['order_id'], order['user_id'], "completed"))
+
+        # Отмененные заказы: удаляем все файлы
+        cancelled = get_stale_cancelled_orders(now - timedelta(days=Config.CANCELLED_RETENTION_DAYS))
+        for order in cancelled:
+            to_remove.append(get_order_folder(order['order_id'], order['user_id'], "uploads"))
+            to_remove.append(get_order_folder(order['order_id'], order['user_id'], "completed"))
+            released_orders.append((order['order_id'], order['user_id']))
+
+        # Папки, для которых нет заказа в базе
+        orphans = 0
+        folders = await aiofs.run(_find_order_folders)
+        existing = get_existing_order_ids(folders.keys())
+        # При ошибке БД сироты не ищем, чтобы не удалить файлы существующих заказов
+        if existing is not None:
+            grace = (now - timedelta(hours=Config.ORPHAN_GRACE_HOURS)).timestamp()
+            for order_id, entries in folders.items():
+                if order_id in existing:
                     continue
+                for path, user_id, mtime in entries:
+                    if mtime < grace:
+                        to_remove.append(path)
+                        released_orders.append((order_id, user_id))
+                        orphans += 1
+
+        # Голосовые сообщения и недокачанные файлы хранилища
+        to_remove += await aiofs.run(
+            _find_old_files, "voices", now - timedelta(days=Config.VOICE_RETENTION_DAYS)
+        )
+        to_remove += await aiofs.run(
+            _find_old_files, Path(Config.BLOB_FOLDER) / "tmp", now - timedelta(days=1)
+        )
+
+        # Удаляем ограниченными пачками, не блокируя обработку обновлений
+        removed = 0
+        failed = set()
+        reclaimed = 0
+        for start in range(0, len(to_remove), Config.CLEANUP_BATCH_SIZE):
+            batch = to_remove[start:start + Config.CLEANUP_BATCH_SIZE]
+            batch_removed, batch_failed, batch_reclaimed = await aiofs.run(_remove_paths, batch)
+            removed += len(batch_removed)
+            failed.update(batch_failed)
+            reclaimed += batch_reclaimed
+
+        for order_id, user_id in released_orders:
+            release_order_storage(order_id, user_id)
+
+        # Файлы этих заказов удалены (или их не было): следующие запуски их больше не просматривают.
+        # Заказ с неудаленной папкой не отмечается и будет удален при следующем запуске
+        reaped = [order['order_id'] for order in expired + cancelled
+                  if not any(get_order_folder(order['order_id'], order['user_id'], folder_type) in failed
+                             for folder_type in ("uploads", "completed"))]
+        mark_orders_reaped(reaped)
+
+        logger.info(f"Очистка файлов: удалено {removed}, папок без заказа {orphans}, "
+                    f"освобождено {format_file_size(reclaimed)}")
+
+        if removed:
+            await context.bot.send_message(
+                chat_id=Config.ADMIN_ID,
+                text=(
+                    f"🧹 Очистка файлов завершена\n\n"
+                    f"Удалено папок и файлов: {removed}\n"
+                    f"Из них без заказа в базе: {orphans}\n"
+                    f"Освобождено: {format_file_size(reclaimed)}"
+                )
+            )
 
     except Exception as e:
         logger.error(f"Ошибка при очистке старых файлов: {e}")
 
 
+def _backup_database(source, destination):
+    """Согласованная копия базы средствами SQLite (с учетом еще не перенесенного журнала WAL)"""
+    source_conn = sqlite3.connect(source)
+    destination_conn = sqlite3.connect(destination)
+    try:
+        source_conn.backup(destination_conn)
+    finally:
+        destination_conn.close()
+        source_conn.close()
+
+
 async def create_backup(context: CallbackContext):
     """Создание резервной копии базы данных"""
     try:
@@ -374,20 +860,19 @@ async def create_backup(context: CallbackContext):
             return
 
         backup_dir = Path("backups")
-        backup_dir.mkdir(exist_ok=True)
+        await aiofs.mkdir(backup_dir)
 
         # Создаем имя файла с датой
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         backup_file = backup_dir / f"backup_{timestamp}.db"
 
-        # Копируем базу данных
-        import shutil
-        shutil.copy2(Config.DB_NAME, backup_file)
+        # Копируем базу данных (копия файла в режиме WAL могла бы не содержать последних записей)
+        await aiofs.run(_backup_database, Config.DB_NAME, backup_file)
 
         # Удаляем старые резервные копии (оставляем последние 7)
-        backup_files = sorted(backup_dir.glob("backup_*.db"), key=os.path.getmtime)
+        backup_files = await aiofs.sorted_by_mtime(await aiofs.list_files(backup_dir, "backup_*.db"))
         for old_backup in backup_files[:-7]:
-            old_backup.unlink()
+            await aiofs.unlink(old_backup)
 
         logger.info(f"Создана резервная копия: {backup_file}")
 
@@ -441,7 +926,11 @@ def format_order_details(order):
 
 def get_file_size(file_path):
     """Получение размера файла в читаемом формате"""
-    size = os.path.getsize(file_path)
+    return format_file_size(os.path.getsize(file_path))
+
+
+def format_file_size(size):
+    """Форматирование размера в байтах в читаемый вид"""
     for unit in ['B', 'KB', 'MB', 'GB']:
         if size < 1024.0:
             return f"{size:.2f} {unit}"
@@ -471,19 +960,22 @@ def format_timedelta(td):
         return f"{seconds} сек."
 
 
-def delete_order_files(order_id, user_id):
+async def delete_order_folder(folder):
+    """Удаление папки заказа с освобождением ссылок на хранилище"""
+    if not await aiofs.is_dir(folder):
+        return False
+    await aiofs.run(storage.release_folder, folder)
+    return await aiofs.rmtree(folder)
+
+
+async def delete_order_files(order_id, user_id, folder_types=("uploads", "completed")):
     """Полное удаление всех файлов заказа"""
     try:
-        # Удаляем папку с загруженными файлами
-        upload_folder = create_order_folder(order_id, user_id, "uploads")
-        if upload_folder and upload_folder.exists():
-            shutil.rmtree(upload_folder)
-
-        # Удаляем папку с выполненной работой
-        completed_folder = create_order_folder(order_id, user_id, "completed")
-        if completed_folder and completed_folder.exists():
-            shutil.rmtree(completed_folder)
+        # Удаляем папки с загруженными файлами и выполненной работой
+        for folder_type in folder_types:
+            await delete_order_folder(get_order_folder(order_id, user_id, folder_type))
 
+        release_order_storage(order_id, user_id)
         logger.info(f"Файлы заказа #{order_id} полностью удалены")
         return True
     except Exception as e: